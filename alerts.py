@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import time
+from config import ADMIN_USER_ID, LOW_STOCK_ALERT_DELAY, LOW_STOCK_ALERT_COOLDOWN
+from send_queue import send_queue
+
+logger = logging.getLogger(__name__)
+
+class LowStockAlerts:
+    """Отслеживает пересечение порога min_stock и шлет администратору дайджест"""
+
+    def __init__(self, delay: int = LOW_STOCK_ALERT_DELAY, cooldown: int = LOW_STOCK_ALERT_COOLDOWN):
+        self.delay = delay
+        self.cooldown = cooldown
+        self._pending = {}  # part_id -> данные для дайджеста
+        self._last_alerted = {}  # part_id -> время последнего оповещения
+        self._flush_handle = None
+
+    def note_change(self, part, new_quantity: int, new_min_stock: int = None):
+        """Вызывается после изменения остатка или порога запчасти.
+
+        part - строка или словарь с прежними значениями (id, name, part_number,
+        quantity, unit, min_stock). Таблицу целиком не читаем.
+        """
+        part_id = part['id']
+        old_min_stock = part['min_stock']
+        min_stock = old_min_stock if new_min_stock is None else new_min_stock
+
+        if new_quantity > min_stock:
+            # Остаток восстановился до отправки дайджеста - оповещать не о чем
+            self._pending.pop(part_id, None)
+            return
+
+        if part_id in self._pending:
+            self._pending[part_id].update(quantity=new_quantity, min_stock=min_stock)
+            return
+
+        if part['quantity'] <= old_min_stock:
+            # Порог был пересечен раньше
+            return
+
+        last = self._last_alerted.get(part_id)
+        if last is not None and time.monotonic() - last < self.cooldown:
+            return
+
+        self._pending[part_id] = {
+            'name': part['name'],
+            'part_number': part['part_number'],
+            'unit': part['unit'],
+            'quantity': new_quantity,
+            'min_stock': min_stock,
+        }
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.delay, self.flush)
+
+    def flush(self):
+        """Отправляет накопленный дайджест администратору"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+
+        now = time.monotonic()
+        message = "⚠️ Критический остаток:\n\n"
+        for part_id, part in sorted(self._pending.items(), key=lambda item: item[1]['quantity']):
+            message += f"{part['name']} ({part['part_number']}): {part['quantity']}/{part['min_stock']} {part['unit']}\n"
+            self._last_alerted[part_id] = now
+        self._pending.clear()
+
+        if send_queue.running:
+            send_queue.enqueue(ADMIN_USER_ID, message)
+        else:
+            logger.warning("Очередь отправки не запущена, дайджест не отправлен:\n%s", message)
+
+# Общий сборщик оповещений бота
+low_stock_alerts = LowStockAlerts()
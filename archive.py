@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+from database import get_db_connection, adjust_count, TRANSACTION_COLUMNS, ARCHIVE_COUNT
+
+logger = logging.getLogger(__name__)
+
+# Пауза между пачками, чтобы обработчики успевали писать в базу
+ARCHIVE_BATCH_PAUSE = 0.05
+
+# Транзакций удаленной запчасти за одну пачку (id передаются параметрами запроса)
+PURGE_BATCH_SIZE = 500
+
+def archive_transactions_batch(cutoff: str, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Переносит в архив одну пачку транзакций старше cutoff.
+
+    Каждая пачка - отдельная короткая транзакция, блокировка на запись
+    держится только на время переноса batch_size строк.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Самые старые строки берутся по индексу created_at (в нем есть и id),
+    # а не проходом по всей таблице в порядке id до первых старых строк
+    cursor.execute(
+        'SELECT MAX(id) FROM (SELECT id FROM main.transactions WHERE created_at < ? ORDER BY created_at, id LIMIT ?)',
+        (cutoff, batch_size)
+    )
+    max_id = cursor.fetchone()[0]
+    if max_id is None:
+        return 0
+
+    try:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO archive.transactions ({TRANSACTION_COLUMNS}) '
+            f'SELECT {TRANSACTION_COLUMNS} FROM main.transactions WHERE id <= ? AND created_at < ?',
+            (max_id, cutoff)
+        )
+        cursor.execute('DELETE FROM main.transactions WHERE id <= ? AND created_at < ?', (max_id, cutoff))
+        moved = cursor.rowcount
+        # Счетчик transactions уменьшил триггер на DELETE, архивный ведем сами
+        adjust_count(cursor, ARCHIVE_COUNT, moved)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return moved
+
+async def archive_old_transactions(after_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    """Переносит транзакции старше after_days дней в архивную БД пачками"""
+    # created_at заполняется CURRENT_TIMESTAMP, то есть в UTC
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=after_days)).strftime('%Y-%m-%d %H:%M:%S')
+    total = 0
+    while True:
+        moved = archive_transactions_batch(cutoff)
+        if not moved:
+            break
+        total += moved
+        await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+
+    if total:
+        logger.info("В архив перенесено транзакций: %s (старше %s)", total, cutoff)
+    return total
+
+def purge_part_batch(part_id: int, batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """Переносит в архив одну пачку транзакций удаленной запчасти.
+
+    Строка самой запчасти остается (с deleted_at), чтобы архивная
+    история показывала наименование и код.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM main.transactions WHERE part_id = ? LIMIT ?', (part_id, batch_size))
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        return 0
+
+    placeholders = ','.join('?' * len(ids))
+    try:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO archive.transactions ({TRANSACTION_COLUMNS}) '
+            f'SELECT {TRANSACTION_COLUMNS} FROM main.transactions WHERE id IN ({placeholders})',
+            ids
+        )
+        cursor.execute(f'DELETE FROM main.transactions WHERE id IN ({placeholders})', ids)
+        moved = cursor.rowcount
+        adjust_count(cursor, ARCHIVE_COUNT, moved)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return moved
+
+async def purge_deleted_parts(batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """Переносит в архив историю удаленных запчастей короткими пачками.
+
+    Удаление в боте только ставит deleted_at, а долгий перенос истории
+    идет здесь, по расписанию, с паузой между пачками.
+    """
+    cursor = get_db_connection().cursor()
+    cursor.execute('''
+    SELECT id FROM parts
+    WHERE deleted_at IS NOT NULL AND EXISTS (SELECT 1 FROM main.transactions t WHERE t.part_id = parts.id)
+    ''')
+    part_ids = [row[0] for row in cursor.fetchall()]
+
+    total = 0
+    for part_id in part_ids:
+        while True:
+            moved = purge_part_batch(part_id, batch_size)
+            total += moved
+            await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+            if moved < batch_size:
+                break
+        # Прогноз по удаленной запчасти больше не нужен
+        conn = get_db_connection()
+        conn.execute('DELETE FROM reorder_points WHERE part_id = ?', (part_id,))
+        conn.commit()
+
+    if part_ids:
+        logger.info("История удаленных запчастей перенесена в архив: %s запчастей, %s транзакций", len(part_ids), total)
+    return total
@@ -1,12 +1,14 @@
-import sqlite3
 import logging
-from config import ALLOWED_USERS, ADMIN_USER_ID
+import time
+from collections import OrderedDict
+from config import ALLOWED_USERS, ADMIN_USER_ID, UNAUTHORIZED_REPLY_TTL
+from database import get_db_connection
 
 logger = logging.getLogger(__name__)
 
 def init_auth_db():
-    """Инициализация таблицы пользователей"""
-    conn = sqlite3.connect('parts.db', check_same_thread=False)
+    """Инициализация таблицы пользователей (вызывается при запуске бота из SqliteStorage.init)"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -28,7 +30,6 @@ def init_auth_db():
         )
     
     conn.commit()
-    return conn
 
 def is_user_allowed(user_id: int) -> bool:
     """Проверяет, есть ли пользователь в списке разрешенных"""
@@ -42,5 +43,43 @@ def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором"""
     return user_id == ADMIN_USER_ID
 
-# Инициализируем базу при импорте
-init_auth_db()
+class UnauthorizedSenders:
+    """Отрицательный кэш неразрешенных отправителей.
+
+    Первому сообщению отправителя отвечаем отказом, следующие в течение
+    ttl секунд отбрасываем молча: без ответа, записи в лог и обработчиков.
+    Отправители хранятся в порядке времени ответа, поэтому устаревшие
+    удаляются с начала, а при наплыве новых id кэш не растет больше max_senders.
+    """
+
+    def __init__(self, ttl: int = UNAUTHORIZED_REPLY_TTL, max_senders: int = 10000):
+        self.ttl = ttl
+        self.max_senders = max_senders
+        self._replied = OrderedDict()  # user_id -> время ответа (monotonic)
+        self.rejected = 0
+        self.replied = 0
+
+    def should_reply(self, user_id: int) -> bool:
+        """Учитывает отклоненное обновление; True, если отправителю пора ответить"""
+        self.rejected += 1
+        now = time.monotonic()
+        while self._replied and now - next(iter(self._replied.values())) >= self.ttl:
+            self._replied.popitem(last=False)
+        if user_id in self._replied:
+            return False
+        self._replied[user_id] = now
+        if len(self._replied) > self.max_senders:
+            self._replied.popitem(last=False)
+        self.replied += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'rejected': self.rejected,
+            'replied': self.replied,
+            'dropped': self.rejected - self.replied,
+            'cached_senders': len(self._replied),
+        }
+
+# Общий кэш бота
+unauthorized_senders = UnauthorizedSenders()
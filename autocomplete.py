@@ -0,0 +1,108 @@
+import logging
+import time
+from bisect import bisect_left, insort
+from functools import lru_cache
+from fuzzy import normalize_part_number
+
+logger = logging.getLogger(__name__)
+
+# Слова наименований сильно повторяются, нормализуем каждое один раз
+_normalize_word = lru_cache(maxsize=65536)(normalize_part_number)
+
+def _tokens(name: str, part_number: str) -> set:
+    """Ключи запчасти: канонический код и слова наименования"""
+    tokens = {_normalize_word(word) for word in name.split()}
+    tokens.add(normalize_part_number(part_number))
+    tokens.discard('')
+    return tokens
+
+class PartPrefixIndex:
+    """Отсортированный индекс префиксов по кодам и словам наименований.
+
+    Ключи хранятся одним отсортированным списком пар (ключ, id), поэтому
+    все ключи с нужным префиксом лежат подряд и находятся двумя bisect.
+    Для запроса из нескольких слов перебирается самый узкий диапазон,
+    а остальные слова проверяются по ключам найденных запчастей.
+    """
+
+    # Сколько ключей просматривать за запрос: при редко совпадающих словах
+    # лучше вернуть неполный ответ, чем задержать автодополнение
+    SCAN_LIMIT = 3000
+
+    def __init__(self):
+        self._keys = []  # отсортированные пары (ключ, id запчасти)
+        self._parts = {}  # id -> (наименование, код, единица, ключи)
+
+    def load(self, parts):
+        """Строит индекс по всем запчастям из хранилища (при запуске бота)"""
+        started = time.perf_counter()
+        self._parts = {}
+        keys = []
+        for part in parts:
+            tokens = _tokens(part.name, part.part_number)
+            self._parts[part.id] = (part.name, part.part_number, part.unit, tokens)
+            keys.extend((token, part.id) for token in tokens)
+        keys.sort()
+        self._keys = keys
+        logger.info("Индекс автодополнения построен: %s ключей за %.2f с", len(self._keys), time.perf_counter() - started)
+
+    def add(self, part_id: int, name: str, part_number: str, unit: str):
+        self.remove(part_id)
+        tokens = _tokens(name, part_number)
+        self._parts[part_id] = (name, part_number, unit, tokens)
+        for token in tokens:
+            insort(self._keys, (token, part_id))
+
+    def remove(self, part_id: int):
+        part = self._parts.pop(part_id, None)
+        if part is None:
+            return
+        for token in part[3]:
+            position = bisect_left(self._keys, (token, part_id))
+            if position < len(self._keys) and self._keys[position] == (token, part_id):
+                del self._keys[position]
+
+    def _prefix_range(self, prefix: str):
+        # Все ключи, начинающиеся с prefix, меньше prefix + '\uffff'
+        return bisect_left(self._keys, (prefix,)), bisect_left(self._keys, (prefix + '\uffff',))
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """Запчасти, у которых каждое слово запроса - префикс кода или слова наименования.
+
+        Возвращает список (id, наименование, код, единица).
+        """
+        prefixes = [token for token in map(normalize_part_number, query.split()) if token]
+        if not prefixes:
+            return []
+
+        found = []
+        seen = set()
+
+        def collect(start, end, others):
+            """Добавляет запчасти из диапазона ключей; True, если набрано limit"""
+            for position in range(start, min(end, start + self.SCAN_LIMIT)):
+                part_id = self._keys[position][1]
+                if part_id in seen:
+                    continue
+                tokens = self._parts[part_id][3]
+                if all(any(token.startswith(other) for token in tokens) for other in others):
+                    seen.add(part_id)
+                    found.append(part_id)
+                    if len(found) >= limit:
+                        return True
+            return False
+
+        # Запрос вида "6305 2rs" - это код с разделителем
+        if len(prefixes) > 1 and collect(*self._prefix_range(''.join(prefixes)), []):
+            return self._results(found)
+
+        ranges = [self._prefix_range(prefix) for prefix in prefixes]
+        narrowest = min(range(len(prefixes)), key=lambda i: ranges[i][1] - ranges[i][0])
+        collect(*ranges[narrowest], prefixes[:narrowest] + prefixes[narrowest + 1:])
+        return self._results(found)
+
+    def _results(self, found: list) -> list:
+        return [(part_id, *self._parts[part_id][:3]) for part_id in found]
+
+# Общий индекс бота
+part_prefix_index = PartPrefixIndex()
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+from config import RENDER_CACHE_SIZE
+
+# Версия данных склада: увеличивается при каждом изменении запчастей, остатков или цен.
+# Кэши сравнивают сохраненную версию с текущей вместо явной инвалидации.
+_data_version = 0
+
+def bump_data_version():
+    """Отмечает, что данные склада изменились"""
+    global _data_version
+    _data_version += 1
+
+def get_data_version() -> int:
+    return _data_version
+
+class RenderCache:
+    """LRU-кэш готовых экранов бота.
+
+    Версия данных входит в ключ, поэтому после изменения склада старые
+    записи больше не находятся и со временем вытесняются как самые давние.
+    """
+
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: tuple, render):
+        """Возвращает экран по ключу (вид, параметры) или строит его вызовом render()"""
+        key = (*key, _data_version)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        self.misses += 1
+        value = render()
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+# Общий кэш экранов
+render_cache = RenderCache()
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from config import CHANGELOG_FEED_PATH, CHANGELOG_POLL_INTERVAL, CHANGELOG_KEEP_DAYS
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Сколько изменений читать за один запрос
+CHANGELOG_BATCH_SIZE = 500
+
+# Имя курсора файловой ленты в changelog_cursors
+FEED_CURSOR = 'feed'
+
+def read_changes(after_seq: int, limit: int = CHANGELOG_BATCH_SIZE) -> list:
+    """Изменения с номером больше after_seq по возрастанию seq.
+
+    Строка: seq, tbl ('parts' / 'transactions'), op ('I' / 'U' / 'D'),
+    row_id, changed_at (UTC). Перенос транзакций в архив тоже выглядит
+    как удаление из transactions, а удаление запчасти - как правка parts
+    (заполняется deleted_at).
+    """
+    cursor = get_db_connection().cursor()
+    cursor.execute(
+        'SELECT seq, tbl, op, row_id, changed_at FROM changelog WHERE seq > ? ORDER BY seq LIMIT ?',
+        (after_seq, limit)
+    )
+    return cursor.fetchall()
+
+def last_seq() -> int:
+    """Номер последнего изменения (0, если журнал пуст)"""
+    cursor = get_db_connection().cursor()
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def get_cursor(name: str):
+    cursor = get_db_connection().cursor()
+    cursor.execute('SELECT seq FROM changelog_cursors WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def save_cursor(name: str, seq: int):
+    """Запоминает, до какого изменения дочитал постоянный подписчик"""
+    conn = get_db_connection()
+    conn.execute(
+        'INSERT INTO changelog_cursors (name, seq) VALUES (?, ?) '
+        'ON CONFLICT(name) DO UPDATE SET seq = excluded.seq',
+        (name, seq)
+    )
+    conn.commit()
+
+def change_to_dict(row) -> dict:
+    return {
+        'seq': row['seq'],
+        'table': row['tbl'],
+        'op': row['op'],
+        'row_id': row['row_id'],
+        'changed_at': row['changed_at'],
+    }
+
+async def subscribe(after_seq: int = None, poll_interval: float = CHANGELOG_POLL_INTERVAL):
+    """Асинхронный итератор по изменениям.
+
+    Без after_seq начинает с изменений, появившихся после вызова.
+    Пока есть непрочитанные изменения, они читаются пачками подряд,
+    иначе журнал опрашивается раз в poll_interval секунд (запрос по
+    первичному ключу, без чтения таблиц целиком).
+
+        async for change in subscribe(seq):
+            ...
+    """
+    if after_seq is None:
+        after_seq = last_seq()
+    while True:
+        rows = read_changes(after_seq)
+        for row in rows:
+            after_seq = row['seq']
+            yield change_to_dict(row)
+        if len(rows) < CHANGELOG_BATCH_SIZE:
+            await asyncio.sleep(poll_interval)
+
+class ChangelogFeed:
+    """Дописывает журнал изменений в файл JSON lines для внешних утилит (tail -f).
+
+    Позиция хранится в changelog_cursors, после перезапуска лента
+    продолжается с места остановки. Запись строк и сохранение позиции
+    не атомарны: после сбоя последняя пачка может повториться,
+    поэтому читателям стоит пропускать seq, которые они уже видели.
+    """
+
+    def __init__(self, path: str = CHANGELOG_FEED_PATH):
+        self.path = path
+        self._worker = None
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        if not self.path:
+            return
+        self._worker = asyncio.get_running_loop().create_task(self._run(), name='changelog_feed')
+        logger.info("Лента изменений пишется в %s", self.path)
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def _run(self):
+        seq = get_cursor(FEED_CURSOR)
+        if seq is None:
+            seq = last_seq()
+        while True:
+            rows = read_changes(seq)
+            if rows:
+                try:
+                    self._write([change_to_dict(row) for row in rows])
+                except OSError as e:
+                    logger.error("Ошибка записи ленты изменений %s: %s", self.path, e)
+                    await asyncio.sleep(CHANGELOG_POLL_INTERVAL)
+                    continue
+                seq = rows[-1]['seq']
+                save_cursor(FEED_CURSOR, seq)
+            if len(rows) < CHANGELOG_BATCH_SIZE:
+                await asyncio.sleep(CHANGELOG_POLL_INTERVAL)
+
+    def _write(self, changes: list):
+        with open(self.path, 'a', encoding='utf-8') as feed:
+            for change in changes:
+                feed.write(json.dumps(change, ensure_ascii=False) + '\n')
+
+async def prune_changelog(keep_days: int = CHANGELOG_KEEP_DAYS):
+    """Удаляет старые записи журнала, не трогая непрочитанные постоянными подписчиками"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute('SELECT MIN(seq) FROM changelog_cursors')
+    keep_from = cursor.fetchone()[0]
+    total = 0
+    while True:
+        cursor.execute(
+            'DELETE FROM changelog WHERE seq IN ('
+            'SELECT seq FROM changelog WHERE changed_at < ? AND seq <= COALESCE(?, seq) ORDER BY seq LIMIT ?)',
+            (cutoff, keep_from, CHANGELOG_BATCH_SIZE)
+        )
+        deleted = cursor.rowcount
+        conn.commit()
+        total += deleted
+        if deleted < CHANGELOG_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)
+
+    if total:
+        logger.info("Удалено старых записей журнала изменений: %s", total)
+
+# Файловая лента бота
+changelog_feed = ChangelogFeed()
@@ -7,6 +7,11 @@ load_dotenv()
 # Получаем токен бота
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+# Логи: json (по строке JSON на запись) или text; пустой LOG_FILE - вывод в stderr
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_FILE = os.getenv('LOG_FILE', '')
+
 # ID администратора (замените на ваш реальный ID)
 ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID', '123456789'))
 
@@ -19,8 +24,84 @@ ALLOWED_USERS = {uid: f"Пользователь_{uid}" for uid in ALLOWED_USER_
 if ADMIN_USER_ID:
     ALLOWED_USERS[ADMIN_USER_ID] = "Администратор"
 
+# Неразрешенным пользователям отвечаем не чаще раза в столько секунд, остальное молча отбрасываем
+UNAUTHORIZED_REPLY_TTL = int(os.getenv('UNAUTHORIZED_REPLY_TTL', '3600'))
+
 # Настройки пагинации
 ITEMS_PER_PAGE = 10
 
-if not BOT_TOKEN:
-    raise ValueError("Не найден BOT_TOKEN в переменных окружения")
+# Хранилище данных: sqlite (рабочее) или memory (тесты и замеры, без записи на диск)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+
+# Сколько готовых экранов (страницы остатков, отчеты) держать в кэше
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '256'))
+
+# Копия таблицы parts в памяти для остатков, поиска и отчетов по всем складам
+PARTS_MIRROR = os.getenv('PARTS_MIRROR', '0') == '1'
+
+# Склад по умолчанию для операций без явного указания места
+DEFAULT_LOCATION = os.getenv('DEFAULT_LOCATION', 'склад')
+
+# Настройки очереди исходящих сообщений (лимиты Telegram)
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '25'))  # сообщений в секунду на весь бот
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))  # сообщений в секунду в один чат
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', '3'))  # сколько сообщений можно отправить в чат подряд
+
+# Оповещения о критическом остатке
+LOW_STOCK_ALERT_DELAY = int(os.getenv('LOW_STOCK_ALERT_DELAY', '60'))  # секунд на сбор дайджеста
+LOW_STOCK_ALERT_COOLDOWN = int(os.getenv('LOW_STOCK_ALERT_COOLDOWN', '21600'))  # не чаще раза в 6 часов на позицию
+
+# Расписание резервного копирования (окно в местном времени, ЧЧ:ММ-ЧЧ:ММ)
+BACKUP_WINDOW = os.getenv('BACKUP_WINDOW', '02:00-05:00')
+BACKUP_INTERVAL_HOURS = int(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+BACKUP_JITTER_MINUTES = int(os.getenv('BACKUP_JITTER_MINUTES', '30'))
+
+# Хранение бэкапов: сколько последних дневных, недельных и месячных копий оставлять
+BACKUP_KEEP_DAILY = int(os.getenv('BACKUP_KEEP_DAILY', '7'))
+BACKUP_KEEP_WEEKLY = int(os.getenv('BACKUP_KEEP_WEEKLY', '4'))
+BACKUP_KEEP_MONTHLY = int(os.getenv('BACKUP_KEEP_MONTHLY', '12'))
+
+# Архив старых транзакций (отдельный файл SQLite, подключается через ATTACH)
+ARCHIVE_DB_PATH = os.getenv('ARCHIVE_DB_PATH', 'parts_archive.db')
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_WINDOW = os.getenv('ARCHIVE_WINDOW', '01:00-02:00')
+
+# Ежедневные снимки остатков для запросов "остаток на дату"
+SNAPSHOT_WINDOW = os.getenv('SNAPSHOT_WINDOW', '00:00-01:00')
+SNAPSHOT_KEEP_DAYS = int(os.getenv('SNAPSHOT_KEEP_DAYS', '62'))  # старше храним только первый снимок месяца
+
+# Ночная сверка остатков с журналом транзакций
+RECONCILE_WINDOW = os.getenv('RECONCILE_WINDOW', '05:00-06:00')
+RECONCILE_AUTOFIX = os.getenv('RECONCILE_AUTOFIX', '0') == '1'  # исправлять расхождения автоматически
+
+# Прогноз расхода и точки заказа (нужен NumPy; без него отчет строится только по min_stock)
+FORECAST_WINDOW = os.getenv('FORECAST_WINDOW', '06:00-07:00')
+FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', '90'))  # окно скользящего среднего расхода
+FORECAST_LEAD_TIME_DAYS = int(os.getenv('FORECAST_LEAD_TIME_DAYS', '14'))  # срок поставки
+FORECAST_SERVICE_Z = float(os.getenv('FORECAST_SERVICE_Z', '1.65'))  # страховой запас: 1.65 - уровень сервиса 95%
+
+# Заказ поставщикам: на сколько дней расхода сверх точки заказа заказывать
+ORDER_COVER_DAYS = int(os.getenv('ORDER_COVER_DAYS', '30'))
+
+# Сколько дней помнить update_id проведенных движений (защита от повторной обработки)
+DEDUP_KEEP_DAYS = int(os.getenv('DEDUP_KEEP_DAYS', '7'))
+
+# Журнал изменений parts и transactions для внешних подписчиков
+CHANGELOG_FEED_PATH = os.getenv('CHANGELOG_FEED_PATH', '')  # JSON lines для tail -f; пусто - не писать
+CHANGELOG_POLL_INTERVAL = float(os.getenv('CHANGELOG_POLL_INTERVAL', '1'))  # секунд между проверками
+CHANGELOG_KEEP_DAYS = int(os.getenv('CHANGELOG_KEEP_DAYS', '30'))
+
+# Inline-режим (@бот код)
+INLINE_RESULTS_LIMIT = int(os.getenv('INLINE_RESULTS_LIMIT', '20'))
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '10'))  # секунд кэша ответа на стороне Telegram
+
+# Локальный HTTP-эндпоинт проверки состояния (/live, /ready, /stats); порт 0 - выключен
+HEALTH_HOST = os.getenv('HEALTH_HOST', '127.0.0.1')
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '8080'))
+HEALTH_REFRESH_INTERVAL = float(os.getenv('HEALTH_REFRESH_INTERVAL', '15'))  # секунд между замерами БД
+
+def validate_config():
+    """Проверка обязательных настроек (вызывается при запуске бота, а не при импорте)"""
+    if not BOT_TOKEN:
+        raise ValueError("Не найден BOT_TOKEN в переменных окружения")
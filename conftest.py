@@ -0,0 +1,30 @@
+import pytest
+import database
+import storage
+from storage import SqliteStorage, MemoryStorage
+
+@pytest.fixture
+def sqlite_storage(tmp_path, monkeypatch):
+    """Рабочее хранилище на временной parts.db и архиве в tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, 'ARCHIVE_DB_PATH', str(tmp_path / 'parts_archive.db'))
+    database.close_db()
+    sqlite = SqliteStorage()
+    sqlite.init()
+    yield sqlite
+    database.close_db()
+
+@pytest.fixture
+def memory_storage():
+    return MemoryStorage()
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def any_storage(request):
+    """Каждый тест с этой фикстурой проходит на обоих хранилищах"""
+    return request.getfixturevalue(f'{request.param}_storage')
+
+@pytest.fixture
+def bot_storage(any_storage, monkeypatch):
+    """Хранилище, которое видят обработчики через get_storage()"""
+    monkeypatch.setattr(storage, '_storage', any_storage)
+    return any_storage
@@ -1,47 +1,134 @@
 import sqlite3
 import logging
-import shutil
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from threading import local
-from threading import Timer
-import threading
+from fuzzy import normalize_part_number
+from config import BACKUP_KEEP_DAILY, BACKUP_KEEP_WEEKLY, BACKUP_KEEP_MONTHLY, ARCHIVE_DB_PATH, DEFAULT_LOCATION, DEDUP_KEEP_DAYS
 
 logger = logging.getLogger(__name__)
 
 # Используем ThreadLocal для безопасного доступа к БД в многопоточности
 thread_local = local()
 
-# Глобальная переменная для таймера бэкапов
-backup_timer = None
+# Колонки таблицы транзакций в порядке объявления (одинаковы в основной и архивной БД)
+TRANSACTION_COLUMNS = 'id, part_id, type, quantity, document_number, comment, created_at, location'
+
+# Изменение общего остатка, которое вносит транзакция (перемещения его не меняют)
+SIGNED_QUANTITY = "CASE type WHEN 'incoming' THEN quantity WHEN 'outgoing' THEN -quantity ELSE 0 END"
+
+# Счетчик строк архива ведут пути записи: триггеры основной БД не видят присоединенную
+ARCHIVE_COUNT = 'archive.transactions'
+
+# Номер последней транзакции в горячей и архивной БД
+LAST_TRANSACTION_ID = '''
+SELECT COALESCE(MAX(id), 0) FROM (
+    SELECT MAX(id) AS id FROM main.transactions
+    UNION ALL
+    SELECT MAX(id) FROM archive.transactions
+)
+'''
+
+class DuplicateUpdate(Exception):
+    """Обновление Telegram с этим update_id уже изменило остатки"""
+
+# Определение таблицы запчастей (name - для пересборки в rebuild_parts_table)
+PARTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    part_number TEXT NOT NULL,
+    quantity INTEGER DEFAULT 0,
+    unit TEXT DEFAULT 'шт.',
+    price REAL DEFAULT 0.0,
+    location TEXT DEFAULT 'склад',
+    min_stock INTEGER DEFAULT 5,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    part_number_norm TEXT,
+    supplier TEXT,
+    pack_size INTEGER DEFAULT 1,
+    deleted_at TIMESTAMP
+)
+'''
 
 def get_db_connection():
     """Возвращает соединение с БД для текущего потока"""
     if not hasattr(thread_local, 'conn'):
         thread_local.conn = sqlite3.connect('parts.db', check_same_thread=False)
         thread_local.conn.row_factory = sqlite3.Row
+        attach_archive(thread_local.conn)
     return thread_local.conn
 
+def attach_archive(conn):
+    """Подключает архив транзакций и представление all_transactions (горячие + архивные)"""
+    conn.execute('ATTACH DATABASE ? AS archive', (ARCHIVE_DB_PATH,))
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS archive.transactions (
+        id INTEGER PRIMARY KEY,
+        part_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        document_number TEXT,
+        comment TEXT,
+        created_at TIMESTAMP,
+        location TEXT
+    )
+    ''')
+    add_column_if_missing(conn, 'archive.transactions', 'location', 'TEXT')
+    # История запчасти листается по (created_at, id) от новых к старым (history.py)
+    conn.execute('DROP INDEX IF EXISTS archive.idx_archive_transactions_part_id')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS archive.idx_archive_transactions_part_created '
+        'ON transactions (part_id, created_at DESC, id DESC)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_transactions_created_at ON transactions (created_at)')
+    # Временное представление живет в рамках соединения и может ссылаться на обе БД
+    conn.execute(f'''
+    CREATE TEMP VIEW IF NOT EXISTS all_transactions AS
+    SELECT {TRANSACTION_COLUMNS} FROM main.transactions
+    UNION ALL
+    SELECT {TRANSACTION_COLUMNS} FROM archive.transactions
+    ''')
+    conn.commit()
+
 def init_db():
     """Инициализация базы данных"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # Таблица запчастей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS parts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        part_number TEXT NOT NULL UNIQUE,
-        quantity INTEGER DEFAULT 0,
-        unit TEXT DEFAULT 'шт.',
-        price REAL DEFAULT 0.0,
-        location TEXT DEFAULT 'склад',
-        min_stock INTEGER DEFAULT 5,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    cursor.execute(PARTS_TABLE.format(name='parts'))
+    # Канонический код для поиска без учета регистра, раскладки и разделителей
+    add_column_if_missing(conn, 'parts', 'part_number_norm', 'TEXT')
+    cursor.execute('SELECT id, part_number FROM parts WHERE part_number_norm IS NULL')
+    cursor.executemany(
+        'UPDATE parts SET part_number_norm = ? WHERE id = ?',
+        [(normalize_part_number(part_number), part_id) for part_id, part_number in cursor.fetchall()]
     )
-    ''')
+    # Поставщик и кратность упаковки для заказов (purchase_orders.py)
+    add_column_if_missing(conn, 'parts', 'supplier', 'TEXT')
+    add_column_if_missing(conn, 'parts', 'pack_size', 'INTEGER DEFAULT 1')
+    # Мягкое удаление: строка остается для истории, читается через live_parts
+    add_column_if_missing(conn, 'parts', 'deleted_at', 'TIMESTAMP')
+    rebuild_parts_table(conn)
+    # Индексы покрывают только неудаленные запчасти; код уникален среди них же,
+    # поэтому удаленный код можно завести заново
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_parts_part_number ON parts (part_number) WHERE deleted_at IS NULL')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_parts_part_number_norm ON parts (part_number_norm) WHERE deleted_at IS NULL'
+    )
+    # Листание остатков по курсору (name, id)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_name_id ON parts (name, id) WHERE deleted_at IS NULL')
+    # Удаленные запчасти, история которых еще не перенесена в архив (archive.purge_deleted_parts)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_deleted_at ON parts (deleted_at) WHERE deleted_at IS NOT NULL')
+    # Критический остаток (quantity - min_stock <= 0): отчет и заказ читают только такие строки
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_parts_low_stock ON parts (quantity - min_stock) WHERE deleted_at IS NULL'
+    )
+    # Самые дорогие запасы для /valuation - первые строки индекса
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_value ON parts (quantity * price) WHERE deleted_at IS NULL')
+    cursor.execute('CREATE VIEW IF NOT EXISTS live_parts AS SELECT * FROM parts WHERE deleted_at IS NULL')
     
     # Таблица транзакций
     cursor.execute('''
@@ -53,99 +140,423 @@ def init_db():
         document_number TEXT,
         comment TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        location TEXT,
         FOREIGN KEY (part_id) REFERENCES parts (id)
     )
     ''')
+    add_column_if_missing(conn, 'transactions', 'location', 'TEXT')
+    # Заменен индексом (part_id, created_at DESC, id DESC): он же обслуживает поиск по part_id
+    cursor.execute('DROP INDEX IF EXISTS idx_transactions_part_id')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_transactions_part_created ON transactions (part_id, created_at DESC, id DESC)'
+    )
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions (created_at)')
+    
+    # Остатки по складам
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock (
+        part_id INTEGER NOT NULL,
+        location TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (part_id, location)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_location ON stock (location, part_id)')
+    # Запчасти, заведенные до появления складов, числятся на своем parts.location
+    cursor.execute('''
+    INSERT INTO stock (part_id, location, quantity)
+    SELECT id, COALESCE(location, ?), quantity FROM live_parts p
+    WHERE NOT EXISTS (SELECT 1 FROM stock WHERE stock.part_id = p.id)
+    ''', (DEFAULT_LOCATION,))
+    
+    # Снимки остатков: строки пишутся одним INSERT ... SELECT на весь склад
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        part_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        taken_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (taken_at, part_id)
+    ) WITHOUT ROWID
+    ''')
+    # Последняя транзакция, вошедшая в снимок - от нее считается дельта
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_snapshot_runs (
+        taken_at TIMESTAMP PRIMARY KEY,
+        last_transaction_id INTEGER NOT NULL
+    )
+    ''')
+    
+    # Остатки по журналу транзакций для инкрементальной сверки
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ledger_balances (
+        part_id INTEGER PRIMARY KEY,
+        balance INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_transaction_id INTEGER NOT NULL
+    )
+    ''')
+    
+    # Точки заказа по прогнозу расхода (пересчитываются целиком в forecast.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS reorder_points (
+        part_id INTEGER PRIMARY KEY,
+        daily_mean REAL NOT NULL,
+        daily_std REAL NOT NULL,
+        reorder_point INTEGER NOT NULL,
+        computed_at TIMESTAMP NOT NULL
+    )
+    ''')
+    
+    # Журнал изменений (CDC): триггеры пишут каждую вставку, правку и удаление
+    # parts и transactions; seq только растет и после очистки не переиспользуется
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS changelog (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        op TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    for table in ('parts', 'transactions'):
+        for event, op, row in (('INSERT', 'I', 'NEW'), ('UPDATE', 'U', 'NEW'), ('DELETE', 'D', 'OLD')):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS changelog_{table}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO changelog (tbl, op, row_id) VALUES ('{table}', '{op}', {row}.id);
+            END
+            ''')
+    # Число неудаленных запчастей и строк transactions без COUNT(*): триггеры меняют счетчики
+    # в той же транзакции, что и саму таблицу
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS table_counts (
+        tbl TEXT PRIMARY KEY,
+        row_count INTEGER NOT NULL
+    )
+    ''')
+    for table in ('parts', 'transactions'):
+        for event, sign, row in (('INSERT', '+', 'NEW'), ('DELETE', '-', 'OLD')):
+            # Счетчик parts - только неудаленные запчасти
+            condition = f'WHEN {row}.deleted_at IS NULL' if table == 'parts' else ''
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS count_{table}_{event.lower()}
+            AFTER {event} ON {table} {condition}
+            BEGIN
+                UPDATE table_counts SET row_count = row_count {sign} 1 WHERE tbl = '{table}';
+            END
+            ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS count_parts_soft_delete
+    AFTER UPDATE OF deleted_at ON parts
+    WHEN (OLD.deleted_at IS NULL) <> (NEW.deleted_at IS NULL)
+    BEGIN
+        UPDATE table_counts SET row_count = row_count + CASE WHEN NEW.deleted_at IS NULL THEN 1 ELSE -1 END
+        WHERE tbl = 'parts';
+    END
+    ''')
+    # Первый запуск с таблицей счетчиков: один раз считаем строки целиком
+    cursor.execute('SELECT tbl FROM table_counts')
+    counted = {row[0] for row in cursor.fetchall()}
+    for table, source in (('parts', 'live_parts'), ('transactions', 'transactions'), (ARCHIVE_COUNT, ARCHIVE_COUNT)):
+        if table not in counted:
+            cursor.execute(f'INSERT INTO table_counts (tbl, row_count) SELECT ?, COUNT(*) FROM {source}', (table,))
+    
+    # Сохраненные позиции постоянных подписчиков журнала
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS changelog_cursors (
+        name TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL
+    )
+    ''')
+    
+    # Обновления Telegram, уже изменившие остатки: повтор после перезапуска
+    # или сетевого сбоя не проводится второй раз. update_id - rowid таблицы,
+    # проверка повтора - один поиск по первичному ключу
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS processed_updates (
+        update_id INTEGER PRIMARY KEY,
+        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Время последнего выполнения периодических задач
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS job_runs (
+        name TEXT PRIMARY KEY,
+        last_run_at TIMESTAMP NOT NULL
+    )
+    ''')
     
     conn.commit()
     logger.info("База данных успешно инициализирована")
     return conn
 
+def rebuild_parts_table(conn):
+    """Одноразовая миграция: UNIQUE(part_number) заменяется частичным индексом.
+
+    Ограничение таблицы мешает завести запчасть с кодом удаленной, а
+    снять его в SQLite можно только пересборкой таблицы. Индексы и
+    триггеры parts удаляются вместе со старой таблицей, init_db создает
+    их заново.
+    """
+    if not any(row['origin'] == 'u' for row in conn.execute('PRAGMA index_list(parts)')):
+        return
+    columns = ', '.join(row['name'] for row in conn.execute('PRAGMA table_info(parts)'))
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'parts'").fetchone()
+    # Остатки прерванной пересборки и представление, которое ссылается на parts
+    conn.execute('DROP TABLE IF EXISTS parts_rebuilt')
+    conn.execute('DROP VIEW IF EXISTS live_parts')
+    conn.execute(PARTS_TABLE.format(name='parts_rebuilt'))
+    conn.execute(f'INSERT INTO parts_rebuilt ({columns}) SELECT {columns} FROM parts')
+    conn.execute('DROP TABLE parts')
+    conn.execute('ALTER TABLE parts_rebuilt RENAME TO parts')
+    # id удаленных когда-то запчастей не должны выдаваться повторно
+    if sequence:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'parts'", (sequence[0],))
+    conn.commit()
+    logger.info("Таблица parts пересобрана: уникальность кода только среди неудаленных запчастей")
+
+def add_column_if_missing(conn, table, column, definition):
+    """Простая миграция: добавляет колонку в существующую таблицу"""
+    schema, _, name = table.rpartition('.')
+    prefix = f'{schema}.' if schema else ''
+    columns = [row[1] for row in conn.execute(f'PRAGMA {prefix}table_info({name})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        logger.info("Добавлена колонка %s.%s", table, column)
+
+def adjust_count(cursor, table, delta):
+    """Меняет счетчик строк таблицы, которую не обслуживают триггеры (архив)"""
+    if delta:
+        cursor.execute('UPDATE table_counts SET row_count = row_count + ? WHERE tbl = ?', (delta, table))
+
+def get_table_counts():
+    """Счетчики строк {таблица: число} - чтение по первичному ключу, без COUNT(*)"""
+    cursor = get_db_connection().cursor()
+    cursor.execute('SELECT tbl, row_count FROM table_counts')
+    return {tbl: row_count for tbl, row_count in cursor.fetchall()}
+
+def claim_update(cursor, update_id):
+    """Отмечает обновление Telegram обработанным в текущей транзакции БД.
+
+    Если update_id уже отмечен, бросает DuplicateUpdate; вызывающий код
+    откатывает транзакцию, и движение не проводится повторно.
+    """
+    if update_id is None:
+        return
+    cursor.execute('INSERT OR IGNORE INTO processed_updates (update_id) VALUES (?)', (update_id,))
+    if cursor.rowcount == 0:
+        raise DuplicateUpdate(update_id)
+
+def prune_processed_updates(keep_days=DEDUP_KEEP_DAYS, batch_size=1000):
+    """Удаляет отметки об обновлениях старше keep_days дней короткими пачками"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+    total = 0
+    while True:
+        # update_id растут со временем, старые отметки идут первыми по первичному ключу
+        cursor.execute(
+            'DELETE FROM processed_updates WHERE update_id IN ('
+            'SELECT update_id FROM processed_updates WHERE processed_at < ? ORDER BY update_id LIMIT ?)',
+            (cutoff, batch_size)
+        )
+        deleted = cursor.rowcount
+        conn.commit()
+        total += deleted
+        if deleted < batch_size:
+            break
+    if total:
+        logger.info("Удалено старых отметок обработанных обновлений: %s", total)
+    return total
+
+def record_movement(cursor, part_id, delta, comment=None, location=None):
+    """Записывает изменение остатка запчасти в журнал транзакций"""
+    if delta == 0:
+        return
+    cursor.execute(
+        'INSERT INTO transactions (part_id, type, quantity, comment, location) VALUES (?, ?, ?, ?, ?)',
+        (part_id, 'incoming' if delta > 0 else 'outgoing', abs(delta), comment, location)
+    )
+
+def apply_movement(cursor, part_id, location, delta, comment=None):
+    """Изменяет остаток запчасти на складе location и общий остаток, пишет транзакцию"""
+    if delta == 0:
+        return
+    cursor.execute('''
+    INSERT INTO stock (part_id, location, quantity) VALUES (?, ?, ?)
+    ON CONFLICT(part_id, location) DO UPDATE SET quantity = quantity + excluded.quantity
+    ''', (part_id, location, delta))
+    cursor.execute(
+        'UPDATE parts SET quantity = quantity + ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        (delta, part_id)
+    )
+    record_movement(cursor, part_id, delta, comment, location)
+
+def get_location_quantity(cursor, part_id, location):
+    """Остаток запчасти на конкретном складе"""
+    cursor.execute('SELECT quantity FROM stock WHERE part_id = ? AND location = ?', (part_id, location))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def transfer_stock(conn, part_id, from_location, to_location, quantity, update_id=None):
+    """Перемещает запчасть между складами одной транзакцией БД.
+
+    Возвращает False, если на складе-источнике недостаточно остатка.
+    """
+    cursor = conn.cursor()
+    try:
+        claim_update(cursor, update_id)
+        cursor.execute(
+            'UPDATE stock SET quantity = quantity - ? WHERE part_id = ? AND location = ? AND quantity >= ?',
+            (quantity, part_id, from_location, quantity)
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return False
+        cursor.execute('''
+        INSERT INTO stock (part_id, location, quantity) VALUES (?, ?, ?)
+        ON CONFLICT(part_id, location) DO UPDATE SET quantity = quantity + excluded.quantity
+        ''', (part_id, to_location, quantity))
+        cursor.executemany(
+            'INSERT INTO transactions (part_id, type, quantity, location) VALUES (?, ?, ?, ?)',
+            [(part_id, 'transfer_out', quantity, from_location), (part_id, 'transfer_in', quantity, to_location)]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+def get_last_job_run(name):
+    """Время последнего успешного выполнения задачи или None"""
+    cursor = get_db_connection().cursor()
+    cursor.execute('SELECT last_run_at FROM job_runs WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+def set_last_job_run(name, when):
+    """Запоминает время выполнения задачи"""
+    conn = get_db_connection()
+    conn.execute(
+        'INSERT OR REPLACE INTO job_runs (name, last_run_at) VALUES (?, ?)',
+        (name, when.isoformat(sep=' ', timespec='seconds'))
+    )
+    conn.commit()
+
+# Имена файлов бэкапов: префикс + ГГГГММДД_ЧЧММСС.db
+BACKUP_PREFIX = 'parts_backup_'
+ARCHIVE_BACKUP_PREFIX = 'parts_archive_backup_'
+
+def _copy_database(path, backup_file):
+    """Копия файла БД path в backup_file.
+
+    Онлайн-копирование средствами SQLite: рабочие соединения закрывать
+    не нужно, запись другими соединениями не блокируется дольше одного шага.
+    """
+    source = sqlite3.connect(path)
+    target = sqlite3.connect(backup_file)
+    try:
+        source.backup(target, pages=1024)
+    finally:
+        target.close()
+        source.close()
+
 def backup_database():
-    """Создание резервной копии базы данных"""
+    """Создание резервной копии базы данных и архива транзакций"""
     try:
         # Создаем папку для бэкапов если нет
         backup_dir = 'backups'
         if not os.path.exists(backup_dir):
             os.makedirs(backup_dir)
-            logger.info(f"Создана папка для бэкапов: {backup_dir}")
+            logger.info("Создана папка для бэкапов: %s", backup_dir)
         
         # Формируем имя файла с датой
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = os.path.join(backup_dir, f'parts_backup_{timestamp}.db')
+        backup_file = os.path.join(backup_dir, f'{BACKUP_PREFIX}{timestamp}.db')
+        _copy_database('parts.db', backup_file)
+        logger.info("Резервная копия создана: %s", backup_file)
         
-        # Закрываем соединение перед копированием
-        close_db()
+        # Архив хранит старые транзакции и историю удаленных запчастей, копируем его с той же меткой
+        if os.path.exists(ARCHIVE_DB_PATH):
+            archive_file = os.path.join(backup_dir, f'{ARCHIVE_BACKUP_PREFIX}{timestamp}.db')
+            _copy_database(ARCHIVE_DB_PATH, archive_file)
+            logger.info("Резервная копия архива создана: %s", archive_file)
         
-        # Копируем файл базы данных
-        shutil.copy2('parts.db', backup_file)
-        
-        # Восстанавливаем соединение
-        get_db_connection()
-        
-        logger.info(f"Резервная копия создана: {backup_file}")
-        
-        # Очищаем старые бэкапы (оставляем последние 10)
-        cleanup_old_backups(backup_dir, keep=10)
+        # Очищаем старые бэкапы по политике хранения
+        cleanup_old_backups(backup_dir)
         
         return backup_file
         
     except Exception as e:
-        logger.error(f"Ошибка при создании резервной копии: {e}")
-        # Восстанавливаем соединение в случае ошибки
-        try:
-            get_db_connection()
-        except:
-            pass
+        logger.error("Ошибка при создании резервной копии: %s", e)
         return None
 
-def cleanup_old_backups(backup_dir, keep=10):
-    """Очистка старых резервных копий"""
+def _backup_time(filename, prefix=BACKUP_PREFIX):
+    """Время создания бэкапа по имени файла <prefix>ГГГГММДД_ЧЧММСС.db"""
     try:
-        if not os.path.exists(backup_dir):
-            return
-            
-        backup_files = [f for f in os.listdir(backup_dir) if f.startswith('parts_backup_') and f.endswith('.db')]
-        backup_files.sort(reverse=True)
-        
-        # Удаляем старые файлы
-        for old_file in backup_files[keep:]:
-            file_path = os.path.join(backup_dir, old_file)
-            os.remove(file_path)
-            logger.info(f"Удален старый бэкап: {old_file}")
-            
+        return datetime.strptime(filename[len(prefix):-len('.db')], "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+
+def list_backups(backup_dir='backups', prefix=BACKUP_PREFIX):
+    """Список бэкапов [(время, имя файла)] от новых к старым (prefix - основной БД или архива)"""
+    if not os.path.exists(backup_dir):
+        return []
+    backups = []
+    for f in os.listdir(backup_dir):
+        if f.startswith(prefix) and f.endswith('.db'):
+            created = _backup_time(f, prefix)
+            if created:
+                backups.append((created, f))
+    backups.sort(reverse=True)
+    return backups
+
+def last_backup_time(backup_dir='backups'):
+    """Время последнего бэкапа или None"""
+    backups = list_backups(backup_dir)
+    return backups[0][0] if backups else None
+
+def cleanup_old_backups(backup_dir, daily=BACKUP_KEEP_DAILY, weekly=BACKUP_KEEP_WEEKLY, monthly=BACKUP_KEEP_MONTHLY):
+    """Очистка старых резервных копий.
+
+    Оставляем самую свежую копию за каждый из последних daily дней,
+    weekly недель и monthly месяцев, остальные удаляем. Копии архива
+    транзакций хранятся по той же политике, отдельно от основных.
+    """
+    try:
+        for prefix in (BACKUP_PREFIX, ARCHIVE_BACKUP_PREFIX):
+            _cleanup_backups(backup_dir, list_backups(backup_dir, prefix), daily, weekly, monthly)
     except Exception as e:
-        logger.error(f"Ошибка при очистке старых бэкапов: {e}")
+        logger.error("Ошибка при очистке старых бэкапов: %s", e)
 
-def start_auto_backup(interval_hours=24):
-    """Запуск автоматического резервного копирования"""
-    global backup_timer
-    
-    def backup_wrapper():
-        try:
-            backup_database()
-        finally:
-            # Перезапускаем таймер
-            start_auto_backup(interval_hours)
-    
-    # Отменяем предыдущий таймер если есть
-    if backup_timer:
-        backup_timer.cancel()
-    
-    # Запускаем новый таймер
-    backup_timer = Timer(interval_hours * 3600, backup_wrapper)
-    backup_timer.daemon = True
-    backup_timer.start()
+def _cleanup_backups(backup_dir, backups, daily, weekly, monthly):
+    """Удаляет из backups (от новых к старым) копии, не попавшие под политику хранения"""
+    keep = set()
+    for period_key, limit in (
+        (lambda t: t.date(), daily),
+        (lambda t: t.isocalendar()[:2], weekly),
+        (lambda t: (t.year, t.month), monthly),
+    ):
+        seen = []
+        for created, f in backups:
+            key = period_key(created)
+            if key not in seen:
+                if len(seen) >= limit:
+                    break
+                seen.append(key)
+                keep.add(f)
     
-    logger.info(f"Автоматическое резервное копирование запущено (интервал: {interval_hours} часов)")
-
-def stop_auto_backup():
-    """Остановка автоматического резервного копирования"""
-    global backup_timer
-    if backup_timer:
-        backup_timer.cancel()
-        backup_timer = None
-        logger.info("Автоматическое резервное копирование остановлено")
+    # Удаляем старые файлы
+    for created, old_file in backups:
+        if old_file not in keep:
+            os.remove(os.path.join(backup_dir, old_file))
+            logger.info("Удален старый бэкап: %s", old_file)
 
 def close_db():
     """Закрывает соединение с БД для текущего потока"""
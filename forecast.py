@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from config import FORECAST_HISTORY_DAYS, FORECAST_LEAD_TIME_DAYS, FORECAST_SERVICE_Z
+from database import get_db_connection
+from cache import bump_data_version
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # прогноз необязателен: без NumPy отчет строится только по min_stock
+
+logger = logging.getLogger(__name__)
+
+# Формат CURRENT_TIMESTAMP в SQLite (UTC)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Сколько строк истории читать из курсора за раз
+FETCH_SIZE = 100000
+
+# Сколько позиций по прогнозу показывать в отчете
+REPORT_LIMIT = 30
+
+# День расхода считается от начала окна истории
+OUTGOING_QUERY = '''
+SELECT part_id, CAST(julianday(created_at) - julianday(?) AS INTEGER), quantity
+FROM all_transactions
+WHERE type = 'outgoing' AND created_at >= ?
+'''
+
+def load_outgoing(since: str):
+    """Расходы начиная с since одной матрицей int64: part_id, день, количество"""
+    cursor = get_db_connection().cursor()
+    # Кортежи вместо sqlite3.Row: строк истории может быть несколько миллионов
+    cursor.row_factory = None
+    cursor.execute(OUTGOING_QUERY, (since, since))
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
+    if not chunks:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.concatenate(chunks)
+
+def forecast_consumption(history, window_days: int, lead_time_days: int, service_z: float):
+    """Скользящее среднее и отклонение дневного расхода по всем запчастям сразу.
+
+    history - матрица (part_id, день от начала окна, количество). Дни без
+    расхода входят в окно как нули, поэтому среднее и дисперсия считаются
+    по суммам и суммам квадратов дневных расходов, без матрицы запчасти x дни.
+    Возвращает массивы: part_id, среднее, отклонение, точка заказа.
+    """
+    part_ids, part_index = np.unique(history[:, 0], return_inverse=True)
+    days = np.minimum(history[:, 1], window_days - 1)
+    # Дневной расход каждой запчасти: группировка по ключу (запчасть, день)
+    day_keys, day_index = np.unique(part_index * window_days + days, return_inverse=True)
+    daily = np.bincount(day_index, weights=history[:, 2])
+    day_part = day_keys // window_days
+
+    mean = np.bincount(day_part, weights=daily, minlength=len(part_ids)) / window_days
+    mean_square = np.bincount(day_part, weights=daily * daily, minlength=len(part_ids)) / window_days
+    std = np.sqrt(np.maximum(mean_square - mean * mean, 0))
+
+    # Расход за срок поставки плюс страховой запас
+    reorder_point = np.ceil(mean * lead_time_days + service_z * std * np.sqrt(lead_time_days)).astype(np.int64)
+    return part_ids, mean, std, reorder_point
+
+def compute_reorder_points(window_days: int = FORECAST_HISTORY_DAYS,
+                           lead_time_days: int = FORECAST_LEAD_TIME_DAYS,
+                           service_z: float = FORECAST_SERVICE_Z) -> int:
+    """Пересчитывает таблицу reorder_points по расходам за window_days дней.
+
+    Запчасти без расхода в окне в таблицу не попадают. Возвращает число
+    позиций с прогнозом (0, если NumPy не установлен).
+    """
+    if np is None:
+        logger.warning("NumPy не установлен, прогноз расхода пропущен")
+        return 0
+
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    since = (now - timedelta(days=window_days)).strftime(TIMESTAMP_FORMAT)
+    history = load_outgoing(since)
+    part_ids, mean, std, reorder_point = forecast_consumption(history, window_days, lead_time_days, service_z)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    computed_at = now.strftime(TIMESTAMP_FORMAT)
+    try:
+        cursor.execute('DELETE FROM reorder_points')
+        cursor.executemany(
+            'INSERT INTO reorder_points (part_id, daily_mean, daily_std, reorder_point, computed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            zip(part_ids.tolist(), mean.tolist(), std.tolist(), reorder_point.tolist(), [computed_at] * len(part_ids))
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logger.info(
+        "Прогноз расхода: %s позиций по %s расходам за %.2f с",
+        len(part_ids), len(history), time.perf_counter() - started
+    )
+    return len(part_ids)
+
+def reorder_suggestions(limit: int = REPORT_LIMIT):
+    """Запчасти выше min_stock, но не выше точки заказа, по возрастанию дней запаса.
+
+    Возвращает (строки, сколько всего таких позиций). В строке: id, name,
+    part_number, unit, quantity, reorder_point, days_of_cover.
+    """
+    cursor = get_db_connection().cursor()
+    # CROSS JOIN фиксирует порядок: перебираем только запчасти с прогнозом, parts - по первичному ключу
+    cursor.execute('''
+    SELECT p.id, p.name, p.part_number, p.unit, p.quantity, r.reorder_point,
+           p.quantity / r.daily_mean AS days_of_cover,
+           COUNT(*) OVER () AS total
+    FROM reorder_points r
+    CROSS JOIN live_parts p ON p.id = r.part_id
+    WHERE p.quantity <= r.reorder_point AND p.quantity > p.min_stock
+    ORDER BY days_of_cover
+    LIMIT ?
+    ''', (limit,))
+    rows = cursor.fetchall()
+    return rows, rows[0]['total'] if rows else 0
+
+async def run_forecast():
+    """Периодическая задача: пересчет точек заказа вне event loop"""
+    await asyncio.to_thread(compute_reorder_points)
+    # Версию данных меняем в event loop, как и остальные изменения склада
+    bump_data_version()
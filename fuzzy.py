@@ -0,0 +1,106 @@
+import logging
+import re
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Кириллические буквы, которые на клавиатуре путают с латинскими
+_HOMOGLYPHS = str.maketrans('авекмнорстух', 'abekmhopctyx')
+
+_SEPARATORS = re.compile(r'[\W_]+')
+
+def normalize_part_number(part_number: str) -> str:
+    """Канонический вид кода: регистр, раскладка и разделители не важны.
+
+    '6305-2RS', '6305 2rs' и '6305-2Rs' дают '63052rs',
+    'ВК-12' с кириллицей совпадает с латинским 'BK12'.
+    """
+    return _SEPARATORS.sub('', part_number.casefold().translate(_HOMOGLYPHS))
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    """Расстояние редактирования; при превышении limit возвращает limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+def _trigrams(code: str) -> set:
+    padded = f'^{code}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class PartNumberIndex:
+    """Триграммный индекс кодов запчастей в памяти для подсказок "возможно, вы имели в виду".
+
+    Кандидаты отбираются по числу общих триграмм, затем проверяются
+    расстоянием редактирования, поэтому поиск не перебирает все коды.
+    """
+
+    # Сколько лучших по триграммам кандидатов проверять расстоянием редактирования
+    CANDIDATES = 100
+
+    def __init__(self):
+        self._postings = {}  # триграмма -> множество канонических кодов
+        self._codes = {}  # канонический код -> множество исходных кодов
+
+    def load(self, part_numbers):
+        """Строит индекс по всем кодам из хранилища (при запуске бота)"""
+        started = time.perf_counter()
+        self._postings = {}
+        self._codes = {}
+        for part_number in part_numbers:
+            self.add(part_number)
+        logger.info("Индекс кодов запчастей построен: %s кодов за %.2f с", len(self._codes), time.perf_counter() - started)
+
+    def add(self, part_number: str):
+        code = normalize_part_number(part_number)
+        if code not in self._codes:
+            self._codes[code] = set()
+            for trigram in _trigrams(code):
+                self._postings.setdefault(trigram, set()).add(code)
+        self._codes[code].add(part_number)
+
+    def remove(self, part_number: str):
+        code = normalize_part_number(part_number)
+        originals = self._codes.get(code)
+        if originals is None:
+            return
+        originals.discard(part_number)
+        if not originals:
+            del self._codes[code]
+            for trigram in _trigrams(code):
+                self._postings[trigram].discard(code)
+
+    def suggest(self, part_number: str, limit: int = 5) -> list:
+        """Ближайшие существующие коды к введенному"""
+        code = normalize_part_number(part_number)
+        if not code:
+            return []
+        # Для коротких кодов допускаем меньше опечаток, иначе подсказки бессмысленны
+        max_distance = 1 if len(code) <= 4 else 2
+
+        shared = Counter()
+        for trigram in _trigrams(code):
+            shared.update(self._postings.get(trigram, ()))
+
+        matches = []
+        for candidate, common in shared.most_common(self.CANDIDATES):
+            distance = levenshtein(code, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, -common, candidate))
+        matches.sort()
+
+        suggestions = []
+        for _, _, match in matches:
+            suggestions.extend(sorted(self._codes[match]))
+        return suggestions[:limit]
+
+# Общий индекс бота
+part_number_index = PartNumberIndex()
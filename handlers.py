@@ -1,49 +1,118 @@
+import asyncio
 import logging
 import os
-from datetime import datetime
-from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, CommandHandler, filters
-from database import get_db_connection, backup_database
-from keyboards import get_cancel_keyboard, get_main_keyboard, get_navigation_keyboard, get_users_management_keyboard, get_backup_keyboard
-from auth import is_user_allowed, get_user_role, is_admin
-from config import ALLOWED_USERS, ADMIN_USER_ID, ITEMS_PER_PAGE
+from datetime import datetime, timezone
+from telegram import Update, ReplyKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import ApplicationHandlerStop, ContextTypes, ConversationHandler, MessageHandler, CommandHandler, filters
+from database import backup_database
+from storage import get_storage, EDITABLE_FIELDS, DuplicateUpdate, PartNumberTaken
+from keyboards import get_cancel_keyboard, get_main_keyboard, get_stock_page_keyboard, get_history_page_keyboard, get_users_management_keyboard, get_backup_keyboard
+from auth import is_user_allowed, get_user_role, is_admin, unauthorized_senders
+from config import ALLOWED_USERS, ADMIN_USER_ID, ITEMS_PER_PAGE, DEFAULT_LOCATION, INLINE_RESULTS_LIMIT, INLINE_CACHE_TIME
+from send_queue import reply, reply_document, edit
+from alerts import low_stock_alerts
+from snapshots import stock_as_of
+from reconcile import reconcile_ledger, format_reconcile_result
+from valuation import get_valuation
+from purchase_orders import build_purchase_order, purchase_order_csv
+from cache import render_cache
+from fuzzy import normalize_part_number, part_number_index
+from autocomplete import part_prefix_index
 
 # Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler
 (ADD_PART_NAME, ADD_PART_NUMBER, ADD_PART_QUANTITY, ADD_PART_UNIT, 
  ADD_PART_MIN_STOCK, EDIT_PART_SELECT, EDIT_PART_FIELD, EDIT_PART_VALUE, 
  DELETE_PART_SELECT, DELETE_PART_CONFIRM, INCOMING, OUTGOING, SEARCH,
- ADD_USER, REMOVE_USER) = range(15)
+ ADD_USER, REMOVE_USER, TRANSFER) = range(16)
 
-async def auth_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Промежуточный обработчик для проверки прав"""
-    user_id = update.effective_user.id
+async def reject_unauthorized(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отсекает обновления неразрешенных пользователей до остальных обработчиков (группа -1).
+
+    Отказ отправляется не чаще раза в UNAUTHORIZED_REPLY_TTL на отправителя,
+    остальные обновления отбрасываются молча.
+    """
+    user = update.effective_user
+    if user is not None and is_user_allowed(user.id):
+        return
     
-    if not is_user_allowed(user_id):
-        logger.warning(f"Неавторизованный доступ: {user_id}")
+    if user is not None and unauthorized_senders.should_reply(user.id):
+        logger.warning("Неавторизованный доступ: %s", user.id)
         if update.message:
-            await update.message.reply_text(
+            await reply(
+                update,
                 "⛔ Доступ запрещен!\n\n"
                 "У вас нет прав для использования этого бота.\n"
                 "Обратитесь к администратору."
             )
+    raise ApplicationHandlerStop
+
+async def auth_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Промежуточный обработчик для проверки прав"""
+    user_id = update.effective_user.id
+    
+    if not is_user_allowed(user_id):
+        # Отказ уже отправил reject_unauthorized
         return False
     
     context.user_data['role'] = get_user_role(user_id)
     return True
 
+def find_part(part_number: str):
+    """Ищет запчасть по коду.
+
+    Если точного совпадения нет, ищет по каноническому коду (без учета
+    регистра, раскладки и разделителей), а затем подбирает похожие коды.
+    Возвращает (запчасть или None, список подсказок).
+    """
+    parts = get_storage().parts
+    part = parts.get_by_number(part_number)
+    if part:
+        return part, []
+    
+    matches = parts.find_by_norm(normalize_part_number(part_number))
+    if len(matches) == 1:
+        return matches[0], []
+    if matches:
+        return None, [match.part_number for match in matches]
+    return None, part_number_index.suggest(part_number)
+
+async def reply_part_not_found(update: Update, message: str, suggestions: list, suffix: str = ''):
+    """Ответ "запчасть не найдена" с кнопками похожих кодов (к коду добавляется suffix)"""
+    if not suggestions:
+        await reply(update, message)
+        return
+    
+    keyboard = [[f'{code}{suffix}'] for code in suggestions]
+    keyboard.append(['❌ Отмена'])
+    await reply(
+        update,
+        f'{message}\n\nВозможно, вы имели в виду:\n' + '\n'.join(f'• {code}' for code in suggestions),
+        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    )
+
+async def reply_already_processed(update: Update):
+    """Ответ на повтор обновления, по которому движение уже проведено"""
+    logger.info("Повтор обновления %s, движение не проводится", update.update_id)
+    await reply(update, 'ℹ️ Эта операция уже проведена, повтор не учтен.', reply_markup=get_main_keyboard())
+
+def get_location_filter(context: ContextTypes.DEFAULT_TYPE):
+    """Склад, выбранный пользователем через /location (None - все склады)"""
+    return context.user_data.get('location')
+
+def get_operation_location(context: ContextTypes.DEFAULT_TYPE):
+    """Склад для прихода/расхода/правки, если он не указан явно"""
+    return context.user_data.get('location') or DEFAULT_LOCATION
+
 # Команда /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await auth_middleware(update, context):
         return
     
-    await update.message.reply_text(
+    await reply(
+        update,
         '🏭 Бот учета запасных частей\n\n'
         'Выберите действие:',
         reply_markup=get_main_keyboard()
@@ -59,22 +128,30 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 📦 Приход - оформить поступление запчастей
 📤 Расход - оформить выдачу запчастей
+🔄 Перемещение - переместить запчасти между складами
 📊 Остатки - посмотреть текущие остатки
 🔍 Поиск - найти запчасть по названию/номеру
 ➕ Добавить запчасть - добавить новую позицию
 ✏️ Редактировать запчасть - изменить данные запчасти
 🗑️ Удалить запчасть - удалить позицию из системы
 📋 Отчет - получить отчет по складу
+💰 Оценка склада - стоимость запасов по ценам
+/stock_on ДД.ММ.ГГГГ - остатки на дату
+/location [склад] - выбрать склад для остатков, отчета и поиска
+/order [склад] - CSV-заказ по поставщикам (или по складам)
+/history КОД - история прихода и расхода запчасти
 👑 Управление пользователями - управление доступом
 💾 Бэкапы - управление резервными копиями
 
 ❌ Отмена - отменить текущее действие
 
 📝 Форматы ввода:
-• Приход/расход: "Код детали | Количество"
+• Приход/расход: "Код детали | Количество [| Склад]"
+• Перемещение: "Код детали | Количество | Откуда | Куда"
 • Поиск: "Номер или название"
+• В любом чате: "@бот 6305" - подсказки по коду или названию
 """
-    await update.message.reply_text(help_text)
+    await reply(update, help_text)
 
 # Управление бэкапами
 async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -84,16 +161,17 @@ async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = update.effective_user.id
     if not is_admin(user_id):
-        await update.message.reply_text("⛔ Только администратор может создавать резервные копии.")
+        await reply(update, "⛔ Только администратор может создавать резервные копии.")
         return
     
-    await update.message.reply_text("🔄 Создание резервной копии...")
+    await reply(update, "🔄 Создание резервной копии...")
     
-    backup_file = backup_database()
+    backup_file = await asyncio.to_thread(backup_database)
     
     if backup_file:
         file_size = os.path.getsize(backup_file) / 1024
-        await update.message.reply_text(
+        await reply(
+            update,
             f"✅ Резервная копия успешно создана!\n\n"
             f"📁 Файл: {os.path.basename(backup_file)}\n"
             f"💾 Размер: {file_size:.1f} КБ\n"
@@ -101,7 +179,8 @@ async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_backup_keyboard()
         )
     else:
-        await update.message.reply_text(
+        await reply(
+            update,
             "❌ Ошибка при создании резервной копии.",
             reply_markup=get_backup_keyboard()
         )
@@ -113,12 +192,13 @@ async def backup_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = update.effective_user.id
     if not is_admin(user_id):
-        await update.message.reply_text("⛔ Только администратор может просматривать статус бэкапов.")
+        await reply(update, "⛔ Только администратор может просматривать статус бэкапов.")
         return
     
     backup_dir = 'backups'
     if not os.path.exists(backup_dir):
-        await update.message.reply_text(
+        await reply(
+            update,
             "📭 Резервные копии отсутствуют.",
             reply_markup=get_backup_keyboard()
         )
@@ -128,7 +208,8 @@ async def backup_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     backup_files.sort(reverse=True)
     
     if not backup_files:
-        await update.message.reply_text(
+        await reply(
+            update,
             "📭 Резервные копии отсутствуют.",
             reply_markup=get_backup_keyboard()
         )
@@ -150,7 +231,7 @@ async def backup_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Для создания новой копии нажмите '💾 Создать бэкап'"
     )
     
-    await update.message.reply_text(message, reply_markup=get_backup_keyboard())
+    await reply(update, message, reply_markup=get_backup_keyboard())
 
 # Обработка навигации
 async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -159,13 +240,7 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     text = update.message.text
     
-    if text == '◀️ Предыдущая страница':
-        context.user_data['stock_page'] = context.user_data.get('stock_page', 2) - 1
-        await show_stock(update, context)
-    elif text == '▶️ Следующая страница':
-        context.user_data['stock_page'] = context.user_data.get('stock_page', 0) + 1
-        await show_stock(update, context)
-    elif text == '📋 Главное меню':
+    if text == '📋 Главное меню':
         await start(update, context)
     else:
         await handle_message(update, context)
@@ -177,10 +252,11 @@ async def manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = update.effective_user.id
     if not is_admin(user_id):
-        await update.message.reply_text("⛔ Только администратор может управлять пользователями.")
+        await reply(update, "⛔ Только администратор может управлять пользователями.")
         return
     
-    await update.message.reply_text(
+    await reply(
+        update,
         "👑 Управление пользователями:\n\n"
         "Выберите действие:",
         reply_markup=get_users_management_keyboard()
@@ -193,7 +269,7 @@ async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = update.effective_user.id
     if not is_admin(user_id):
-        await update.message.reply_text("⛔ Только администратор может просматривать пользователей.")
+        await reply(update, "⛔ Только администратор может просматривать пользователей.")
         return
     
     message = "👥 Список пользователей:\n\n"
@@ -202,7 +278,7 @@ async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message += f"{role}: {username} (ID: {uid})\n"
     
     message += f"\nВсего пользователей: {len(ALLOWED_USERS)}"
-    await update.message.reply_text(message, reply_markup=get_users_management_keyboard())
+    await reply(update, message, reply_markup=get_users_management_keyboard())
 
 # Добавление пользователя - начало
 async def add_user_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -211,10 +287,11 @@ async def add_user_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = update.effective_user.id
     if not is_admin(user_id):
-        await update.message.reply_text("⛔ Только администратор может добавлять пользователей.")
+        await reply(update, "⛔ Только администратор может добавлять пользователей.")
         return ConversationHandler.END
     
-    await update.message.reply_text(
+    await reply(
+        update,
         "Введите ID пользователя для добавления:\n\n"
         "Чтобы получить ID пользователя, попросите его написать боту @userinfobot\n\n"
         "❌ Отмена - отменить добавление",
@@ -231,27 +308,29 @@ async def add_user_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
         new_user_id = int(update.message.text.strip())
         
         if new_user_id in ALLOWED_USERS:
-            await update.message.reply_text("❌ Этот пользователь уже есть в списке.")
+            await reply(update, "❌ Этот пользователь уже есть в списке.")
             return ADD_USER
         
         # Добавляем пользователя
         ALLOWED_USERS[new_user_id] = f"Пользователь_{new_user_id}"
         
-        # Обновляем .env файл
+        # Обновляем .env файл и таблицу пользователей
         update_env_file(new_user_id, None)
+        get_storage().users.add(new_user_id, ALLOWED_USERS[new_user_id])
         
-        await update.message.reply_text(
+        await reply(
+            update,
             f"✅ Пользователь {new_user_id} успешно добавлен!\n\n"
             f"Теперь у него есть доступ к боту.",
             reply_markup=get_users_management_keyboard()
         )
         
     except ValueError:
-        await update.message.reply_text("❌ ID пользователя должен быть числом! Введите снова:")
+        await reply(update, "❌ ID пользователя должен быть числом! Введите снова:")
         return ADD_USER
     except Exception as e:
-        logger.error(f"Ошибка при добавлении пользователя: {e}")
-        await update.message.reply_text("❌ Ошибка при добавлении пользователя.")
+        logger.error("Ошибка при добавлении пользователя: %s", e)
+        await reply(update, "❌ Ошибка при добавлении пользователя.")
     
     return ConversationHandler.END
 
@@ -262,7 +341,7 @@ async def remove_user_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = update.effective_user.id
     if not is_admin(user_id):
-        await update.message.reply_text("⛔ Только администратор может удалять пользователей.")
+        await reply(update, "⛔ Только администратор может удалять пользователей.")
         return ConversationHandler.END
     
     # Показываем список пользователей для удаления
@@ -275,13 +354,14 @@ async def remove_user_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             message += f"👤 {username} (ID: {uid})\n"
     
     if not users_list:
-        await update.message.reply_text("❌ Нет пользователей для удаления.", reply_markup=get_users_management_keyboard())
+        await reply(update, "❌ Нет пользователей для удаления.", reply_markup=get_users_management_keyboard())
         return ConversationHandler.END
     
     users_list.append(['❌ Отмена'])
     reply_markup = ReplyKeyboardMarkup(users_list, resize_keyboard=True)
     
-    await update.message.reply_text(
+    await reply(
+        update,
         message + "\nВыберите пользователя для удаления:",
         reply_markup=reply_markup
     )
@@ -299,35 +379,37 @@ async def remove_user_process(update: Update, context: ContextTypes.DEFAULT_TYPE
             user_id_str = text.split('(ID:')[1].split(')')[0].strip()
             user_id_to_remove = int(user_id_str)
         else:
-            await update.message.reply_text("❌ Неверный формат. Выберите пользователя из списка.")
+            await reply(update, "❌ Неверный формат. Выберите пользователя из списка.")
             return REMOVE_USER
         
         if user_id_to_remove == ADMIN_USER_ID:
-            await update.message.reply_text("❌ Нельзя удалить администратора!")
+            await reply(update, "❌ Нельзя удалить администратора!")
             return REMOVE_USER
         
         if user_id_to_remove not in ALLOWED_USERS:
-            await update.message.reply_text("❌ Пользователь не найден в списке.")
+            await reply(update, "❌ Пользователь не найден в списке.")
             return REMOVE_USER
         
         # Удаляем пользователя
         removed_username = ALLOWED_USERS.pop(user_id_to_remove)
         
-        # Обновляем .env файл
+        # Обновляем .env файл и таблицу пользователей
         update_env_file(None, user_id_to_remove)
+        get_storage().users.remove(user_id_to_remove)
         
-        await update.message.reply_text(
+        await reply(
+            update,
             f"✅ Пользователь {removed_username} (ID: {user_id_to_remove}) удален!\n\n"
             f"Теперь у него нет доступа к боту.",
             reply_markup=get_users_management_keyboard()
         )
         
     except ValueError:
-        await update.message.reply_text("❌ Ошибка формата. Выберите пользователя из списка:")
+        await reply(update, "❌ Ошибка формата. Выберите пользователя из списка:")
         return REMOVE_USER
     except Exception as e:
-        logger.error(f"Ошибка при удалении пользователя: {e}")
-        await update.message.reply_text("❌ Ошибка при удалении пользователя.")
+        logger.error("Ошибка при удалении пользователя: %s", e)
+        await reply(update, "❌ Ошибка при удалении пользователя.")
     
     return ConversationHandler.END
 
@@ -376,10 +458,10 @@ def update_env_file(add_user_id: int = None, remove_user_id: int = None):
         with open('.env', 'w') as f:
             f.writelines(new_lines)
             
-        logger.info(f"Обновлен .env файл. Текущие пользователи: {new_users_str}")
+        logger.info("Обновлен .env файл. Текущие пользователи: %s", new_users_str)
             
     except Exception as e:
-        logger.error(f"Ошибка обновления .env файла: {e}")
+        logger.error("Ошибка обновления .env файла: %s", e)
 
 # Обработка текстовых сообщений
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -389,11 +471,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     
     # Навигация
-    if text in ['◀️ Предыдущая страница', '▶️ Следующая страница', '📋 Главное меню']:
+    if text == '📋 Главное меню':
         await handle_navigation(update, context)
     # Управление бэкапами
     elif text == '💾 Бэкапы':
-        await update.message.reply_text(
+        await reply(
+            update,
             "💾 Управление резервными копиями:\n\n"
             "Выберите действие:",
             reply_markup=get_backup_keyboard()
@@ -416,6 +499,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await incoming_start(update, context)
     elif text == '📤 Расход':
         await outgoing_start(update, context)
+    elif text == '🔄 Перемещение':
+        await transfer_start(update, context)
     elif text == '📊 Остатки':
         await show_stock(update, context)
     elif text == '🔍 Поиск':
@@ -428,19 +513,22 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await delete_part_start(update, context)
     elif text == '📋 Отчет':
         await generate_report(update, context)
+    elif text == '💰 Оценка склада':
+        await valuation_report(update, context)
     elif text == '❓ Помощь':
         await help_command(update, context)
     elif text == '❌ Отмена':
         await cancel(update, context)
     else:
-        await update.message.reply_text("Не понимаю команду. Используйте кнопки меню.")
+        await reply(update, "Не понимаю команду. Используйте кнопки меню.")
 
 # Добавление запчасти - начало
 async def add_part_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await auth_middleware(update, context):
         return ConversationHandler.END
         
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите наименование детали:\n\n'
         'Пример: Подшипник шариковый 6305\n\n'
         '❌ Отмена - отменить добавление',
@@ -454,7 +542,8 @@ async def add_part_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
         
     context.user_data['new_part'] = {'name': update.message.text.strip()}
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите код детали (артикул):\n\n'
         'Пример: 6305-2RS\n\n'
         '❌ Отмена - отменить добавление'
@@ -468,17 +557,13 @@ async def add_part_number(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     part_number = update.message.text.strip()
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM parts WHERE part_number = ?', (part_number,))
-    existing_part = cursor.fetchone()
-    
-    if existing_part:
-        await update.message.reply_text('❌ Запчасть с таким кодом уже существует! Введите другой код:')
+    if get_storage().parts.get_by_number(part_number):
+        await reply(update, '❌ Запчасть с таким кодом уже существует! Введите другой код:')
         return ADD_PART_NUMBER
     
     context.user_data['new_part']['part_number'] = part_number
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите начальное количество:\n\n'
         'Пример: 10\n\n'
         '❌ Отмена - отменить добавление'
@@ -497,7 +582,8 @@ async def add_part_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = [['шт.', 'м', 'кг', 'уп.'], ['❌ Отмена']]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
-        await update.message.reply_text(
+        await reply(
+            update,
             'Выберите или введите единицу измерения:\n\n'
             'Пример: шт., м, кг, уп.\n\n'
             '❌ Отмена - отменить добавление',
@@ -505,7 +591,7 @@ async def add_part_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ADD_PART_UNIT
     except ValueError:
-        await update.message.reply_text('❌ Количество должно быть числом! Введите снова:')
+        await reply(update, '❌ Количество должно быть числом! Введите снова:')
         return ADD_PART_QUANTITY
 
 async def add_part_unit(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -515,7 +601,8 @@ async def add_part_unit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     unit = update.message.text.strip()
     context.user_data['new_part']['unit'] = unit
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите минимальный запас (пороговое значение для оповещения):\n\n'
         'Пример: 5\n\n'
         '❌ Отмена - отменить добавление',
@@ -532,41 +619,37 @@ async def add_part_min_stock(update: Update, context: ContextTypes.DEFAULT_TYPE)
         min_stock = int(update.message.text.strip())
         part_data = context.user_data['new_part']
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'INSERT INTO parts (name, part_number, quantity, unit, min_stock) VALUES (?, ?, ?, ?, ?)',
-            (part_data['name'], part_data['part_number'], part_data['quantity'], 
-             part_data['unit'], min_stock)
+        location = get_operation_location(context)
+        # Начальный остаток оформляется как приход на склад
+        part = get_storage().parts.create(
+            part_data['name'], part_data['part_number'], part_data['unit'], min_stock, location, part_data['quantity']
         )
         
-        if part_data['quantity'] > 0:
-            part_id = cursor.lastrowid
-            cursor.execute(
-                'INSERT INTO transactions (part_id, type, quantity) VALUES (?, ?, ?)',
-                (part_id, 'incoming', part_data['quantity'])
-            )
-        
-        conn.commit()
-        
-        await update.message.reply_text(
+        await reply(
+            update,
             f'✅ Запчасть успешно добавлена:\n\n'
             f'🏷️ Наименование: {part_data["name"]}\n'
             f'🔢 Код: {part_data["part_number"]}\n'
             f'📦 Количество: {part_data["quantity"]} {part_data["unit"]}\n'
+            f'📍 Склад: {location}\n'
             f'⚠️ Мин. запас: {min_stock} {part_data["unit"]}',
             reply_markup=get_main_keyboard()
         )
         
+        part_number_index.add(part_data['part_number'])
+        part_prefix_index.add(part.id, part.name, part.part_number, part.unit)
         context.user_data.pop('new_part', None)
         
+    except PartNumberTaken:
+        # Код заняли, пока шел диалог
+        await reply(update, '❌ Запчасть с таким кодом уже существует!', reply_markup=get_main_keyboard())
+        context.user_data.pop('new_part', None)
     except ValueError:
-        await update.message.reply_text('❌ Минимальный запас должен быть числом! Введите снова:')
+        await reply(update, '❌ Минимальный запас должен быть числом! Введите снова:')
         return ADD_PART_MIN_STOCK
     except Exception as e:
-        logger.error(f"Ошибка при добавлении запчасти: {e}")
-        await update.message.reply_text('❌ Ошибка при добавлении запчасти. Попробуйте снова.')
+        logger.error("Ошибка при добавлении запчасти: %s", e)
+        await reply(update, '❌ Ошибка при добавлении запчасти. Попробуйте снова.')
     
     return ConversationHandler.END
 
@@ -575,7 +658,8 @@ async def delete_part_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await auth_middleware(update, context):
         return ConversationHandler.END
         
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите код детали для удаления:\n\n'
         'Пример: 6305-2RS\n\n'
         '❌ Отмена - отменить удаление',
@@ -590,39 +674,38 @@ async def delete_part_select(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
     part_number = update.message.text.strip()
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM parts WHERE part_number = ?', (part_number,))
-    part = cursor.fetchone()
+    part, suggestions = find_part(part_number)
     
     if not part:
-        await update.message.reply_text('❌ Запчасть не найдена! Введите другой код:')
+        await reply_part_not_found(update, '❌ Запчасть не найдена! Введите другой код:', suggestions)
         return DELETE_PART_SELECT
     
     context.user_data['delete_part'] = {
-        'id': part[0],
-        'name': part[1],
-        'part_number': part[2],
-        'quantity': part[3],
-        'unit': part[4]
+        'id': part.id,
+        'name': part.name,
+        'part_number': part.part_number,
+        'quantity': part.quantity,
+        'unit': part.unit
     }
     
     keyboard = [['✅ Да, удалить', '❌ Нет, отменить']]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    await update.message.reply_text(
+    await reply(
+        update,
         f'⚠️ Вы уверены, что хотите удалить запчасть?\n\n'
-        f'🏷️ Наименование: {part[1]}\n'
-        f'🔢 Код: {part[2]}\n'
-        f'📦 Количество: {part[3]} {part[4]}\n\n'
-        'Это действие нельзя отменить!',
+        f'🏷️ Наименование: {part.name}\n'
+        f'🔢 Код: {part.part_number}\n'
+        f'📦 Количество: {part.quantity} {part.unit}\n\n'
+        'Запчасть пропадет из остатков и поиска, история движений сохранится в архиве.',
         reply_markup=reply_markup
     )
     return DELETE_PART_CONFIRM
 
 async def delete_part_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text == '❌ Нет, отменить':
-        await update.message.reply_text(
+        await reply(
+            update,
             '✅ Удаление отменено.',
             reply_markup=get_main_keyboard()
         )
@@ -630,26 +713,22 @@ async def delete_part_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
         
     if update.message.text != '✅ Да, удалить':
-        await update.message.reply_text('❌ Пожалуйста, выберите вариант из клавиатуры:')
+        await reply(update, '❌ Пожалуйста, выберите вариант из клавиатуры:')
         return DELETE_PART_CONFIRM
         
     part_data = context.user_data.get('delete_part')
     if not part_data:
-        await update.message.reply_text('❌ Ошибка: данные о запчасти не найдены.')
+        await reply(update, '❌ Ошибка: данные о запчасти не найдены.')
         return ConversationHandler.END
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Сначала удаляем связанные транзакции
-        cursor.execute('DELETE FROM transactions WHERE part_id = ?', (part_data['id'],))
-        # Затем удаляем саму запчасть
-        cursor.execute('DELETE FROM parts WHERE id = ?', (part_data['id'],))
+        # Запчасть только помечается удаленной, историю ночью переносит в архив purge_deleted_parts
+        get_storage().parts.delete(part_data['id'])
+        part_number_index.remove(part_data['part_number'])
+        part_prefix_index.remove(part_data['id'])
         
-        conn.commit()
-        
-        await update.message.reply_text(
+        await reply(
+            update,
             f'✅ Запчасть успешно удалена:\n\n'
             f'🏷️ Наименование: {part_data["name"]}\n'
             f'🔢 Код: {part_data["part_number"]}\n'
@@ -658,8 +737,9 @@ async def delete_part_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         
     except Exception as e:
-        logger.error(f"Ошибка при удалении запчасти: {e}")
-        await update.message.reply_text(
+        logger.error("Ошибка при удалении запчасти: %s", e)
+        await reply(
+            update,
             '❌ Ошибка при удалении запчасти.',
             reply_markup=get_main_keyboard()
         )
@@ -672,7 +752,8 @@ async def edit_part_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await auth_middleware(update, context):
         return ConversationHandler.END
         
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите код детали для редактирования:\n\n'
         'Пример: 6305-2RS\n\n'
         '❌ Отмена - отменить редактирование',
@@ -687,37 +768,43 @@ async def edit_part_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     part_number = update.message.text.strip()
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM parts WHERE part_number = ?', (part_number,))
-    part = cursor.fetchone()
+    part, suggestions = find_part(part_number)
     
     if not part:
-        await update.message.reply_text('❌ Запчасть не найдена! Введите другой код:')
+        await reply_part_not_found(update, '❌ Запчасть не найдена! Введите другой код:', suggestions)
         return EDIT_PART_SELECT
     
     context.user_data['edit_part'] = {
-        'id': part[0],
-        'name': part[1],
-        'part_number': part[2],
-        'quantity': part[3],
-        'unit': part[4],
-        'min_stock': part[7]
+        'id': part.id,
+        'name': part.name,
+        'part_number': part.part_number,
+        'quantity': part.quantity,
+        'unit': part.unit,
+        'price': part.price,
+        'min_stock': part.min_stock,
+        'supplier': part.supplier,
+        'pack_size': part.pack_size
     }
     
     keyboard = [
         ['✏️ Наименование', '✏️ Код'],
         ['✏️ Количество', '✏️ Единица измерения'],
-        ['✏️ Мин. запас', '❌ Отмена']
+        ['✏️ Мин. запас', '✏️ Цена'],
+        ['✏️ Поставщик', '✏️ Кратность'],
+        ['❌ Отмена']
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    await update.message.reply_text(
+    await reply(
+        update,
         f'📝 Редактирование запчасти:\n\n'
-        f'🏷️ Наименование: {part[1]}\n'
-        f'🔢 Код: {part[2]}\n'
-        f'📦 Количество: {part[3]} {part[4]}\n'
-        f'⚠️ Мин. запас: {part[7]} {part[4]}\n\n'
+        f'🏷️ Наименование: {part.name}\n'
+        f'🔢 Код: {part.part_number}\n'
+        f'📦 Количество: {part.quantity} {part.unit}\n'
+        f'⚠️ Мин. запас: {part.min_stock} {part.unit}\n'
+        f'💰 Цена: {part.price:.2f}\n'
+        f'🚚 Поставщик: {part.supplier or "не указан"}\n'
+        f'📦 Кратность заказа: {part.pack_size} {part.unit}\n\n'
         'Выберите что редактировать:',
         reply_markup=reply_markup
     )
@@ -736,17 +823,27 @@ async def edit_part_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
         '✏️ Код': 'part_number',
         '✏️ Количество': 'quantity',
         '✏️ Единица измерения': 'unit',
-        '✏️ Мин. запас': 'min_stock'
+        '✏️ Мин. запас': 'min_stock',
+        '✏️ Цена': 'price',
+        '✏️ Поставщик': 'supplier',
+        '✏️ Кратность': 'pack_size'
     }
     
     if field not in field_map:
-        await update.message.reply_text('❌ Неверный выбор! Выберите поле для редактирования:')
+        await reply(update, '❌ Неверный выбор! Выберите поле для редактирования:')
         return EDIT_PART_FIELD
     
     context.user_data['edit_field'] = field_map[field]
     
     current_value = part_data[field_map[field]]
-    await update.message.reply_text(
+    if field_map[field] == 'quantity':
+        # Количество правится на складе пользователя
+        location = get_operation_location(context)
+        part_data['location'] = location
+        part_data['location_quantity'] = get_storage().parts.location_quantity(part_data['id'], location)
+        current_value = f"{part_data['location_quantity']} (склад: {location})"
+    await reply(
+        update,
         f'Текущее значение: {current_value}\n\n'
         f'Введите новое значение:\n\n'
         f'❌ Отмена - отменить редактирование',
@@ -763,48 +860,52 @@ async def edit_part_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
         field = context.user_data['edit_field']
         new_value = update.message.text.strip()
         part_data = context.user_data['edit_part']
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        storage = get_storage()
         
         if field in ['quantity', 'min_stock']:
             new_value = int(new_value)
+        elif field == 'price':
+            new_value = float(new_value.replace(',', '.'))
+            if new_value < 0:
+                raise ValueError
+        elif field == 'pack_size':
+            new_value = int(new_value)
+            if new_value < 1:
+                raise ValueError
         
         if field == 'part_number' and new_value != part_data['part_number']:
-            cursor.execute('SELECT * FROM parts WHERE part_number = ?', (new_value,))
-            if cursor.fetchone():
-                await update.message.reply_text('❌ Запчасть с таким кодом уже существует! Введите другой код:')
+            if storage.parts.get_by_number(new_value):
+                await reply(update, '❌ Запчасть с таким кодом уже существует! Введите другой код:')
                 return EDIT_PART_VALUE
         
-        # БЕЗОПАСНОЕ обновление с использованием словаря
-        allowed_fields = {
-            'name': 'name',
-            'part_number': 'part_number', 
-            'quantity': 'quantity',
-            'unit': 'unit',
-            'min_stock': 'min_stock'
-        }
-        
-        if field not in allowed_fields:
-            await update.message.reply_text('❌ Неверное поле для редактирования!')
+        if field != 'quantity' and field not in EDITABLE_FIELDS:
+            await reply(update, '❌ Неверное поле для редактирования!')
             return ConversationHandler.END
         
-        # Безопасное выполнение запроса
-        sql = f'UPDATE parts SET {allowed_fields[field]} = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?'
-        cursor.execute(sql, (new_value, part_data['id']))
-        
         if field == 'quantity':
-            quantity_diff = new_value - part_data['quantity']
-            if quantity_diff != 0:
-                transaction_type = 'incoming' if quantity_diff > 0 else 'outgoing'
-                cursor.execute(
-                    'INSERT INTO transactions (part_id, type, quantity) VALUES (?, ?, ?)',
-                    (part_data['id'], transaction_type, abs(quantity_diff))
-                )
+            # Общий остаток меняется на разницу со складом, разница пишется в журнал
+            quantity_diff = new_value - part_data['location_quantity']
+            storage.ledger.move(part_data['id'], part_data['location'], quantity_diff, update_id=update.update_id)
+        else:
+            storage.parts.update(part_data['id'], field, new_value)
         
-        conn.commit()
+        if field == 'part_number':
+            part_number_index.remove(part_data['part_number'])
+            part_number_index.add(new_value)
+        if field in ['name', 'part_number', 'unit']:
+            part_data[field] = new_value
+            part_prefix_index.add(part_data['id'], part_data['name'], part_data['part_number'], part_data['unit'])
         
-        await update.message.reply_text(
+        if field in ['quantity', 'min_stock']:
+            # part_data прочитана в начале диалога, общий остаток берем после записи
+            part = storage.parts.get(part_data['id'])
+            if field == 'quantity':
+                low_stock_alerts.note_change(part._replace(quantity=part.quantity - quantity_diff), part.quantity)
+            else:
+                low_stock_alerts.note_change(part._replace(min_stock=part_data['min_stock']), part.quantity, new_value)
+        
+        await reply(
+            update,
             f'✅ Запчасть успешно обновлена!\n\n'
             f'Поле "{field}" изменено на: {new_value}',
             reply_markup=get_main_keyboard()
@@ -813,12 +914,17 @@ async def edit_part_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop('edit_part', None)
         context.user_data.pop('edit_field', None)
         
+    except DuplicateUpdate:
+        await reply_already_processed(update)
+    except PartNumberTaken:
+        await reply(update, '❌ Запчасть с таким кодом уже существует! Введите другой код:')
+        return EDIT_PART_VALUE
     except ValueError:
-        await update.message.reply_text('❌ Неверный формат! Введите числовое значение:')
+        await reply(update, '❌ Неверный формат! Введите числовое значение:')
         return EDIT_PART_VALUE
     except Exception as e:
-        logger.error(f"Ошибка при редактировании запчасти: {e}")
-        await update.message.reply_text('❌ Ошибка при обновлении.')
+        logger.error("Ошибка при редактировании запчасти: %s", e)
+        await reply(update, '❌ Ошибка при обновлении.')
     
     return ConversationHandler.END
 
@@ -827,10 +933,12 @@ async def incoming_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await auth_middleware(update, context):
         return ConversationHandler.END
         
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите данные прихода:\n'
-        'Код детали | Количество\n\n'
-        'Пример: 6305-2RS | 10\n\n'
+        'Код детали | Количество [| Склад]\n\n'
+        'Пример: 6305-2RS | 10\n'
+        f'Склад по умолчанию: {get_operation_location(context)}\n\n'
         '❌ Отмена - отменить приход',
         reply_markup=get_cancel_keyboard()
     )
@@ -844,50 +952,44 @@ async def incoming_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         data = update.message.text.split('|')
         if len(data) < 2:
-            await update.message.reply_text('❌ Неверный формат. Используйте: Код детали | Количество')
+            await reply(update, '❌ Неверный формат. Используйте: Код детали | Количество')
             return INCOMING
         
         part_number = data[0].strip()
         quantity = int(data[1].strip())
+        location = data[2].strip() if len(data) > 2 and data[2].strip() else get_operation_location(context)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM parts WHERE part_number = ?', (part_number,))
-        part = cursor.fetchone()
+        part, suggestions = find_part(part_number)
         
         if not part:
-            await update.message.reply_text('❌ Запчасть не найдена!')
+            # Кнопка подсказки повторяет ввод с исправленным кодом
+            suffix = ''.join(f' | {item.strip()}' for item in data[1:])
+            await reply_part_not_found(update, '❌ Запчасть не найдена!', suggestions, suffix)
             return INCOMING
         
-        new_quantity = part[3] + quantity
-        cursor.execute(
-            'UPDATE parts SET quantity = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-            (new_quantity, part[0])
-        )
+        new_quantity = part.quantity + quantity
+        get_storage().ledger.move(part.id, location, quantity, update_id=update.update_id)
+        low_stock_alerts.note_change(part, new_quantity)
         
-        cursor.execute(
-            'INSERT INTO transactions (part_id, type, quantity) VALUES (?, ?, ?)',
-            (part[0], 'incoming', quantity)
-        )
-        
-        conn.commit()
-        
-        await update.message.reply_text(
+        await reply(
+            update,
             f'✅ Приход оформлен:\n'
-            f'Запчасть: {part[1]}\n'
-            f'Код: {part[2]}\n'
-            f'Количество: +{quantity} {part[4]}\n'
-            f'Новый остаток: {new_quantity} {part[4]}',
+            f'Запчасть: {part.name}\n'
+            f'Код: {part.part_number}\n'
+            f'Количество: +{quantity} {part.unit}\n'
+            f'Склад: {location}\n'
+            f'Новый остаток: {new_quantity} {part.unit}',
             reply_markup=get_main_keyboard()
         )
         
+    except DuplicateUpdate:
+        await reply_already_processed(update)
     except ValueError:
-        await update.message.reply_text('❌ Ошибка: количество должно быть числом!')
+        await reply(update, '❌ Ошибка: количество должно быть числом!')
         return INCOMING
     except Exception as e:
-        logger.error(f"Ошибка при приходе: {e}")
-        await update.message.reply_text('❌ Ошибка при обработке прихода.')
+        logger.error("Ошибка при приходе: %s", e)
+        await reply(update, '❌ Ошибка при обработке прихода.')
     
     return ConversationHandler.END
 
@@ -896,10 +998,12 @@ async def outgoing_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await auth_middleware(update, context):
         return ConversationHandler.END
         
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите данные расхода:\n'
-        'Код детали | Количество\n\n'
-        'Пример: 6305-2RS | 2\n\n'
+        'Код детали | Количество [| Склад]\n\n'
+        'Пример: 6305-2RS | 2\n'
+        f'Склад по умолчанию: {get_operation_location(context)}\n\n'
         '❌ Отмена - отменить расход',
         reply_markup=get_cancel_keyboard()
     )
@@ -913,59 +1017,56 @@ async def outgoing_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         data = update.message.text.split('|')
         if len(data) < 2:
-            await update.message.reply_text('❌ Неверный формат. Используйте: Код детали | Количество')
+            await reply(update, '❌ Неверный формат. Используйте: Код детали | Количество')
             return OUTGOING
         
         part_number = data[0].strip()
         quantity = int(data[1].strip())
+        location = data[2].strip() if len(data) > 2 and data[2].strip() else get_operation_location(context)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM parts WHERE part_number = ?', (part_number,))
-        part = cursor.fetchone()
+        part, suggestions = find_part(part_number)
         
         if not part:
-            await update.message.reply_text('❌ Запчасть не найдена!')
+            # Кнопка подсказки повторяет ввод с исправленным кодом
+            suffix = ''.join(f' | {item.strip()}' for item in data[1:])
+            await reply_part_not_found(update, '❌ Запчасть не найдена!', suggestions, suffix)
             return OUTGOING
         
-        if part[3] < quantity:
-            await update.message.reply_text(
+        available = get_storage().parts.location_quantity(part.id, location)
+        if available < quantity:
+            await reply(
+                update,
                 f'❌ Недостаточно на складе!\n'
-                f'Запчасть: {part[1]}\n'
-                f'Доступно: {part[3]} {part[4]}\n'
-                f'Требуется: {quantity} {part[4]}'
+                f'Запчасть: {part.name}\n'
+                f'Склад: {location}\n'
+                f'Доступно: {available} {part.unit}\n'
+                f'Требуется: {quantity} {part.unit}'
             )
             return OUTGOING
         
-        new_quantity = part[3] - quantity
-        cursor.execute(
-            'UPDATE parts SET quantity = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-            (new_quantity, part[0])
-        )
-        
-        cursor.execute(
-            'INSERT INTO transactions (part_id, type, quantity) VALUES (?, ?, ?)',
-            (part[0], 'outgoing', quantity)
-        )
-        
-        conn.commit()
+        new_quantity = part.quantity - quantity
+        get_storage().ledger.move(part.id, location, -quantity, update_id=update.update_id)
+        low_stock_alerts.note_change(part, new_quantity)
         
-        await update.message.reply_text(
+        await reply(
+            update,
             f'✅ Расход оформлен:\n'
-            f'Запчасть: {part[1]}\n'
-            f'Код: {part[2]}\n'
-            f'Количество: -{quantity} {part[4]}\n'
-            f'Новый остаток: {new_quantity} {part[4]}',
+            f'Запчасть: {part.name}\n'
+            f'Код: {part.part_number}\n'
+            f'Количество: -{quantity} {part.unit}\n'
+            f'Склад: {location}\n'
+            f'Новый остаток: {new_quantity} {part.unit}',
             reply_markup=get_main_keyboard()
         )
         
+    except DuplicateUpdate:
+        await reply_already_processed(update)
     except ValueError:
-        await update.message.reply_text('❌ Ошибка: количество должно быть числом!')
+        await reply(update, '❌ Ошибка: количество должно быть числом!')
         return OUTGOING
     except Exception as e:
-        logger.error(f"Ошибка при расходе: {e}")
-        await update.message.reply_text('❌ Ошибка при обработке расхода.')
+        logger.error("Ошибка при расходе: %s", e)
+        await reply(update, '❌ Ошибка при обработке расхода.')
     
     return ConversationHandler.END
 
@@ -974,7 +1075,8 @@ async def search_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await auth_middleware(update, context):
         return ConversationHandler.END
         
-    await update.message.reply_text(
+    await reply(
+        update,
         'Введите номер или название запчасти для поиска:\n\n'
         '❌ Отмена - отменить поиск',
         reply_markup=get_cancel_keyboard()
@@ -987,100 +1089,489 @@ async def search_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
         
     search_term = update.message.text.strip()
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'SELECT * FROM parts WHERE name LIKE ? OR part_number LIKE ?',
-        (f'%{search_term}%', f'%{search_term}%')
-    )
-    parts = cursor.fetchall()
+    location = get_location_filter(context)
+    parts = get_storage().parts.search(search_term, location)
     
     if not parts:
-        await update.message.reply_text('🔍 Запчасти не найдены.', reply_markup=get_main_keyboard())
+        await reply(update, '🔍 Запчасти не найдены.', reply_markup=get_main_keyboard())
     else:
-        message = "🔍 Результаты поиска:\n\n"
+        message = f"🔍 Результаты поиска{f' (склад: {location})' if location else ''}:\n\n"
         for part in parts:
-            status = "⚠️ " if part[3] <= part[7] else "✅ "
-            message += f"{status}{part[1]} ({part[2]}): {part[3]} {part[4]}\n"
+            status = "⚠️ " if part.quantity <= part.min_stock else "✅ "
+            message += f"{status}{part.name} ({part.part_number}): {part.quantity} {part.unit} 📜 /history_{part.id}\n"
         
-        await update.message.reply_text(message, reply_markup=get_main_keyboard())
+        await reply(update, message, reply_markup=get_main_keyboard())
     
     return ConversationHandler.END
 
-# Показать остатки
-async def show_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await auth_middleware(update, context):
+# Inline-поиск: @бот код или название
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    if not is_user_allowed(query.from_user.id):
+        logger.warning("Неавторизованный inline-запрос: %s", query.from_user.id)
+        await query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
         return
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM parts')
-    total_count = cursor.fetchone()[0]
+
+    found = part_prefix_index.search(query.query, INLINE_RESULTS_LIMIT)
+
+    # Наименования и коды берем из индекса, остатки - свежие из хранилища
+    parts = {part.id: part for part in get_storage().parts.get_many([part_id for part_id, _, _, _ in found])}
+
+    results = []
+    for part_id, name, part_number, unit in found:
+        if part_id not in parts:
+            continue
+        quantity, min_stock = parts[part_id].quantity, parts[part_id].min_stock
+        status = "⚠️ " if quantity <= min_stock else "✅ "
+        results.append(InlineQueryResultArticle(
+            id=str(part_id),
+            title=f"{name} ({part_number})",
+            description=f"{status}Остаток: {quantity} {unit}",
+            input_message_content=InputTextMessageContent(
+                f"🏷️ {name}\n🔢 Код: {part_number}\n📦 Остаток: {quantity} {unit}"
+            )
+        ))
+
+    # Ответ зависит от прав пользователя, поэтому кэш Telegram - личный
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+# Страница остатков по курсору (name, id) без OFFSET
+def render_stock_page(location, page: int = 1, direction: str = None, cursor_id: int = None):
+    """Текст и inline-кнопки страницы остатков.
+
+    direction 'n' - страница после запчасти cursor_id, 'p' - перед ней,
+    None - первая страница. Возвращает (текст, клавиатура или None).
+    """
+    parts_repository = get_storage().parts
+    total_count = parts_repository.count(location)
     
     if total_count == 0:
-        await update.message.reply_text('📭 Нет запчастей в базе данных.')
-        return
+        return '📭 Нет запчастей в базе данных.', None
+    
+    # Лишняя строка показывает, есть ли страница дальше
+    if direction == 'p':
+        parts = parts_repository.page(location, before_id=cursor_id, limit=ITEMS_PER_PAGE)
+        has_more = len(parts) > ITEMS_PER_PAGE
+        parts = parts[-ITEMS_PER_PAGE:]
+    else:
+        parts = parts_repository.page(location, after_id=cursor_id if direction == 'n' else None, limit=ITEMS_PER_PAGE)
+        has_more = len(parts) > ITEMS_PER_PAGE
+        parts = parts[:ITEMS_PER_PAGE]
     
-    # Получаем страницу из контекста или устанавливаем первую
-    page = context.user_data.get('stock_page', 1)
-    offset = (page - 1) * ITEMS_PER_PAGE
+    if not parts:
+        # Запчасть-курсор удалена или страница опустела - начинаем сначала
+        if direction is None:
+            return '📭 Нет запчастей в базе данных.', None
+        return render_stock_page(location)
     
-    cursor.execute('SELECT * FROM parts ORDER BY name LIMIT ? OFFSET ?', (ITEMS_PER_PAGE, offset))
-    parts = cursor.fetchall()
+    if direction == 'p':
+        has_prev, has_next = has_more and page > 1, True
+    else:
+        has_prev, has_next = page > 1, has_more
     
     total_pages = (total_count + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
-    message = f"📊 Остатки на складе (стр. {page}/{total_pages})\n\n"
+    message = f"📊 Остатки на складе{f' {location}' if location else ''} (стр. {page}/{total_pages})\n\n"
     
     for part in parts:
-        status = "⚠️ " if part[3] <= part[7] else "✅ "
-        message += f"{status}{part[1]} ({part[2]}): {part[3]} {part[4]}\n"
+        status = "⚠️ " if part.quantity <= part.min_stock else "✅ "
+        message += f"{status}{part.name} ({part.part_number}): {part.quantity} {part.unit}\n"
     
-    # Добавляем кнопки навигации если нужно
-    if total_count > ITEMS_PER_PAGE:
-        has_prev = page > 1
-        has_next = page < total_pages
-        
-        reply_markup = get_navigation_keyboard(has_prev, has_next)
-        await update.message.reply_text(message, reply_markup=reply_markup)
-        
-        # Сохраняем текущую страницу
-        context.user_data['stock_page'] = page
-    else:
-        await update.message.reply_text(message, reply_markup=get_main_keyboard())
+    if not has_prev and not has_next:
+        return message, None
+    return message, get_stock_page_keyboard(page, parts[0].id, parts[-1].id, has_prev, has_next)
 
-# Генерация отчета
-async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Показать остатки
+async def show_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await auth_middleware(update, context):
         return
         
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    location = get_location_filter(context)
+    message, reply_markup = render_cache.get_or_render(
+        ('stock', location, 1, None, None),
+        lambda: render_stock_page(location)
+    )
+    await reply(update, message, reply_markup=reply_markup or get_main_keyboard())
+
+# Листание остатков: правим то же сообщение вместо отправки нового
+async def stock_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if not await auth_middleware(update, context):
+        return
     
-    cursor.execute('SELECT * FROM parts WHERE quantity <= min_stock ORDER BY quantity')
-    low_stock = cursor.fetchall()
+    try:
+        _, direction, page, cursor_id = query.data.split(':')
+        page, cursor_id = int(page), int(cursor_id)
+    except ValueError:
+        logger.warning("Неверные данные кнопки листания: %s", query.data)
+        return
     
-    cursor.execute('SELECT COUNT(*), SUM(quantity) FROM parts')
-    total_parts, total_quantity = cursor.fetchone()
+    location = get_location_filter(context)
+    message, reply_markup = render_cache.get_or_render(
+        ('stock', location, page, direction, cursor_id),
+        lambda: render_stock_page(location, page, direction, cursor_id)
+    )
+    await edit(update, message, reply_markup=reply_markup)
+
+# Генерация отчета
+def render_report(location) -> str:
+    parts_repository = get_storage().parts
+    low_stock = parts_repository.low_stock(location)
+    total_parts, total_quantity = parts_repository.totals(location)
     
-    message = "📋 Отчет по складу\n\n"
+    message = f"📋 Отчет по складу{f' {location}' if location else ''}\n\n"
     message += f"Всего позиций: {total_parts}\n"
     message += f"Общее количество: {total_quantity or 0} шт.\n\n"
     
     if low_stock:
         message += "⚠️ Критический остаток:\n"
         for part in low_stock:
-            message += f"{part[1]} ({part[2]}): {part[3]}/{part[7]} {part[4]}\n"
+            message += f"{part.name} ({part.part_number}): {part.quantity}/{part.min_stock} {part.unit}\n"
     else:
         message += "✅ Все позиции в норме"
     
-    await update.message.reply_text(message)
+    # Прогноз считается по общему остатку, для отдельного склада не показываем
+    suggestions, total = parts_repository.reorder_suggestions() if not location else ([], 0)
+    if suggestions:
+        message = message.rstrip('\n') + f"\n\n📈 Пора заказать по прогнозу расхода ({total}):\n"
+        for part in suggestions:
+            message += (
+                f"{part['name']} ({part['part_number']}): {part['quantity']}/{part['reorder_point']} {part['unit']}, "
+                f"хватит на ~{part['days_of_cover']:.0f} дн.\n"
+            )
+    
+    if low_stock or suggestions:
+        message += "\n🛒 Заказ поставщикам файлом: /order"
+    
+    return message
+
+async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await auth_middleware(update, context):
+        return
+        
+    location = get_location_filter(context)
+    message = render_cache.get_or_render(('report', location), lambda: render_report(location))
+    await reply(update, message)
+
+# Оценка стоимости склада
+async def valuation_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await auth_middleware(update, context):
+        return
+    
+    valuation = await asyncio.to_thread(get_valuation)
+    
+    message = "💰 Оценка склада\n\n"
+    message += f"Общая стоимость: {valuation['total_value']:,.2f}\n"
+    message += f"Позиций без цены: {valuation['unpriced']}\n\n"
+    
+    if valuation['by_location']:
+        message += "📍 По складам:\n"
+        for location in valuation['by_location']:
+            message += f"• {location['location']}: {location['value']:,.2f} ({location['positions']} поз.)\n"
+    
+    if valuation['top']:
+        message += "\n🏆 Больше всего средств в запасах:\n"
+        for i, part in enumerate(valuation['top'], 1):
+            message += (
+                f"{i}. {part['name']} ({part['part_number']}): "
+                f"{part['quantity']} {part['unit']} × {part['price']:,.2f} = {part['value']:,.2f}\n"
+            )
+    
+    await reply(update, message)
+
+# Остатки на дату
+async def stock_on_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Остатки на дату по ближайшему снимку и движениям после него"""
+    if not await auth_middleware(update, context):
+        return
+    
+    date_text = ' '.join(context.args).strip()
+    moment = None
+    for date_format in ('%d.%m.%Y %H:%M', '%d.%m.%Y'):
+        try:
+            moment = datetime.strptime(date_text, date_format)
+            break
+        except ValueError:
+            pass
+    
+    if moment is None:
+        await reply(
+            update,
+            '❌ Укажите дату: /stock_on ДД.ММ.ГГГГ [ЧЧ:ММ]\n\n'
+            'Пример: /stock_on 01.10.2025'
+        )
+        return
+    
+    # Дата введена в местном времени
+    snapshot_time, parts = await asyncio.to_thread(stock_as_of, moment.astimezone(timezone.utc))
+    
+    message = f"📅 Остатки на {moment.strftime('%d.%m.%Y %H:%M')}\n"
+    if snapshot_time:
+        message += f"(снимок от {snapshot_time.astimezone().strftime('%d.%m.%Y %H:%M')} с учетом движений)\n\n"
+    else:
+        message += "(текущие остатки с учетом движений)\n\n"
+    
+    in_stock = [part for part in parts if part['quantity']]
+    for part in in_stock:
+        message += f"{part['name']} ({part['part_number']}): {part['quantity']} {part['unit']}\n"
+    
+    if in_stock:
+        message += f"\nВсего позиций с остатком: {len(in_stock)}"
+    else:
+        message += "📭 На эту дату остатков нет."
+    
+    await reply(update, message)
+
+# Сверка остатков с журналом транзакций
+async def reconcile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сверка: /reconcile [full] [fix]"""
+    if not await auth_middleware(update, context):
+        return
+    
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await reply(update, "⛔ Только администратор может запускать сверку.")
+        return
+    
+    args = [arg.lower() for arg in context.args]
+    result = await asyncio.to_thread(reconcile_ledger, 'full' in args, 'fix' in args)
+    await reply(update, format_reconcile_result(result))
+
+# Заказ поставщикам
+async def order_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/order - CSV заказа по поставщикам, /order склад - по складам"""
+    if not await auth_middleware(update, context):
+        return
+    
+    group_by = 'location' if context.args and context.args[0].lower() in ('склад', 'location') else 'supplier'
+    groups = await asyncio.to_thread(build_purchase_order, group_by)
+    if not groups:
+        await reply(update, "✅ Заказывать нечего: все позиции выше точки заказа.")
+        return
+    
+    await reply_document(
+        update,
+        purchase_order_csv(groups, group_by),
+        f"order_{datetime.now():%Y%m%d}.csv",
+        caption=f"🛒 Заказ: {sum(len(lines) for _, lines in groups)} поз., групп: {len(groups)}"
+    )
+
+# История движений запчасти
+HISTORY_ICONS = {
+    'incoming': ('📦', '+'),
+    'outgoing': ('📤', '-'),
+    'transfer_in': ('🔄', '+'),
+    'transfer_out': ('🔄', '-'),
+}
+
+def render_history_page(part_id: int, page: int = 1, direction: str = None, cursor_id: int = None, balance: int = None):
+    """Текст и inline-кнопки страницы истории запчасти.
+
+    direction 'n' - движения старше cursor_id, 'p' - новее него, None -
+    последние движения. balance - общий остаток на границе страницы из
+    кнопки листания. Возвращает (текст, клавиатура или None).
+    """
+    storage = get_storage()
+    part = storage.parts.get(part_id)
+    if part is None:
+        return '❌ Запчасть не найдена!', None
+    
+    if direction == 'p':
+        rows, has_more = storage.ledger.history(part_id, balance, before_id=cursor_id)
+        has_prev, has_next = has_more and page > 1, True
+    elif direction == 'n':
+        rows, has_more = storage.ledger.history(part_id, balance, after_id=cursor_id)
+        has_prev, has_next = page > 1, has_more
+    else:
+        rows, has_more = storage.ledger.history(part_id, part.quantity)
+        has_prev, has_next = False, has_more
+    
+    if not rows and direction is not None:
+        # Движение-курсор удалено вместе с историей - начинаем с последних движений
+        return render_history_page(part_id)
+    
+    message = f"📜 История: {part.name} ({part.part_number}), стр. {page}\n"
+    message += f"Остаток сейчас: {part.quantity} {part.unit}\n\n"
+    if not rows:
+        message += "📭 Движений нет."
+    
+    for row in rows:
+        icon, sign = HISTORY_ICONS.get(row['type'], ('•', ''))
+        created_at = datetime.strptime(row['created_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        message += (
+            f"{created_at.astimezone():%d.%m.%Y %H:%M} {icon} {sign}{row['quantity']} ({row['location'] or '-'}) "
+            f"→ {row['balance']}"
+        )
+        if row['comment']:
+            message += f" - {row['comment']}"
+        message += "\n"
+    
+    if not has_prev and not has_next:
+        return message, None
+    # Остаток до самого старого движения страницы - начало следующей страницы
+    first = (rows[0]['id'], rows[0]['balance'])
+    last = (rows[-1]['id'], rows[-1]['balance'] - rows[-1]['delta'])
+    return message, get_history_page_keyboard(part_id, page, first, last, has_prev, has_next)
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/history КОД или /history_<id> (ссылка из результатов поиска)"""
+    if not await auth_middleware(update, context):
+        return
+    
+    command, _, part_number = update.message.text.partition(' ')
+    command = command.split('@')[0]
+    if command.startswith('/history_'):
+        part = get_storage().parts.get(int(command[len('/history_'):]))
+    else:
+        part_number = part_number.strip()
+        if not part_number:
+            await reply(update, '❌ Укажите код: /history КОД\n\nПример: /history 6305-2RS')
+            return
+        part, suggestions = find_part(part_number)
+        if not part:
+            await reply_part_not_found(update, '❌ Запчасть не найдена!', [f'/history {code}' for code in suggestions])
+            return
+    
+    if part is None:
+        await reply(update, '❌ Запчасть не найдена!')
+        return
+    
+    message, reply_markup = render_cache.get_or_render(('history', part.id, 1), lambda: render_history_page(part.id))
+    await reply(update, message, reply_markup=reply_markup)
+
+async def history_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if not await auth_middleware(update, context):
+        return
+    
+    try:
+        _, direction, part_id, page, cursor_id, balance = query.data.split(':')
+        part_id, page, cursor_id, balance = int(part_id), int(page), int(cursor_id), int(balance)
+    except ValueError:
+        logger.warning("Неверные данные кнопки листания истории: %s", query.data)
+        return
+    
+    message, reply_markup = render_cache.get_or_render(
+        ('history', part_id, page, direction, cursor_id, balance),
+        lambda: render_history_page(part_id, page, direction, cursor_id, balance)
+    )
+    await edit(update, message, reply_markup=reply_markup)
+
+# Выбор склада для просмотра
+async def location_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/location - список складов, /location <склад> - фильтр, /location все - сброс"""
+    if not await auth_middleware(update, context):
+        return
+    
+    location = ' '.join(context.args).strip()
+    if location.lower() in ('все', 'all'):
+        context.user_data.pop('location', None)
+        await reply(update, '📍 Показываются все склады.', reply_markup=get_main_keyboard())
+        return
+    if location:
+        context.user_data['location'] = location
+        await reply(
+            update,
+            f'📍 Выбран склад: {location}\n\n'
+            'Остатки, отчет и поиск показываются по этому складу,\n'
+            'приход и расход оформляются на него.\n'
+            '/location все - показать все склады',
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    locations = get_storage().parts.locations()
+    
+    current = get_location_filter(context) or 'все склады'
+    message = f"📍 Склады (выбран: {current}):\n\n"
+    for name, positions, quantity in locations:
+        message += f"• {name}: {positions} поз., {quantity} ед.\n"
+    if not locations:
+        message += "📭 Остатков нет.\n"
+    message += "\nВыбрать склад: /location Название"
+    await reply(update, message)
+
+# Перемещение между складами
+async def transfer_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await auth_middleware(update, context):
+        return ConversationHandler.END
+        
+    await reply(
+        update,
+        'Введите данные перемещения:\n'
+        'Код детали | Количество | Откуда | Куда\n\n'
+        f'Пример: 6305-2RS | 4 | {DEFAULT_LOCATION} | цех 2\n\n'
+        '❌ Отмена - отменить перемещение',
+        reply_markup=get_cancel_keyboard()
+    )
+    return TRANSFER
+
+async def transfer_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.text == '❌ Отмена':
+        await cancel(update, context)
+        return ConversationHandler.END
+        
+    try:
+        data = [item.strip() for item in update.message.text.split('|')]
+        if len(data) < 4 or not data[2] or not data[3]:
+            await reply(update, '❌ Неверный формат. Используйте: Код детали | Количество | Откуда | Куда')
+            return TRANSFER
+        
+        part_number, from_location, to_location = data[0], data[2], data[3]
+        quantity = int(data[1])
+        if quantity <= 0 or from_location == to_location:
+            await reply(update, '❌ Количество должно быть больше нуля, а склады - разными.')
+            return TRANSFER
+        
+        part, suggestions = find_part(part_number)
+        
+        if not part:
+            suffix = ''.join(f' | {item}' for item in data[1:])
+            await reply_part_not_found(update, '❌ Запчасть не найдена!', suggestions, suffix)
+            return TRANSFER
+        
+        storage = get_storage()
+        if not storage.ledger.transfer(part.id, from_location, to_location, quantity, update_id=update.update_id):
+            available = storage.parts.location_quantity(part.id, from_location)
+            await reply(
+                update,
+                f'❌ Недостаточно на складе {from_location}!\n'
+                f'Доступно: {available} {part.unit}\n'
+                f'Требуется: {quantity} {part.unit}'
+            )
+            return TRANSFER
+        
+        await reply(
+            update,
+            f'✅ Перемещение оформлено:\n'
+            f'Запчасть: {part.name}\n'
+            f'Код: {part.part_number}\n'
+            f'Количество: {quantity} {part.unit}\n'
+            f'{from_location} → {to_location}',
+            reply_markup=get_main_keyboard()
+        )
+        
+    except DuplicateUpdate:
+        await reply_already_processed(update)
+    except ValueError:
+        await reply(update, '❌ Ошибка: количество должно быть числом!')
+        return TRANSFER
+    except Exception as e:
+        logger.error("Ошибка при перемещении: %s", e)
+        await reply(update, '❌ Ошибка при обработке перемещения.')
+    
+    return ConversationHandler.END
 
 # Отмена действия
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Выбранный склад - настройка пользователя, а не состояние диалога
+    location = context.user_data.get('location')
     context.user_data.clear()
-    await update.message.reply_text(
+    if location:
+        context.user_data['location'] = location
+    await reply(
+        update,
         '❌ Действие отменено.',
         reply_markup=get_main_keyboard()
     )
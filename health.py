@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from config import HEALTH_HOST, HEALTH_PORT, HEALTH_REFRESH_INTERVAL
+from database import last_backup_time
+from storage import get_storage
+from send_queue import send_queue
+from auth import unauthorized_senders
+
+logger = logging.getLogger(__name__)
+
+# Сколько пропущенных замеров БД подряд считается неготовностью
+STALE_REFRESHES = 3
+
+# Сколько ждать строку запроса от клиента
+REQUEST_TIMEOUT = 5
+
+def measure_database() -> dict:
+    """Замер БД (в отдельном потоке): время чтения счетчиков строк и последний бэкап"""
+    storage = get_storage()
+    started = time.perf_counter()
+    parts = storage.parts.count()
+    transactions = storage.ledger.count()
+    latency_ms = (time.perf_counter() - started) * 1000
+    backup_at = last_backup_time()
+    return {
+        'latency_ms': round(latency_ms, 2),
+        'parts': parts,
+        'transactions': transactions,
+        'last_backup_at': backup_at.isoformat(sep=' ', timespec='seconds') if backup_at else None,
+        'last_backup_age_s': round((datetime.now() - backup_at).total_seconds()) if backup_at else None,
+    }
+
+class HealthServer:
+    """HTTP-эндпоинт состояния бота для мониторинга, только для локальных запросов.
+
+    GET /live - event loop отвечает; GET /ready - БД недавно отвечала и
+    очередь отправки работает; GET /stats - все показатели. Ответы
+    собираются из памяти: БД замеряется фоновой задачей раз в
+    refresh_interval секунд, сколько бы раз ни опрашивал мониторинг.
+    """
+
+    def __init__(self, host: str = HEALTH_HOST, port: int = HEALTH_PORT,
+                 refresh_interval: float = HEALTH_REFRESH_INTERVAL):
+        self.host = host
+        self.port = port
+        self.refresh_interval = refresh_interval
+        self.requests = 0
+        self._server = None
+        self._refresher = None
+        self._started = None
+        self._database = {}
+        self._database_error = None
+        self._measured_at = None  # time.monotonic() последнего удачного замера
+        self._loop_lag_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    async def start(self):
+        if not self.port:
+            return
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logger.error("Эндпоинт состояния не запущен на %s:%s: %s", self.host, self.port, e)
+            return
+        self._started = time.monotonic()
+        self._refresher = asyncio.get_running_loop().create_task(self._refresh(), name='health_refresh')
+        logger.info("Эндпоинт состояния: http://%s:%s/stats", self.host, self.port)
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._refresher.cancel()
+        try:
+            await self._refresher
+        except asyncio.CancelledError:
+            pass
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        self._refresher = None
+
+    async def _refresh(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                self._database = await asyncio.to_thread(measure_database)
+                self._database_error = None
+                self._measured_at = time.monotonic()
+            except Exception as e:
+                self._database_error = str(e)
+                logger.error("Ошибка замера БД для эндпоинта состояния: %s", e)
+            # Насколько позже срока проснулась задача - задержка event loop
+            expected = loop.time() + self.refresh_interval
+            await asyncio.sleep(self.refresh_interval)
+            self._loop_lag_ms = max(loop.time() - expected, 0.0) * 1000
+
+    def ready(self) -> bool:
+        fresh = (self._measured_at is not None
+                 and time.monotonic() - self._measured_at < self.refresh_interval * STALE_REFRESHES)
+        return fresh and self._database_error is None and send_queue.running
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            'ready': self.ready(),
+            'uptime_s': round(now - self._started),
+            'loop_lag_ms': round(self._loop_lag_ms, 2),
+            'database': {
+                **self._database,
+                'measured_age_s': round(now - self._measured_at, 1) if self._measured_at is not None else None,
+                'error': self._database_error,
+            },
+            'send_queue': send_queue.stats(),
+            'unauthorized': unauthorized_senders.stats(),
+        }
+
+    async def _handle(self, reader, writer):
+        self.requests += 1
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            method, path, *_ = request_line.decode('latin-1').split() or ('', '')
+            if method != 'GET':
+                status, body = '405 Method Not Allowed', {'error': 'method not allowed'}
+            elif path == '/live':
+                status, body = '200 OK', {'alive': True}
+            elif path == '/ready':
+                ready = self.ready()
+                status, body = ('200 OK' if ready else '503 Service Unavailable'), {'ready': ready}
+            elif path == '/stats':
+                status, body = '200 OK', self.stats()
+            else:
+                status, body = '404 Not Found', {'error': 'not found'}
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: application/json; charset=utf-8\r\n'
+                f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+# Общий эндпоинт бота
+health_server = HealthServer()
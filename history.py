@@ -0,0 +1,76 @@
+from database import get_db_connection, SIGNED_QUANTITY
+
+# Сколько движений на одной странице истории
+HISTORY_PAGE_SIZE = 10
+
+# Страница движений запчасти по индексу (part_id, created_at DESC, id DESC) горячей
+# и архивной таблиц: SQLite сливает обе выборки без сортировки и читает не больше
+# limit строк, сколько бы движений ни было у запчасти. Остаток после каждого
+# движения считается оконной функцией только по строкам страницы от остатка
+# на границе страницы (balance), а не по всей истории.
+OLDER_QUERY = f'''
+SELECT id, type, quantity, location, comment, created_at, delta,
+       ? - (SUM(delta) OVER (ORDER BY created_at DESC, id DESC ROWS UNBOUNDED PRECEDING) - delta) AS balance
+FROM (
+    SELECT id, type, quantity, location, comment, created_at, {SIGNED_QUANTITY} AS delta
+    FROM all_transactions
+    WHERE part_id = ? {{cursor}}
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+)
+'''
+
+NEWER_QUERY = f'''
+SELECT id, type, quantity, location, comment, created_at, delta,
+       ? + SUM(delta) OVER (ORDER BY created_at, id ROWS UNBOUNDED PRECEDING) AS balance
+FROM (
+    SELECT id, type, quantity, location, comment, created_at, {SIGNED_QUANTITY} AS delta
+    FROM all_transactions
+    WHERE part_id = ? AND (created_at, id) > (?, ?)
+    ORDER BY created_at, id
+    LIMIT ?
+)
+'''
+
+def _created_at(cursor, transaction_id):
+    cursor.execute('SELECT created_at FROM all_transactions WHERE id = ?', (transaction_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def part_history(part_id: int, balance: int, after_id: int = None, before_id: int = None,
+                 limit: int = HISTORY_PAGE_SIZE):
+    """Страница движений запчасти от новых к старым.
+
+    Без курсора - самые новые движения, balance - текущий остаток.
+    after_id - движения старше него, balance - остаток до него.
+    before_id - движения новее него, balance - остаток после него.
+    Возвращает (строки страницы, есть ли еще страница в направлении
+    листания); в строке: id, type, quantity, location, comment,
+    created_at (UTC), delta - изменение общего остатка, balance -
+    общий остаток после движения.
+    """
+    cursor = get_db_connection().cursor()
+    cursor_id = before_id if before_id is not None else after_id
+    created_at = None
+    if cursor_id is not None:
+        created_at = _created_at(cursor, cursor_id)
+        if created_at is None:
+            return [], False
+
+    if before_id is not None:
+        cursor.execute(NEWER_QUERY, (balance, part_id, created_at, before_id, limit + 1))
+        rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        return rows, has_more
+
+    if after_id is not None:
+        cursor.execute(
+            OLDER_QUERY.format(cursor='AND (created_at, id) < (?, ?)'),
+            (balance, part_id, created_at, after_id, limit + 1)
+        )
+    else:
+        cursor.execute(OLDER_QUERY.format(cursor=''), (balance, part_id, limit + 1))
+    rows = cursor.fetchall()
+    return rows[:limit], len(rows) > limit
@@ -1,4 +1,4 @@
-from telegram import ReplyKeyboardMarkup
+from telegram import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 
 # Утилиты для создания клавиатур
 def get_cancel_keyboard():
@@ -11,19 +11,36 @@ def get_main_keyboard():
         ['➕ Добавить запчасть', '✏️ Редактировать запчасть'],
         ['🗑️ Удалить запчасть', '📋 Отчет'],
         ['👑 Управление пользователями', '💾 Бэкапы'],
+        ['🔄 Перемещение', '💰 Оценка склада'],
         ['❓ Помощь']
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
-def get_navigation_keyboard(has_prev: bool, has_next: bool):
-    """Клавиатура для навигации по страницам"""
-    keyboard = []
+def get_stock_page_keyboard(page: int, first_id: int, last_id: int, has_prev: bool, has_next: bool):
+    """Inline-кнопки листания остатков.
+
+    В callback_data лежит курсор: номер страницы и id крайней запчасти,
+    поэтому сервер не хранит, на какой странице находится пользователь.
+    """
+    buttons = []
     if has_prev:
-        keyboard.append(['◀️ Предыдущая страница'])
+        buttons.append(InlineKeyboardButton('◀️', callback_data=f'stock:p:{page - 1}:{first_id}'))
     if has_next:
-        keyboard.append(['▶️ Следующая страница'])
-    keyboard.append(['📋 Главное меню'])
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        buttons.append(InlineKeyboardButton('▶️', callback_data=f'stock:n:{page + 1}:{last_id}'))
+    return InlineKeyboardMarkup([buttons])
+
+def get_history_page_keyboard(part_id: int, page: int, first: tuple, last: tuple, has_prev: bool, has_next: bool):
+    """Inline-кнопки листания истории движений запчасти.
+
+    first и last - (id движения, остаток на границе страницы): курсор
+    и остаток, от которого считается соседняя страница.
+    """
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton('◀️', callback_data=f'hist:p:{part_id}:{page - 1}:{first[0]}:{first[1]}'))
+    if has_next:
+        buttons.append(InlineKeyboardButton('▶️', callback_data=f'hist:n:{part_id}:{page + 1}:{last[0]}:{last[1]}'))
+    return InlineKeyboardMarkup([buttons])
 
 def get_users_management_keyboard():
     """Клавиатура для управления пользователями"""
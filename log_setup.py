@@ -0,0 +1,98 @@
+import functools
+import json
+import logging
+import queue
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Поля из extra=..., которые попадают в JSON-запись
+STRUCTURED_FIELDS = ('user_id', 'chat_id', 'handler', 'duration_ms')
+
+# Время обработки обновлений пишется отдельным логгером, его легко отфильтровать
+timing_logger = logging.getLogger('updates')
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись: время (UTC), уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LazyQueueHandler(QueueHandler):
+    """Кладет запись в очередь как есть.
+
+    Стандартный QueueHandler форматирует сообщение и трассировку еще в
+    вызывающем потоке; здесь это делает поток QueueListener, поэтому
+    event loop тратит на запись лога только put в очередь. Аргументы
+    сообщения форматируются чуть позже вызова, передавать в лог
+    изменяемые объекты, которые тут же меняются, не стоит.
+    """
+
+    def prepare(self, record):
+        return record
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, path: str = LOG_FILE):
+    """Все логгеры пишут в очередь, запись на диск или в stderr - в отдельном потоке"""
+    global _listener
+    if _listener is not None:
+        return
+
+    target = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler()
+    target.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, target)
+    _listener.start()
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи (при остановке бота)"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+def timed_handler(callback):
+    """Оборачивает обработчик обновлений: пишет его длительность с user_id и именем"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            user = getattr(update, 'effective_user', None)
+            timing_logger.info(
+                "%s: %.1f мс", callback.__name__, duration_ms,
+                extra={
+                    'user_id': user.id if user else None,
+                    'handler': callback.__name__,
+                    'duration_ms': round(duration_ms, 2),
+                }
+            )
+    return wrapper
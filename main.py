@@ -1,63 +1,91 @@
 import logging
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from telegram.ext import Application, ConversationHandler, MessageHandler, CommandHandler, filters
-from telegram.error import TelegramError
-from config import BOT_TOKEN
-from database import init_db, close_db, start_auto_backup, stop_auto_backup
-from handlers import *
-from keyboards import get_main_keyboard
+from telegram import Update
+from telegram.ext import Application, ContextTypes, ConversationHandler, MessageHandler, CommandHandler, InlineQueryHandler, CallbackQueryHandler, TypeHandler, filters
+from send_queue import send_queue, reply
+from log_setup import setup_logging, stop_logging, timed_handler
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Глобальная переменная для отслеживания состояния
 bot_start_time = None
 
+# Момент запуска процесса и начала опроса Telegram (для замеров этапов запуска)
+boot_started = None
+polling_started = None
+
+@contextmanager
+def boot_phase(name: str):
+    """Этап запуска: пишет в лог его длительность"""
+    started = time.perf_counter()
+    logger.info("Запуск: %s...", name)
+    yield
+    logger.info("Запуск: %s - %.2f с", name, time.perf_counter() - started)
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     try:
-        logger.error(f"Ошибка в обработчике: {context.error}", exc_info=context.error)
+        logger.error("Ошибка в обработчике: %s", context.error, exc_info=context.error)
         
         # Если ошибка связана с конкретным сообщением
         if update and hasattr(update, 'message') and update.message:
-            await update.message.reply_text(
+            await reply(
+                update,
                 "⚠️ Произошла ошибка. Попробуйте еще раз или обратитесь к администратору."
             )
     except Exception as e:
-        logger.error(f"Ошибка в обработчике ошибок: {e}")
+        logger.error("Ошибка в обработчике ошибок: %s", e)
 
 async def post_init(application: Application):
     """Функция, вызываемая после инициализации бота"""
+    from changelog import changelog_feed
+    from scheduler import schedule_jobs
+    from health import health_server
+    
     global bot_start_time
     bot_start_time = datetime.now()
-    logger.info(f"Бот успешно запущен в {bot_start_time}")
+    send_queue.start(application.bot)
+    changelog_feed.start()
+    await health_server.start()
+    schedule_jobs(application.job_queue)
+    logger.info("Запуск: опрос Telegram - %.2f с", time.perf_counter() - polling_started)
+    logger.info("Бот успешно запущен в %s, запуск занял %.2f с", bot_start_time, time.perf_counter() - boot_started)
 
 async def post_stop(application: Application):
     """Функция, вызываемая при остановке бота"""
+    from alerts import low_stock_alerts
+    from changelog import changelog_feed
+    from database import close_db
+    from health import health_server
+    
+    low_stock_alerts.flush()
+    await health_server.stop()
+    await changelog_feed.stop()
+    await send_queue.stop()
     logger.info("Бот остановлен")
     close_db()
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для проверки статуса бота"""
+    from handlers import auth_middleware
+    from storage import get_storage
+    from config import ALLOWED_USERS
+    from auth import unauthorized_senders
+    
     if not await auth_middleware(update, context):
         return
         
     global bot_start_time
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    storage = get_storage()
     
     # Получаем статистику
-    cursor.execute('SELECT COUNT(*) FROM parts')
-    parts_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM transactions')
-    transactions_count = cursor.fetchone()[0]
+    parts_count = storage.parts.count()
+    transactions_count = storage.ledger.count()
     
     uptime = datetime.now() - bot_start_time if bot_start_time else "неизвестно"
+    rejected = unauthorized_senders.stats()
     
     status_message = (
         "🤖 Статус бота:\n\n"
@@ -66,154 +94,219 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• Запчастей в базе: {parts_count}\n"
         f"• Операций в истории: {transactions_count}\n"
         f"• Пользователей: {len(ALLOWED_USERS)}\n"
+        f"• Чужих обновлений: {rejected['rejected']} (ответов: {rejected['replied']}, отброшено молча: {rejected['dropped']})\n"
         f"• Версия: 2.0\n"
         "• Статус: ✅ Работает нормально"
     )
     
-    await update.message.reply_text(status_message)
+    await reply(update, status_message)
+
+def instrument_handlers(application: Application):
+    """Оборачивает колбэки обработчиков в timed_handler, у диалогов - все шаги.
+
+    Группа -1 (отсев чужих обновлений) не оборачивается, чтобы не писать
+    в лог по записи на каждое отброшенное сообщение.
+    """
+    pending = [handler for group, handlers in application.handlers.items() if group >= 0 for handler in handlers]
+    while pending:
+        handler = pending.pop()
+        if isinstance(handler, ConversationHandler):
+            pending.extend(handler.entry_points)
+            pending.extend(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                pending.extend(state_handlers)
+        else:
+            handler.callback = timed_handler(handler.callback)
+
+def register_handlers(application: Application):
+    """Регистрирует обработчики команд и диалогов"""
+    import handlers
+    
+    # Добавляем обработчики ошибок
+    application.add_error_handler(error_handler)
+    
+    # Неразрешенные пользователи отсекаются раньше фильтров всех диалогов
+    application.add_handler(TypeHandler(Update, handlers.reject_unauthorized), group=-1)
+    
+    conv_handler_add = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['➕ Добавить запчасть']), handlers.add_part_start)],
+        states={
+            handlers.ADD_PART_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.add_part_name)],
+            handlers.ADD_PART_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.add_part_number)],
+            handlers.ADD_PART_QUANTITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.add_part_quantity)],
+            handlers.ADD_PART_UNIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.add_part_unit)],
+            handlers.ADD_PART_MIN_STOCK: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.add_part_min_stock)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="add_part_conversation"
+    )
+    
+    conv_handler_edit = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['✏️ Редактировать запчасть']), handlers.edit_part_start)],
+        states={
+            handlers.EDIT_PART_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.edit_part_select)],
+            handlers.EDIT_PART_FIELD: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.edit_part_field)],
+            handlers.EDIT_PART_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.edit_part_value)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="edit_part_conversation"
+    )
+    
+    conv_handler_delete = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['🗑️ Удалить запчасть']), handlers.delete_part_start)],
+        states={
+            handlers.DELETE_PART_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.delete_part_select)],
+            handlers.DELETE_PART_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.delete_part_confirm)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="delete_part_conversation"
+    )
+    
+    conv_handler_incoming = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['📦 Приход']), handlers.incoming_start)],
+        states={
+            handlers.INCOMING: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.incoming_process)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="incoming_conversation"
+    )
+    
+    conv_handler_outgoing = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['📤 Расход']), handlers.outgoing_start)],
+        states={
+            handlers.OUTGOING: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.outgoing_process)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="outgoing_conversation"
+    )
+    
+    conv_handler_transfer = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['🔄 Перемещение']), handlers.transfer_start)],
+        states={
+            handlers.TRANSFER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.transfer_process)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="transfer_conversation"
+    )
+    
+    conv_handler_search = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['🔍 Поиск']), handlers.search_start)],
+        states={
+            handlers.SEARCH: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.search_process)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="search_conversation"
+    )
+    
+    # Новые обработчики для управления пользователями
+    conv_handler_add_user = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['➕ Добавить пользователя']), handlers.add_user_start)],
+        states={
+            handlers.ADD_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.add_user_process)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="add_user_conversation"
+    )
+    
+    conv_handler_remove_user = ConversationHandler(
+        entry_points=[MessageHandler(filters.Text(['➖ Удалить пользователя']), handlers.remove_user_start)],
+        states={
+            handlers.REMOVE_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.remove_user_process)],
+        },
+        fallbacks=[CommandHandler('cancel', handlers.cancel), MessageHandler(filters.Text(['❌ Отмена']), handlers.cancel)],
+        name="remove_user_conversation"
+    )
+    
+    # Добавляем обработчики
+    application.add_handler(CommandHandler("start", handlers.start))
+    application.add_handler(CommandHandler("help", handlers.help_command))
+    application.add_handler(CommandHandler("cancel", handlers.cancel))
+    application.add_handler(CommandHandler("status", status_command))
+    application.add_handler(CommandHandler("stock_on", handlers.stock_on_command))
+    application.add_handler(CommandHandler("reconcile", handlers.reconcile_command))
+    application.add_handler(CommandHandler("location", handlers.location_command))
+    application.add_handler(CommandHandler("order", handlers.order_command))
+    application.add_handler(CommandHandler("history", handlers.history_command))
+    # Ссылки /history_<id> из результатов поиска
+    application.add_handler(MessageHandler(filters.Regex(r'^/history_\d+(@\w+)?$'), handlers.history_command))
+    
+    application.add_handler(conv_handler_add)
+    application.add_handler(conv_handler_edit)
+    application.add_handler(conv_handler_delete)
+    application.add_handler(conv_handler_incoming)
+    application.add_handler(conv_handler_outgoing)
+    application.add_handler(conv_handler_transfer)
+    application.add_handler(conv_handler_search)
+    application.add_handler(conv_handler_add_user)
+    application.add_handler(conv_handler_remove_user)
+    
+    application.add_handler(InlineQueryHandler(handlers.inline_query))
+    application.add_handler(CallbackQueryHandler(handlers.stock_page_callback, pattern=r'^stock:'))
+    application.add_handler(CallbackQueryHandler(handlers.history_page_callback, pattern=r'^hist:'))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_message))
+    
+    instrument_handlers(application)
 
 def main():
-    """Главная функция запуска бота"""
+    """Главная функция запуска бота.
+
+    Запуск идет по этапам: настройки -> миграции БД -> прогрев кэшей ->
+    обработчики -> опрос Telegram. Модули с обращением к БД импортируются
+    внутри этапов, поэтому утилиты и тесты могут импортировать модули бота
+    без базы и сети.
+    """
+    global boot_started, polling_started
+    boot_started = time.perf_counter()
+    setup_logging()
     try:
-        # Инициализация базы данных
-        logger.info("Инициализация базы данных...")
-        init_db()
-        logger.info("База данных готова")
-        
-        # Запуск автоматического резервного копирования (раз в 24 часа)
-        start_auto_backup(interval_hours=24)
-        
-        # Создание приложения
-        logger.info("Создание приложения бота...")
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        # Добавляем обработчики ошибок
-        application.add_error_handler(error_handler)
-        
-        # Conversation Handlers
-        logger.info("Регистрация обработчиков...")
-        
-        conv_handler_add = ConversationHandler(
-            entry_points=[MessageHandler(filters.Text(['➕ Добавить запчасть']), add_part_start)],
-            states={
-                ADD_PART_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_part_name)],
-                ADD_PART_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_part_number)],
-                ADD_PART_QUANTITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_part_quantity)],
-                ADD_PART_UNIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_part_unit)],
-                ADD_PART_MIN_STOCK: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_part_min_stock)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel), MessageHandler(filters.Text(['❌ Отмена']), cancel)],
-            name="add_part_conversation"
-        )
-        
-        conv_handler_edit = ConversationHandler(
-            entry_points=[MessageHandler(filters.Text(['✏️ Редактировать запчасть']), edit_part_start)],
-            states={
-                EDIT_PART_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_part_select)],
-                EDIT_PART_FIELD: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_part_field)],
-                EDIT_PART_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_part_value)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel), MessageHandler(filters.Text(['❌ Отмена']), cancel)],
-            name="edit_part_conversation"
-        )
-        
-        conv_handler_delete = ConversationHandler(
-            entry_points=[MessageHandler(filters.Text(['🗑️ Удалить запчасть']), delete_part_start)],
-            states={
-                DELETE_PART_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_part_select)],
-                DELETE_PART_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_part_confirm)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel), MessageHandler(filters.Text(['❌ Отмена']), cancel)],
-            name="delete_part_conversation"
-        )
-        
-        conv_handler_incoming = ConversationHandler(
-            entry_points=[MessageHandler(filters.Text(['📦 Приход']), incoming_start)],
-            states={
-                INCOMING: [MessageHandler(filters.TEXT & ~filters.COMMAND, incoming_process)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel), MessageHandler(filters.Text(['❌ Отмена']), cancel)],
-            name="incoming_conversation"
-        )
-        
-        conv_handler_outgoing = ConversationHandler(
-            entry_points=[MessageHandler(filters.Text(['📤 Расход']), outgoing_start)],
-            states={
-                OUTGOING: [MessageHandler(filters.TEXT & ~filters.COMMAND, outgoing_process)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel), MessageHandler(filters.Text(['❌ Отмена']), cancel)],
-            name="outgoing_conversation"
-        )
-        
-        conv_handler_search = ConversationHandler(
-            entry_points=[MessageHandler(filters.Text(['🔍 Поиск']), search_start)],
-            states={
-                SEARCH: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_process)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel), MessageHandler(filters.Text(['❌ Отмена']), cancel)],
-            name="search_conversation"
-        )
-        
-        # Новые обработчики для управления пользователями
-        conv_handler_add_user = ConversationHandler(
-            entry_points=[MessageHandler(filters.Text(['➕ Добавить пользователя']), add_user_start)],
-            states={
-                ADD_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_user_process)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel), MessageHandler(filters.Text(['❌ Отмена']), cancel)],
-            name="add_user_conversation"
-        )
-        
-        conv_handler_remove_user = ConversationHandler(
-            entry_points=[MessageHandler(filters.Text(['➖ Удалить пользователя']), remove_user_start)],
-            states={
-                REMOVE_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, remove_user_process)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel), MessageHandler(filters.Text(['❌ Отмена']), cancel)],
-            name="remove_user_conversation"
-        )
-        
-        # Добавляем обработчики
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("cancel", cancel))
-        application.add_handler(CommandHandler("status", status_command))
+        with boot_phase("настройки"):
+            from config import BOT_TOKEN, PARTS_MIRROR, validate_config
+            validate_config()
         
-        application.add_handler(conv_handler_add)
-        application.add_handler(conv_handler_edit)
-        application.add_handler(conv_handler_delete)
-        application.add_handler(conv_handler_incoming)
-        application.add_handler(conv_handler_outgoing)
-        application.add_handler(conv_handler_search)
-        application.add_handler(conv_handler_add_user)
-        application.add_handler(conv_handler_remove_user)
+        with boot_phase("миграции БД"):
+            from storage import get_storage
+            storage = get_storage()
+            storage.init()
         
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+        with boot_phase("прогрев кэшей"):
+            from fuzzy import part_number_index
+            from autocomplete import part_prefix_index
+            parts = storage.parts.all()
+            part_number_index.load(part.part_number for part in parts)
+            part_prefix_index.load(parts)
+            if PARTS_MIRROR:
+                from mirror import attach_parts_mirror
+                attach_parts_mirror(storage, parts)
         
-        # Добавляем обработчики событий
-        application.post_init = post_init
-        application.post_stop = post_stop
+        with boot_phase("обработчики"):
+            application = Application.builder().token(BOT_TOKEN).build()
+            register_handlers(application)
+            
+            # Добавляем обработчики событий
+            application.post_init = post_init
+            application.post_stop = post_stop
         
         # Запуск бота
-        logger.info("Запуск бота...")
+        logger.info("Запуск: опрос Telegram...")
         print("🤖 Бот запущен...")
         print("ℹ️  Для проверки статуса используйте /status")
-        print("💾 Автоматическое резервное копирование запущено")
+        print("💾 Автоматическое резервное копирование запланировано")
         print("⚠️  Для остановки нажмите Ctrl+C")
         
+        polling_started = time.perf_counter()
         application.run_polling(
             drop_pending_updates=True,
             allowed_updates=Update.ALL_TYPES
         )
         
     except Exception as e:
-        logger.error(f"Критическая ошибка при запуске бота: {e}", exc_info=True)
+        logger.error("Критическая ошибка при запуске бота: %s", e, exc_info=True)
         print(f"❌ Критическая ошибка: {e}")
     finally:
-        # Останавливаем автоматическое копирование при выходе
-        stop_auto_backup()
+        from database import close_db
         close_db()
         logger.info("Работа бота завершена")
+        stop_logging()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,259 @@
+import logging
+import string
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from config import DEDUP_KEEP_DAYS
+from forecast import REPORT_LIMIT
+from history import HISTORY_PAGE_SIZE
+from storage import Part, PartsRepository, Ledger
+
+logger = logging.getLogger(__name__)
+
+# LIKE в SQLite без учета регистра только для латиницы, поиск по копии ведет себя так же
+_LIKE_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+class PartsMirror:
+    """Копия таблицы parts в памяти, по колонкам.
+
+    Числовые колонки хранятся в array, строковые - в списках, запчасть
+    с id лежит в позиции _positions[id] каждой колонки. Part собирается
+    только для строк, попавших в ответ. Порядок (name, id) для листания
+    хранится отдельным отсортированным списком, как в PartPrefixIndex.
+    NULL в числовых колонках хранится как 0 (кратность - как 1).
+    """
+
+    def __init__(self):
+        self._clear()
+
+    def _clear(self):
+        self._ids = array('q')
+        self._quantities = array('q')
+        self._min_stock = array('q')
+        self._prices = array('d')
+        self._pack_sizes = array('q')
+        self._names = []
+        self._part_numbers = []
+        self._units = []
+        self._locations = []
+        self._suppliers = []
+        self._search_keys = []  # наименование и код для поиска по подстроке
+        self._positions = {}  # id -> позиция в колонках
+        self._order = []  # отсортированные пары (наименование, id)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load(self, parts):
+        """Заполняет копию всеми запчастями из хранилища (при запуске бота)"""
+        started = time.perf_counter()
+        self._clear()
+        for part in parts:
+            self._append(part)
+        self._order.sort()
+        logger.info("Копия таблицы запчастей в памяти: %s позиций за %.2f с", len(self), time.perf_counter() - started)
+
+    def _append(self, part):
+        self._positions[part.id] = len(self._ids)
+        self._ids.append(part.id)
+        self._quantities.append(part.quantity or 0)
+        self._min_stock.append(part.min_stock or 0)
+        self._prices.append(part.price or 0.0)
+        self._pack_sizes.append(part.pack_size or 1)
+        self._names.append(part.name)
+        self._part_numbers.append(part.part_number)
+        self._units.append(part.unit)
+        self._locations.append(part.location)
+        self._suppliers.append(part.supplier)
+        self._search_keys.append(f'{part.name}\0{part.part_number}'.translate(_LIKE_FOLD))
+        self._order.append((part.name, part.id))
+
+    def put(self, part):
+        """Добавляет запчасть или заменяет все ее поля"""
+        if part.id in self._positions:
+            self.remove(part.id)
+        self._append(part)
+        # _append дописал ключ в конец, переносим его на место
+        insort(self._order, self._order.pop())
+
+    def remove(self, part_id: int):
+        position = self._positions.pop(part_id, None)
+        if position is None:
+            return
+        key = (self._names[position], part_id)
+        index = bisect_left(self._order, key)
+        if index < len(self._order) and self._order[index] == key:
+            del self._order[index]
+        # Последняя строка переезжает на место удаленной, колонки остаются плотными
+        last = len(self._ids) - 1
+        for column in (self._ids, self._quantities, self._min_stock, self._prices, self._pack_sizes, self._names,
+                       self._part_numbers, self._units, self._locations, self._suppliers, self._search_keys):
+            column[position] = column[last]
+            del column[last]
+        if position != last:
+            self._positions[self._ids[position]] = position
+
+    def add_quantity(self, part_id: int, delta: int):
+        position = self._positions.get(part_id)
+        if position is not None:
+            self._quantities[position] += delta
+
+    def _part(self, position):
+        return Part(self._ids[position], self._names[position], self._part_numbers[position],
+                    self._quantities[position], self._units[position], self._prices[position],
+                    self._locations[position], self._min_stock[position], self._suppliers[position],
+                    self._pack_sizes[position])
+
+    def get(self, part_id: int):
+        position = self._positions.get(part_id)
+        return self._part(position) if position is not None else None
+
+    def get_many(self, part_ids) -> list:
+        positions = self._positions
+        return [self._part(positions[part_id]) for part_id in part_ids if part_id in positions]
+
+    def all(self) -> list:
+        return [self._part(position) for position in range(len(self._ids))]
+
+    def totals(self):
+        return len(self._ids), sum(self._quantities)
+
+    def page(self, after_id: int = None, before_id: int = None, limit: int = 10) -> list:
+        """То же, что PartsRepository.page по всем складам"""
+        order = self._order
+        cursor_id = before_id if before_id is not None else after_id
+        if cursor_id is None:
+            keys = order[:limit + 1]
+        else:
+            position = self._positions.get(cursor_id)
+            if position is None:
+                return []
+            key = (self._names[position], cursor_id)
+            if before_id is not None:
+                end = bisect_left(order, key)
+                keys = order[max(end - limit - 1, 0):end]
+            else:
+                start = bisect_right(order, key)
+                keys = order[start:start + limit + 1]
+        return [self._part(self._positions[part_id]) for _, part_id in keys]
+
+    def search(self, term: str) -> list:
+        """Подстрока в наименовании или коде, по возрастанию id (как при чтении таблицы)"""
+        term = term.translate(_LIKE_FOLD)
+        positions = [position for position, key in enumerate(self._search_keys) if term in key]
+        positions.sort(key=self._ids.__getitem__)
+        return [self._part(position) for position in positions]
+
+    def low_stock(self) -> list:
+        positions = [
+            position for position, (quantity, min_stock) in enumerate(zip(self._quantities, self._min_stock))
+            if quantity <= min_stock
+        ]
+        positions.sort(key=lambda position: (self._quantities[position], self._ids[position]))
+        return [self._part(position) for position in positions]
+
+class MirroredPartsRepository(PartsRepository):
+    """Чтение по всем складам из копии в памяти, остальное - из основного хранилища.
+
+    Остатки по отдельному складу в копии нет, такие выборки идут в хранилище.
+    Изменения сначала пишутся в хранилище, затем переносятся в копию.
+    """
+
+    def __init__(self, base: PartsRepository, mirror: PartsMirror):
+        self._base = base
+        self._mirror = mirror
+
+    def get(self, part_id):
+        return self._mirror.get(part_id)
+
+    def get_by_number(self, part_number):
+        return self._base.get_by_number(part_number)
+
+    def find_by_norm(self, part_number_norm):
+        return self._base.find_by_norm(part_number_norm)
+
+    def get_many(self, part_ids):
+        return self._mirror.get_many(part_ids)
+
+    def all(self):
+        return self._mirror.all()
+
+    def create(self, name, part_number, unit, min_stock, location, quantity):
+        part = self._base.create(name, part_number, unit, min_stock, location, quantity)
+        self._mirror.put(part)
+        return part
+
+    def update(self, part_id, field, value):
+        self._base.update(part_id, field, value)
+        self._mirror.put(self._base.get(part_id))
+
+    def delete(self, part_id):
+        self._base.delete(part_id)
+        self._mirror.remove(part_id)
+
+    def count(self, location=None):
+        if location:
+            return self._base.count(location)
+        return len(self._mirror)
+
+    def totals(self, location=None):
+        if location:
+            return self._base.totals(location)
+        return self._mirror.totals()
+
+    def page(self, location=None, after_id=None, before_id=None, limit=10):
+        if location:
+            return self._base.page(location, after_id, before_id, limit)
+        return self._mirror.page(after_id, before_id, limit)
+
+    def search(self, term, location=None):
+        if location:
+            return self._base.search(term, location)
+        return self._mirror.search(term)
+
+    def low_stock(self, location=None):
+        if location:
+            return self._base.low_stock(location)
+        return self._mirror.low_stock()
+
+    def location_quantity(self, part_id, location):
+        return self._base.location_quantity(part_id, location)
+
+    def locations(self):
+        return self._base.locations()
+
+    def reorder_suggestions(self, limit=REPORT_LIMIT):
+        return self._base.reorder_suggestions(limit)
+
+class MirroredLedger(Ledger):
+    """Движения пишутся в хранилище, общий остаток в копии меняется следом"""
+
+    def __init__(self, base: Ledger, mirror: PartsMirror):
+        self._base = base
+        self._mirror = mirror
+
+    def move(self, part_id, location, delta, comment=None, update_id=None):
+        self._base.move(part_id, location, delta, comment, update_id)
+        self._mirror.add_quantity(part_id, delta)
+
+    def transfer(self, part_id, from_location, to_location, quantity, update_id=None):
+        # Перемещение не меняет общий остаток запчасти
+        return self._base.transfer(part_id, from_location, to_location, quantity, update_id)
+
+    def count(self):
+        return self._base.count()
+
+    def prune_processed_updates(self, keep_days=DEDUP_KEEP_DAYS):
+        return self._base.prune_processed_updates(keep_days)
+
+    def history(self, part_id, balance, after_id=None, before_id=None, limit=HISTORY_PAGE_SIZE):
+        return self._base.history(part_id, balance, after_id, before_id, limit)
+
+def attach_parts_mirror(storage, parts):
+    """Загружает копию и подключает ее к хранилищу (включается PARTS_MIRROR)"""
+    parts_mirror.load(parts)
+    storage.parts = MirroredPartsRepository(storage.parts, parts_mirror)
+    storage.ledger = MirroredLedger(storage.ledger, parts_mirror)
+
+# Общая копия бота
+parts_mirror = PartsMirror()
@@ -0,0 +1,96 @@
+import csv
+import io
+import logging
+import math
+from config import ORDER_COVER_DAYS
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Группировка строк заказа: колонка запроса и заголовок в CSV
+ORDER_GROUPS = {
+    'supplier': ('supplier', 'Поставщик'),
+    'location': ('location', 'Склад'),
+}
+
+# Склад строки заказа. Заказ считается по общему остатку запчасти, одна строка
+# на запчасть; по складам строки только группируются - по складу, где остаток
+# меньше всего (там деталь кончится первой), а без остатков - по складу из карточки
+ORDER_LOCATION = {
+    'supplier': 'p.location',
+    'location': 'COALESCE((SELECT s.location FROM stock s WHERE s.part_id = p.id ORDER BY s.quantity, s.location LIMIT 1), p.location)',
+}
+
+ORDER_COLUMNS = '''p.id, p.name, p.part_number, p.unit, p.quantity, p.min_stock, {location} AS location,
+       COALESCE(p.supplier, '') AS supplier,
+       MAX(COALESCE(p.pack_size, 1), 1) AS pack_size'''
+
+# Точка заказа - по прогнозу расхода (forecast.py), а без прогноза - min_stock.
+# Ветки не читают parts целиком: запчасти с прогнозом перебираются по reorder_points
+# (CROSS JOIN фиксирует порядок), остальные - по индексу idx_parts_low_stock
+ORDER_QUERY = f'''
+SELECT {ORDER_COLUMNS}, r.reorder_point, r.daily_mean
+FROM reorder_points r
+CROSS JOIN live_parts p ON p.id = r.part_id
+WHERE p.quantity <= r.reorder_point
+UNION ALL
+SELECT {ORDER_COLUMNS}, p.min_stock AS reorder_point, NULL AS daily_mean
+FROM live_parts p
+WHERE p.quantity - p.min_stock <= 0
+  AND NOT EXISTS (SELECT 1 FROM reorder_points r WHERE r.part_id = p.id)
+ORDER BY {{group}}, name
+'''
+
+CSV_HEADER = ['Код', 'Наименование', 'Остаток', 'Точка заказа', 'Целевой остаток', 'Кратность', 'Заказать', 'Ед.']
+
+def target_level(part, cover_days: int) -> int:
+    """Остаток после поставки: точка заказа плюс расход за cover_days.
+
+    Без прогноза расхода заказываем до двойного минимального запаса.
+    """
+    if part['daily_mean'] is None:
+        return part['reorder_point'] + part['min_stock']
+    return part['reorder_point'] + math.ceil(part['daily_mean'] * cover_days)
+
+def order_quantity(quantity: int, target: int, pack_size: int) -> int:
+    """Недостача до target, округленная вверх до целых упаковок"""
+    shortage = target - quantity
+    if shortage <= 0:
+        return 0
+    return -(-shortage // pack_size) * pack_size
+
+def build_purchase_order(group_by: str = 'supplier', cover_days: int = ORDER_COVER_DAYS):
+    """Строки заказа по всем позициям не выше точки заказа одним запросом.
+
+    Возвращает [(группа, [строка CSV, ...])] в порядке групп.
+    """
+    column, _ = ORDER_GROUPS[group_by]
+    cursor = get_db_connection().cursor()
+    cursor.execute(ORDER_QUERY.format(location=ORDER_LOCATION[group_by], group=column))
+
+    groups = []
+    for part in cursor:
+        target = target_level(part, cover_days)
+        quantity = order_quantity(part['quantity'], target, part['pack_size'])
+        if not quantity:
+            continue
+        group = part[column] or ''
+        if not groups or groups[-1][0] != group:
+            groups.append((group, []))
+        groups[-1][1].append([
+            part['part_number'], part['name'], part['quantity'], part['reorder_point'],
+            target, part['pack_size'], quantity, part['unit'],
+        ])
+    logger.info("Заказ поставщикам: %s позиций, групп: %s", sum(len(lines) for _, lines in groups), len(groups))
+    return groups
+
+def purchase_order_csv(groups, group_by: str = 'supplier') -> bytes:
+    """CSV для Excel: разделитель ';', UTF-8 с BOM"""
+    _, title = ORDER_GROUPS[group_by]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow([title] + CSV_HEADER)
+    for group, lines in groups:
+        for line in lines:
+            writer.writerow([group or 'не указан'] + line)
+    return buffer.getvalue().encode('utf-8-sig')
@@ -0,0 +1,190 @@
+"""Проверка планов запросов: горячие запросы не должны читать parts и transactions целиком.
+
+Запуск: python query_plans.py
+
+Во временном каталоге создается схема init_db, заполняется тестовыми
+данными и собирается статистика (ANALYZE). Затем выполняются операции
+хранилища, которые вызывают обработчики, /status и database.py; все их
+SQL-запросы перехватываются и проверяются через EXPLAIN QUERY PLAN.
+Полный проход (SCAN) по parts или transactions и сортировка во временном
+B-дереве считаются ошибкой, если операция явно их не допускает.
+Код возврата 1, если хотя бы один план не прошел проверку.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+import database
+from database import get_db_connection, LAST_TRANSACTION_ID, get_last_job_run, set_last_job_run, prune_processed_updates
+from storage import SqliteStorage
+from forecast import reorder_suggestions
+from purchase_orders import build_purchase_order
+from history import part_history
+from archive import archive_transactions_batch, purge_part_batch, purge_deleted_parts
+from valuation import get_valuation
+from snapshots import take_snapshot, stock_as_of
+from reconcile import reconcile_ledger
+
+# Таблицы, которые нельзя читать целиком там, где ожидается поиск по индексу
+WATCHED_TABLES = {'parts', 'p', 'transactions'}
+
+# Объем тестовых данных: при пустых таблицах планировщик выбирает другие планы
+SAMPLE_PARTS = 2000
+SAMPLE_LOCATIONS = ('склад', 'цех')
+SAMPLE_MOVES_PER_PART = 3
+
+def populate():
+    """Заполняет пустую базу запчастями, остатками на двух складах и транзакциями"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        'INSERT INTO parts (name, part_number, part_number_norm, quantity, unit, location, min_stock) '
+        "VALUES (?, ?, ?, 0, 'шт.', ?, 5)",
+        [(f'Подшипник {i}', f'PN-{i:05d}', f'pn{i:05d}', SAMPLE_LOCATIONS[0]) for i in range(SAMPLE_PARTS)]
+    )
+    for part_id in range(1, SAMPLE_PARTS + 1):
+        for location in SAMPLE_LOCATIONS:
+            for delta in range(1, SAMPLE_MOVES_PER_PART + 1):
+                database.apply_movement(cursor, part_id, location, delta)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.commit()
+
+def hot_operations(storage):
+    """[(название, вызов, допустимые строки плана)] - все горячие обращения к БД.
+
+    Допустимые строки задаются префиксами деталей плана (например,
+    'SCAN parts USING INDEX idx_parts_name_id' для первой страницы остатков)
+    или парами (фрагмент SQL, префикс) - тогда только для запросов операции,
+    в тексте которых есть фрагмент, остальные ее запросы проверяются полностью.
+    """
+    parts, ledger = storage.parts, storage.ledger
+    location = SAMPLE_LOCATIONS[1]
+    part = parts.get_by_number('PN-00100')
+
+    # Запчасть, которую проверка создает, удаляет и переносит в архив
+    belt = {}
+    move_id = get_db_connection().execute('SELECT MAX(id) FROM transactions WHERE part_id = ?', (part.id,)).fetchone()[0]
+    # created_at хранится в UTC в формате CURRENT_TIMESTAMP
+    cutoff = (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    return [
+        # Поиск запчасти по коду, id и каноническому коду
+        ('parts.get', lambda: parts.get(part.id), ()),
+        ('parts.get_by_number', lambda: parts.get_by_number(part.part_number), ()),
+        ('parts.find_by_norm', lambda: parts.find_by_norm('pn00100'), ()),
+        ('parts.get_many', lambda: parts.get_many([1, 2, 3]), ()),
+        ('parts.location_quantity', lambda: parts.location_quantity(part.id, location), ()),
+        # Остатки постранично: по индексу (name, id), без сортировки
+        ('parts.page', lambda: parts.page(limit=10), ('SCAN parts USING INDEX idx_parts_name_id',)),
+        ('parts.page after', lambda: parts.page(after_id=part.id, limit=10), ()),
+        ('parts.page before', lambda: parts.page(before_id=part.id, limit=10), ()),
+        ('parts.page location', lambda: parts.page(location, after_id=part.id, limit=10), ()),
+        # Счетчики строк для /status и эндпоинта состояния
+        ('parts.count', lambda: parts.count(), ()),
+        ('ledger.count', lambda: ledger.count(), ()),
+        # Отчеты и поиск по подстроке читают склад целиком по определению
+        ('parts.totals', lambda: parts.totals(), ('SCAN parts',)),
+        ('parts.totals location', lambda: parts.totals(location), ()),
+        # Критический остаток - по индексу idx_parts_low_stock, сортируются только найденные строки
+        ('parts.low_stock', lambda: parts.low_stock(), ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('parts.low_stock location', lambda: parts.low_stock(location), ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('parts.search', lambda: parts.search('100'), ('SCAN parts',)),
+        ('parts.search location', lambda: parts.search('100', location), ()),
+        ('parts.locations', lambda: parts.locations(), ()),
+        # История запчасти: по индексу (part_id, created_at DESC, id DESC), сортирует
+        # только оконная функция остатка - по строкам одной страницы
+        ('part_history', lambda: part_history(part.id, 0), ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('part_history after', lambda: part_history(part.id, 0, after_id=move_id), ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('part_history before', lambda: part_history(part.id, 0, before_id=move_id), ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('reorder_suggestions', lambda: reorder_suggestions(), ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('purchase_order', lambda: build_purchase_order(), ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('purchase_order location', lambda: build_purchase_order('location'), ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('get_valuation', lambda: get_valuation(),
+         ('SCAN parts USING INDEX idx_parts_value', ('GROUP BY s.location', 'USE TEMP B-TREE FOR ORDER BY'))),
+        # Снимок, остатки на дату и сверка читают все запчасти по определению - только в своем запросе
+        ('take_snapshot', lambda: take_snapshot(), (('INTO stock_snapshots', 'SCAN parts'),)),
+        ('stock_as_of', lambda: stock_as_of(datetime.now(timezone.utc) - timedelta(hours=1)),
+         (('FROM parts p', 'SCAN p'), ('FROM parts p', 'USE TEMP B-TREE FOR ORDER BY'))),
+        ('reconcile_ledger', lambda: reconcile_ledger(), (('LEFT JOIN ledger_balances', 'SCAN parts'),)),
+        # Изменения
+        ('parts.update', lambda: parts.update(part.id, 'part_number', part.part_number), ()),
+        ('ledger.move', lambda: ledger.move(part.id, location, 1), ()),
+        ('ledger.move update_id', lambda: ledger.move(part.id, location, 1, update_id=1), ()),
+        ('ledger.transfer', lambda: ledger.transfer(part.id, location, SAMPLE_LOCATIONS[0], 1), ()),
+        ('parts.create', lambda: belt.update(part=parts.create('Ремень', 'BELT-1', 'шт.', 1, location, 2)), ()),
+        ('parts.delete', lambda: parts.delete(belt['part'].id), ()),
+        ('purge_part_batch', lambda: purge_part_batch(belt['part'].id), ()),
+        ('purge_deleted_parts', lambda: asyncio.run(purge_deleted_parts()), ()),
+        # Архивирование: пачка самых старых транзакций (тестовые все старше cutoff)
+        ('archive_transactions_batch', lambda: archive_transactions_batch(cutoff, 100), ()),
+        # database.py
+        ('last_transaction_id', lambda: get_db_connection().execute(LAST_TRANSACTION_ID).fetchone(), ()),
+        ('prune_processed_updates', lambda: prune_processed_updates(), ()),
+        ('job_runs', lambda: (set_last_job_run('query_plans', datetime.now()), get_last_job_run('query_plans')), ()),
+    ]
+
+def is_allowed(sql: str, detail: str, allowed) -> bool:
+    for entry in allowed:
+        fragment, prefix = entry if isinstance(entry, tuple) else ('', entry)
+        if fragment in sql and detail.startswith(prefix):
+            return True
+    return False
+
+def plan_problems(sql: str, allowed) -> list:
+    """Строки плана запроса, которые не прошли проверку"""
+    problems = []
+    for row in get_db_connection().execute(f'EXPLAIN QUERY PLAN {sql}'):
+        detail = row['detail']
+        words = detail.split()
+        # Таблицы присоединенных БД выводятся с именем схемы: main.transactions
+        bad_scan = words[0] == 'SCAN' and len(words) > 1 and words[1].rpartition('.')[2] in WATCHED_TABLES
+        temp_sort = detail.startswith('USE TEMP B-TREE FOR ORDER BY')
+        if (bad_scan or temp_sort) and not is_allowed(sql, detail, allowed):
+            problems.append(detail)
+    return problems
+
+def check_plans() -> list:
+    """[(операция, запрос, строки плана)] для всех планов с ошибками"""
+    storage = SqliteStorage()
+    storage.init()
+    populate()
+    conn = get_db_connection()
+    failures = []
+    for name, operation, allowed in hot_operations(storage):
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            operation()
+        finally:
+            conn.set_trace_callback(None)
+        # Запросы триггеров попадают в трассировку повторами исходного запроса
+        for sql in dict.fromkeys(statements):
+            if sql.split(None, 1)[0].upper() not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+                continue
+            problems = plan_problems(sql, allowed)
+            if problems:
+                failures.append((name, sql, problems))
+        print(f"{'FAIL' if any(f[0] == name for f in failures) else 'ok  '} {name}")
+    return failures
+
+def main():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # Проверка работает только с временной базой, рабочая parts.db не открывается
+        os.chdir(workdir)
+        database.ARCHIVE_DB_PATH = os.path.join(workdir, 'parts_archive.db')
+        try:
+            failures = check_plans()
+        finally:
+            database.close_db()
+            os.chdir(cwd)
+
+    for name, sql, problems in failures:
+        print(f"\n{name}: {sql}")
+        for detail in problems:
+            print(f"    {detail}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
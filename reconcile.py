@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from config import ADMIN_USER_ID, RECONCILE_AUTOFIX
+from database import get_db_connection, record_movement, SIGNED_QUANTITY, LAST_TRANSACTION_ID
+from cache import bump_data_version
+from send_queue import send_queue
+
+logger = logging.getLogger(__name__)
+
+# Комментарий к корректирующим транзакциям
+RECONCILE_COMMENT = 'Корректировка по сверке'
+
+def reconcile_ledger(full: bool = False, fix: bool = False) -> dict:
+    """Сверяет parts.quantity с итогом журнала транзакций.
+
+    Итоги по журналу хранятся в ledger_balances и дополняются одним
+    агрегирующим запросом по транзакциям после контрольной точки,
+    поэтому регулярная сверка читает только новые строки. full=True
+    пересчитывает итоги с нуля. fix=True добавляет корректирующие
+    транзакции, чтобы журнал совпал с остатками.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if full:
+            cursor.execute('DELETE FROM ledger_balances')
+            last_id = 0
+        else:
+            cursor.execute('SELECT last_transaction_id FROM ledger_checkpoint WHERE id = 1')
+            row = cursor.fetchone()
+            last_id = row[0] if row else 0
+
+        cursor.execute(LAST_TRANSACTION_ID)
+        upto = cursor.fetchone()[0]
+
+        cursor.execute(f'''
+        INSERT INTO ledger_balances (part_id, balance)
+        SELECT part_id, SUM({SIGNED_QUANTITY}) FROM all_transactions
+        WHERE id > ? AND id <= ?
+        GROUP BY part_id
+        ON CONFLICT(part_id) DO UPDATE SET balance = balance + excluded.balance
+        ''', (last_id, upto))
+        cursor.execute(
+            'INSERT OR REPLACE INTO ledger_checkpoint (id, last_transaction_id) VALUES (1, ?)',
+            (upto,)
+        )
+        # Итоги удаленных запчастей больше не нужны
+        cursor.execute(
+            'DELETE FROM ledger_balances WHERE NOT EXISTS (SELECT 1 FROM live_parts p WHERE p.id = ledger_balances.part_id)'
+        )
+
+        cursor.execute('''
+        SELECT p.id, p.name, p.part_number, p.unit, p.quantity, COALESCE(b.balance, 0) AS ledger
+        FROM live_parts p
+        LEFT JOIN ledger_balances b ON b.part_id = p.id
+        WHERE p.quantity <> COALESCE(b.balance, 0)
+        ORDER BY p.name
+        ''')
+        mismatches = cursor.fetchall()
+
+        if fix:
+            # Корректировки попадут в ledger_balances при следующей сверке
+            for part in mismatches:
+                record_movement(cursor, part['id'], part['quantity'] - part['ledger'], RECONCILE_COMMENT)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if fix and mismatches:
+        bump_data_version()
+
+    logger.info(
+        "Сверка журнала: транзакции %s..%s, расхождений: %s%s",
+        last_id + 1, upto, len(mismatches), ', исправлено' if fix and mismatches else ''
+    )
+    return {
+        'from_id': last_id,
+        'to_id': upto,
+        'mismatches': mismatches,
+        'fixed': fix,
+    }
+
+def format_reconcile_result(result: dict) -> str:
+    """Текст отчета о сверке для Telegram"""
+    mismatches = result['mismatches']
+    message = (
+        "🧮 Сверка остатков с журналом\n\n"
+        f"Проверены транзакции: {result['from_id'] + 1}..{result['to_id']}\n"
+    )
+    if not mismatches:
+        return message + "✅ Расхождений нет"
+
+    message += f"⚠️ Расхождений: {len(mismatches)}\n\n"
+    for part in mismatches:
+        message += (
+            f"{part['name']} ({part['part_number']}): "
+            f"в базе {part['quantity']}, по журналу {part['ledger']} {part['unit']}\n"
+        )
+    if result['fixed']:
+        message += "\n✅ Добавлены корректирующие транзакции"
+    return message
+
+async def run_reconcile():
+    """Периодическая задача: инкрементальная сверка и уведомление администратора"""
+    result = await asyncio.to_thread(reconcile_ledger, False, RECONCILE_AUTOFIX)
+    if result['mismatches'] and send_queue.running:
+        send_queue.enqueue(ADMIN_USER_ID, format_reconcile_result(result))
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from telegram.ext import ContextTypes
+from config import BACKUP_WINDOW, BACKUP_INTERVAL_HOURS, BACKUP_JITTER_MINUTES, ARCHIVE_WINDOW, SNAPSHOT_WINDOW, RECONCILE_WINDOW, FORECAST_WINDOW
+from database import backup_database, last_backup_time, get_last_job_run, set_last_job_run
+from storage import get_storage
+from archive import archive_old_transactions, purge_deleted_parts
+from snapshots import run_snapshot
+from reconcile import run_reconcile
+from changelog import prune_changelog
+from forecast import run_forecast
+
+logger = logging.getLogger(__name__)
+
+# Через сколько минут после запуска бота выполнять пропущенную задачу
+CATCHUP_DELAY_MINUTES = 2
+
+def parse_window(spec: str):
+    """Разбирает окно вида '02:00-05:00' в пару datetime.time"""
+    start, end = (datetime.strptime(part.strip(), "%H:%M").time() for part in spec.split('-'))
+    return start, end
+
+class WindowJob:
+    """Периодическая задача на JobQueue бота, выполняемая только в тихое окно.
+
+    Время следующего запуска считается от времени прошлого запуска (last_run),
+    поэтому после перезапуска бота пропущенный запуск выполняется сразу,
+    а не через полный интервал. Если last_run не передан, время успешных
+    запусков хранится в таблице job_runs.
+    """
+
+    def __init__(self, name: str, func, window: str, interval_hours: int, jitter_minutes: int, last_run=None):
+        self.name = name
+        self.func = func  # корутина без аргументов
+        self.persist_runs = last_run is None
+        # функция, возвращающая datetime последнего запуска или None
+        self.last_run = (lambda: get_last_job_run(name)) if last_run is None else last_run
+        self.window_start, self.window_end = parse_window(window)
+        self.interval = timedelta(hours=interval_hours)
+        self.jitter = timedelta(minutes=jitter_minutes)
+        self.last_attempt = None
+
+    def _window_bounds(self, day):
+        start = datetime.combine(day, self.window_start)
+        end = datetime.combine(day, self.window_end)
+        if end <= start:
+            # Окно через полночь, например 23:00-02:00
+            end += timedelta(days=1)
+        return start, end
+
+    def next_run(self, now: datetime) -> datetime:
+        last = self.last_run()
+        if self.last_attempt and (last is None or self.last_attempt > last):
+            # Неудачная попытка тоже считается запуском, иначе будем повторять каждые пару минут
+            last = self.last_attempt
+        if last is None:
+            return now + timedelta(minutes=CATCHUP_DELAY_MINUTES)
+
+        # Берем окно, начало которого ближе всего к моменту last + interval
+        target = last + self.interval
+        windows = [self._window_bounds(target.date() + timedelta(days=offset)) for offset in (-1, 0, 1)]
+        start, end = min((w for w in windows if w[0] > last), key=lambda w: abs(w[0] - target))
+
+        if end <= now:
+            # Окно пропущено (бот был остановлен) - не ждем следующего
+            logger.info("Задача '%s' пропущена с %s, выполняем после запуска", self.name, last.strftime('%d.%m.%Y %H:%M'))
+            return now + timedelta(minutes=CATCHUP_DELAY_MINUTES)
+
+        run_at = max(now, start) + timedelta(seconds=random.uniform(0, self.jitter.total_seconds()))
+        return min(run_at, end - timedelta(minutes=1))
+
+    def schedule(self, job_queue):
+        now = datetime.now()
+        run_at = self.next_run(now)
+        job_queue.run_once(self._run, when=(run_at - now).total_seconds(), name=self.name)
+        logger.info("Задача '%s' запланирована на %s", self.name, run_at.strftime('%d.%m.%Y %H:%M'))
+
+    async def _run(self, context: ContextTypes.DEFAULT_TYPE):
+        self.last_attempt = datetime.now()
+        try:
+            await self.func()
+            if self.persist_runs:
+                set_last_job_run(self.name, self.last_attempt)
+        except Exception as e:
+            logger.error("Ошибка в задаче '%s': %s", self.name, e, exc_info=True)
+        finally:
+            self.schedule(context.job_queue)
+
+async def run_backup():
+    """Резервное копирование вне event loop, чтобы не задерживать обработку сообщений"""
+    await asyncio.to_thread(backup_database)
+
+async def run_prune_updates():
+    """Очистка старых отметок об обработанных обновлениях вне event loop"""
+    await asyncio.to_thread(get_storage().ledger.prune_processed_updates)
+
+def schedule_jobs(job_queue):
+    """Регистрирует периодические задачи бота"""
+    if job_queue is None:
+        logger.error("JobQueue недоступна: установите python-telegram-bot[job-queue]")
+        return
+
+    WindowJob(
+        'backup', run_backup,
+        BACKUP_WINDOW, BACKUP_INTERVAL_HOURS, BACKUP_JITTER_MINUTES,
+        last_run=last_backup_time
+    ).schedule(job_queue)
+    WindowJob('archive', archive_old_transactions, ARCHIVE_WINDOW, 24, 10).schedule(job_queue)
+    WindowJob('purge', purge_deleted_parts, ARCHIVE_WINDOW, 24, 10).schedule(job_queue)
+    WindowJob('changelog', prune_changelog, ARCHIVE_WINDOW, 24, 10).schedule(job_queue)
+    WindowJob('processed_updates', run_prune_updates, ARCHIVE_WINDOW, 24, 10).schedule(job_queue)
+    WindowJob('snapshot', run_snapshot, SNAPSHOT_WINDOW, 24, 5).schedule(job_queue)
+    WindowJob('reconcile', run_reconcile, RECONCILE_WINDOW, 24, 10).schedule(job_queue)
+    WindowJob('forecast', run_forecast, FORECAST_WINDOW, 24, 10).schedule(job_queue)
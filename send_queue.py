@@ -0,0 +1,322 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import timedelta
+from telegram import InlineKeyboardMarkup
+from telegram.error import RetryAfter, BadRequest, Forbidden, NetworkError
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+# Сколько раз повторяем отправку при сетевых ошибках
+MAX_SEND_ATTEMPTS = 5
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд осталось ждать до появления токена"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class OutgoingMessage:
+    """Сообщение, ожидающее отправки"""
+    __slots__ = ('chat_id', 'text', 'reply_markup', 'message_id', 'document', 'filename', 'attempts')
+
+    def __init__(self, chat_id: int, text: str, reply_markup=None, message_id: int = None,
+                 document: bytes = None, filename: str = None):
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_markup = reply_markup
+        # Если задан, это правка уже отправленного сообщения, а не новое
+        self.message_id = message_id
+        # Если задан, это файл, а text - подпись к нему
+        self.document = document
+        self.filename = filename
+        self.attempts = 0
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list:
+    """Делит длинный текст на части не длиннее limit, по возможности по строкам"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    chunks.append(text)
+    return chunks
+
+def _can_coalesce(previous: OutgoingMessage, message: OutgoingMessage) -> bool:
+    """Можно ли склеить два подряд идущих сообщения в один чат"""
+    # Inline-кнопки привязаны к конкретному сообщению, их, правки и файлы не склеиваем
+    if previous.message_id is not None or message.message_id is not None:
+        return False
+    if previous.document is not None or message.document is not None:
+        return False
+    if isinstance(previous.reply_markup, InlineKeyboardMarkup) or isinstance(message.reply_markup, InlineKeyboardMarkup):
+        return False
+    return len(previous.text) + 2 + len(message.text) <= MAX_MESSAGE_LENGTH
+
+def _seconds(retry_after) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class SendQueue:
+    """Центральная очередь исходящих сообщений с учетом лимитов Telegram"""
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: int = SEND_CHAT_BURST):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._pending = {}  # chat_id -> deque сообщений, порядок внутри чата сохраняется
+        self._chat_buckets = {}
+        self._global_bucket = None
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._worker = None
+        self._bot = None
+        # Счетчики для мониторинга
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def depth(self) -> int:
+        """Количество сообщений, ожидающих отправки"""
+        return sum(len(queue) for queue in self._pending.values())
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.depth(),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+            'dropped': self.dropped,
+        }
+
+    def start(self, bot):
+        """Запускает фоновую отправку (вызывается из event loop бота)"""
+        loop = asyncio.get_running_loop()
+        self._bot = bot
+        self._global_bucket = TokenBucket(self.global_rate, max(1.0, self.global_rate), loop.time())
+        self._wakeup = asyncio.Event()
+        self._worker = loop.create_task(self._run(), name='send_queue')
+        logger.info("Очередь исходящих сообщений запущена")
+
+    async def stop(self, timeout: float = 5.0):
+        """Дожидается отправки накопленных сообщений и останавливает очередь"""
+        if not self.running:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._pending and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        if self._pending:
+            logger.warning("Очередь остановлена, не отправлено сообщений: %s", self.depth())
+        logger.info("Очередь исходящих сообщений остановлена")
+
+    def enqueue(self, chat_id: int, text: str, reply_markup=None):
+        """Ставит сообщение в очередь и сразу возвращает управление"""
+        chunks = split_text(text)
+        for chunk in chunks[:-1]:
+            self._put(OutgoingMessage(chat_id, chunk))
+        # Клавиатуру прикрепляем к последней части
+        self._put(OutgoingMessage(chat_id, chunks[-1], reply_markup))
+        self._wakeup.set()
+
+    def enqueue_document(self, chat_id: int, document: bytes, filename: str, caption: str = ''):
+        """Ставит в очередь отправку файла с подписью"""
+        self._put(OutgoingMessage(chat_id, caption, document=document, filename=filename))
+        self._wakeup.set()
+
+    def edit(self, chat_id: int, message_id: int, text: str, reply_markup=None):
+        """Ставит в очередь правку сообщения; ожидающая правка того же сообщения заменяется"""
+        # Правка не может стать несколькими сообщениями: лишнее обрезается
+        text = split_text(text)[0]
+        queue = self._pending.get(chat_id, ())
+        for pending in queue:
+            if pending.message_id == message_id:
+                pending.text = text
+                pending.reply_markup = reply_markup
+                self.coalesced += 1
+                return
+        self._put(OutgoingMessage(chat_id, text, reply_markup, message_id))
+        self._wakeup.set()
+
+    def _put(self, message: OutgoingMessage):
+        queue = self._pending.setdefault(message.chat_id, deque())
+        if queue and _can_coalesce(queue[-1], message):
+            previous = queue[-1]
+            previous.text = f"{previous.text}\n\n{message.text}"
+            # Reply-клавиатура действует до следующей, поэтому берем последнюю
+            if message.reply_markup is not None:
+                previous.reply_markup = message.reply_markup
+            self.coalesced += 1
+        else:
+            queue.append(message)
+
+    def _requeue(self, message: OutgoingMessage):
+        self._pending.setdefault(message.chat_id, deque()).appendleft(message)
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _forget_idle_buckets(self, now: float):
+        """Удаляет полные ведра чатов без очереди, чтобы словарь не рос бесконечно"""
+        if len(self._chat_buckets) < 1000:
+            return
+        for chat_id in [cid for cid, bucket in self._chat_buckets.items()
+                        if cid not in self._pending and bucket.is_full(now)]:
+            del self._chat_buckets[chat_id]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = loop.time()
+            # Выбираем чат, который раньше всех сможет получить сообщение
+            chat_id, wait = min(
+                ((cid, self._chat_bucket(cid, now).delay(now)) for cid in self._pending),
+                key=lambda item: item[1]
+            )
+            wait = max(wait, self._global_bucket.delay(now), self._paused_until - now)
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            queue = self._pending[chat_id]
+            message = queue.popleft()
+            if not queue:
+                del self._pending[chat_id]
+            self._global_bucket.consume(now)
+            self._chat_bucket(chat_id, now).consume(now)
+
+            await self._deliver(message)
+            self._forget_idle_buckets(loop.time())
+
+    async def _deliver(self, message: OutgoingMessage):
+        try:
+            if message.document is not None:
+                await self._bot.send_document(
+                    chat_id=message.chat_id,
+                    document=message.document,
+                    filename=message.filename,
+                    caption=message.text or None
+                )
+            elif message.message_id is None:
+                await self._bot.send_message(
+                    chat_id=message.chat_id,
+                    text=message.text,
+                    reply_markup=message.reply_markup
+                )
+            else:
+                await self._bot.edit_message_text(
+                    chat_id=message.chat_id,
+                    message_id=message.message_id,
+                    text=message.text,
+                    reply_markup=message.reply_markup
+                )
+            self.sent += 1
+        except RetryAfter as e:
+            delay = _seconds(e.retry_after)
+            logger.warning("Флуд-лимит Telegram, пауза отправки на %.0f с", delay)
+            self._paused_until = asyncio.get_running_loop().time() + delay
+            self.retried += 1
+            self._requeue(message)
+        except BadRequest as e:
+            # Повторное нажатие той же кнопки - сообщение уже в нужном виде
+            if message.message_id is not None and 'not modified' in str(e).lower():
+                return
+            logger.error("Сообщение в чат %s отклонено: %s", message.chat_id, e)
+            self.dropped += 1
+        except Forbidden as e:
+            logger.error("Сообщение в чат %s отклонено: %s", message.chat_id, e)
+            self.dropped += 1
+        except NetworkError as e:
+            message.attempts += 1
+            if message.attempts < MAX_SEND_ATTEMPTS:
+                logger.warning("Сетевая ошибка при отправке в чат %s, повтор: %s", message.chat_id, e)
+                self.retried += 1
+                self._requeue(message)
+            else:
+                logger.error("Сообщение в чат %s не отправлено после %s попыток: %s", message.chat_id, message.attempts, e)
+                self.dropped += 1
+        except Exception as e:
+            logger.error("Ошибка при отправке сообщения в чат %s: %s", message.chat_id, e)
+            self.dropped += 1
+
+# Общая очередь бота
+send_queue = SendQueue()
+
+async def reply(update, text: str, reply_markup=None):
+    """Отвечает в чат через очередь отправки, не дожидаясь доставки"""
+    if send_queue.running:
+        send_queue.enqueue(update.effective_chat.id, text, reply_markup=reply_markup)
+        return
+    # Очередь не запущена (например, при отладке) - отправляем напрямую
+    chunks = split_text(text)
+    for chunk in chunks[:-1]:
+        await update.effective_message.reply_text(chunk)
+    await update.effective_message.reply_text(chunks[-1], reply_markup=reply_markup)
+
+async def reply_document(update, document: bytes, filename: str, caption: str = ''):
+    """Отправляет файл в чат через очередь отправки"""
+    if send_queue.running:
+        send_queue.enqueue_document(update.effective_chat.id, document, filename, caption)
+        return
+    await update.effective_message.reply_document(document=document, filename=filename, caption=caption or None)
+
+async def edit(update, text: str, reply_markup=None):
+    """Правит сообщение, к которому привязана нажатая inline-кнопка"""
+    message = update.effective_message
+    if send_queue.running:
+        send_queue.edit(message.chat_id, message.message_id, text, reply_markup=reply_markup)
+        return
+    await message.edit_text(split_text(text)[0], reply_markup=reply_markup)
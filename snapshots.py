@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from config import SNAPSHOT_KEEP_DAYS
+from database import get_db_connection, SIGNED_QUANTITY, LAST_TRANSACTION_ID
+
+logger = logging.getLogger(__name__)
+
+# Формат CURRENT_TIMESTAMP в SQLite (UTC)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Запчасти, удаленные после moment, на тот момент еще были на складе.
+# Параметры: :at - moment, :taken_at и :last_id - снимок
+AS_OF_QUERY = '''
+SELECT p.id, p.name, p.part_number, p.unit, {base} {sign} COALESCE(d.delta, 0) AS quantity
+FROM parts p
+{snapshot_join}
+LEFT JOIN (
+    SELECT part_id, SUM({signed}) AS delta
+    FROM all_transactions
+    WHERE {delta_filter}
+    GROUP BY part_id
+) d ON d.part_id = p.id
+WHERE p.deleted_at IS NULL OR p.deleted_at > :at
+ORDER BY p.name
+'''
+
+def _to_db_time(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+def _from_db_time(value: str) -> datetime:
+    return datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+def take_snapshot() -> str:
+    """Сохраняет остатки всех запчастей одним INSERT ... SELECT"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    taken_at = _to_db_time(datetime.now(timezone.utc))
+    try:
+        cursor.execute(
+            'INSERT OR IGNORE INTO stock_snapshots (part_id, quantity, taken_at) SELECT id, quantity, ? FROM live_parts',
+            (taken_at,)
+        )
+        count = cursor.rowcount
+        # Номер последней транзакции читаем в той же транзакции, что и остатки
+        cursor.execute(
+            f'INSERT OR IGNORE INTO stock_snapshot_runs (taken_at, last_transaction_id) VALUES (?, ({LAST_TRANSACTION_ID}))',
+            (taken_at,)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("Снимок остатков сохранен: %s, позиций: %s", taken_at, count)
+    return taken_at
+
+def stock_as_of(moment: datetime):
+    """Остатки всех запчастей на момент moment.
+
+    Берется ближайший по времени снимок (или текущие остатки) и к нему
+    добавляются / из него вычитаются движения между снимком и moment.
+    Возвращает (время снимка или None для текущих остатков, строки запчастей).
+    """
+    at = _to_db_time(moment)
+    cursor = get_db_connection().cursor()
+
+    cursor.execute(
+        'SELECT taken_at, last_transaction_id FROM stock_snapshot_runs WHERE taken_at <= ? ORDER BY taken_at DESC LIMIT 1',
+        (at,)
+    )
+    before = cursor.fetchone()
+    cursor.execute(
+        'SELECT taken_at, last_transaction_id FROM stock_snapshot_runs WHERE taken_at > ? ORDER BY taken_at LIMIT 1',
+        (at,)
+    )
+    after = cursor.fetchone()
+
+    moment_utc = _from_db_time(at)
+    candidates = [(datetime.now(timezone.utc) - moment_utc, None)]
+    if before:
+        candidates.append((moment_utc - _from_db_time(before['taken_at']), before))
+    if after:
+        candidates.append((_from_db_time(after['taken_at']) - moment_utc, after))
+    _, snapshot = min(candidates, key=lambda item: item[0])
+
+    if snapshot is None:
+        # Ближе всего текущее состояние: вычитаем движения после moment
+        sql = AS_OF_QUERY.format(base='p.quantity', sign='-', snapshot_join='',
+                                 signed=SIGNED_QUANTITY, delta_filter='created_at > :at')
+        params = {'at': at}
+    else:
+        snapshot_join = 'LEFT JOIN stock_snapshots s ON s.taken_at = :taken_at AND s.part_id = p.id'
+        if snapshot is before:
+            delta_filter, sign = 'id > :last_id AND created_at <= :at', '+'
+        else:
+            delta_filter, sign = 'id <= :last_id AND created_at > :at', '-'
+        # Запчасти, удаленной до снимка, в нем нет: после удаления ее движений
+        # не было, и остаток на момент снимка - последний известный p.quantity
+        base = 'COALESCE(s.quantity, CASE WHEN p.deleted_at <= :taken_at THEN p.quantity ELSE 0 END)'
+        sql = AS_OF_QUERY.format(base=base, sign=sign, snapshot_join=snapshot_join,
+                                 signed=SIGNED_QUANTITY, delta_filter=delta_filter)
+        params = {'at': at, 'taken_at': snapshot['taken_at'], 'last_id': snapshot['last_transaction_id']}
+
+    cursor.execute(sql, params)
+    parts = cursor.fetchall()
+    return (_from_db_time(snapshot['taken_at']) if snapshot else None), parts
+
+def prune_snapshots(keep_days: int = SNAPSHOT_KEEP_DAYS) -> int:
+    """Удаляет старые снимки, оставляя первый снимок каждого месяца; возвращает их число"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cutoff = _to_db_time(datetime.now(timezone.utc) - timedelta(days=keep_days))
+    cursor.execute('''
+    SELECT taken_at FROM stock_snapshot_runs
+    WHERE taken_at < ?
+      AND taken_at NOT IN (SELECT MIN(taken_at) FROM stock_snapshot_runs GROUP BY substr(taken_at, 1, 7))
+    ''', (cutoff,))
+    stale = [row[0] for row in cursor.fetchall()]
+
+    # По снимку за транзакцию: запись не держит блокировку базы на все удаление
+    for taken_at in stale:
+        try:
+            cursor.execute('DELETE FROM stock_snapshots WHERE taken_at = ?', (taken_at,))
+            cursor.execute('DELETE FROM stock_snapshot_runs WHERE taken_at = ?', (taken_at,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    if stale:
+        logger.info("Удалено старых снимков остатков: %s", len(stale))
+    return len(stale)
+
+async def run_snapshot():
+    """Периодическая задача: снимок остатков и очистка старых снимков вне event loop"""
+    await asyncio.to_thread(take_snapshot)
+    await asyncio.to_thread(prune_snapshots)
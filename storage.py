@@ -0,0 +1,686 @@
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from config import STORAGE_BACKEND, DEDUP_KEEP_DAYS
+from database import get_db_connection, init_db, apply_movement, get_location_quantity, transfer_stock, claim_update, prune_processed_updates, DuplicateUpdate, ARCHIVE_COUNT
+from fuzzy import normalize_part_number
+from forecast import reorder_suggestions, REPORT_LIMIT
+from history import part_history, HISTORY_PAGE_SIZE
+from auth import init_auth_db
+from cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+class Part(NamedTuple):
+    """Запчасть. Для выборок по складу quantity и location - остаток на этом складе.
+
+    Поля доступны по имени (part.quantity), по индексу в порядке колонок
+    таблицы parts и по ключу (part['quantity']), как у строк sqlite3.Row.
+    """
+    id: int
+    name: str
+    part_number: str
+    quantity: int
+    unit: str
+    price: float
+    location: str
+    min_stock: int
+    supplier: str = None
+    pack_size: int = 1
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+class PartNumberTaken(ValueError):
+    """Код уже занят другой неудаленной запчастью (create и update обоих хранилищ)"""
+
+    def __init__(self, part_number: str):
+        super().__init__(f"Запчасть с кодом {part_number} уже существует")
+        self.part_number = part_number
+
+# Поля, которые можно менять через PartsRepository.update (остаток меняется только через Ledger)
+EDITABLE_FIELDS = ('name', 'part_number', 'unit', 'min_stock', 'price', 'supplier', 'pack_size')
+
+class PartsRepository(ABC):
+    """Запчасти и их остатки по складам. location=None - по всем складам."""
+
+    @abstractmethod
+    def get(self, part_id: int):
+        ...
+
+    @abstractmethod
+    def get_by_number(self, part_number: str):
+        ...
+
+    @abstractmethod
+    def find_by_norm(self, part_number_norm: str) -> list:
+        """Запчасти с таким каноническим кодом (см. normalize_part_number)"""
+
+    @abstractmethod
+    def get_many(self, part_ids: list) -> list:
+        ...
+
+    @abstractmethod
+    def all(self) -> list:
+        ...
+
+    @abstractmethod
+    def create(self, name: str, part_number: str, unit: str, min_stock: int, location: str, quantity: int) -> Part:
+        """Добавляет запчасть, начальный остаток оформляется приходом на location"""
+
+    @abstractmethod
+    def update(self, part_id: int, field: str, value):
+        """Меняет одно из EDITABLE_FIELDS"""
+
+    @abstractmethod
+    def delete(self, part_id: int):
+        """Помечает запчасть удаленной и убирает ее остатки; история остается (в SQLite позже уходит в архив)"""
+
+    @abstractmethod
+    def count(self, location: str = None) -> int:
+        ...
+
+    @abstractmethod
+    def totals(self, location: str = None):
+        """(число позиций, суммарный остаток)"""
+
+    @abstractmethod
+    def page(self, location: str = None, after_id: int = None, before_id: int = None, limit: int = 10) -> list:
+        """Страница по (name, id): после запчасти after_id или перед before_id, по возрастанию.
+
+        Возвращает до limit + 1 строк: лишняя строка (первая для before_id,
+        последняя иначе) показывает, что дальше есть еще страница.
+        """
+
+    @abstractmethod
+    def search(self, term: str, location: str = None) -> list:
+        """Подстрока в наименовании или коде"""
+
+    @abstractmethod
+    def low_stock(self, location: str = None) -> list:
+        """Позиции с остатком не выше минимального, по возрастанию остатка"""
+
+    @abstractmethod
+    def location_quantity(self, part_id: int, location: str) -> int:
+        ...
+
+    @abstractmethod
+    def locations(self) -> list:
+        """[(склад, позиций, суммарный остаток)] по складам с ненулевыми остатками"""
+
+    @abstractmethod
+    def reorder_suggestions(self, limit: int = REPORT_LIMIT):
+        """Позиции выше min_stock, но не выше точки заказа по прогнозу, по возрастанию дней запаса.
+
+        Возвращает (строки, сколько всего таких позиций). В строке: id, name,
+        part_number, unit, quantity, reorder_point, days_of_cover.
+        """
+
+class Ledger(ABC):
+    """Движения остатков. Каждый вызов - отдельная атомарная операция.
+
+    update_id - номер обновления Telegram, вызвавшего движение. Движение
+    с уже проведенным update_id не выполняется, бросается DuplicateUpdate.
+    """
+
+    @abstractmethod
+    def move(self, part_id: int, location: str, delta: int, comment: str = None, update_id: int = None):
+        """Приход (delta > 0) или расход (delta < 0) на складе location"""
+
+    @abstractmethod
+    def transfer(self, part_id: int, from_location: str, to_location: str, quantity: int,
+                 update_id: int = None) -> bool:
+        """Перемещение между складами; False, если на складе-источнике не хватает остатка"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Число транзакций в истории"""
+
+    @abstractmethod
+    def prune_processed_updates(self, keep_days: int = DEDUP_KEEP_DAYS) -> int:
+        """Забывает update_id, проведенные раньше keep_days дней назад; возвращает их число"""
+
+    @abstractmethod
+    def history(self, part_id: int, balance: int, after_id: int = None, before_id: int = None,
+                limit: int = HISTORY_PAGE_SIZE):
+        """Страница движений запчасти от новых к старым, как history.part_history.
+
+        Без курсора - самые новые движения, balance - текущий остаток.
+        after_id - движения старше него, balance - остаток до него.
+        before_id - движения новее него, balance - остаток после него.
+        Возвращает (строки страницы, есть ли еще страница в направлении листания).
+        """
+
+class UserRepository(ABC):
+    """Пользователи бота"""
+
+    @abstractmethod
+    def list(self) -> list:
+        """[(user_id, username, role)]"""
+
+    @abstractmethod
+    def add(self, user_id: int, username: str, role: str = 'user'):
+        ...
+
+    @abstractmethod
+    def remove(self, user_id: int):
+        ...
+
+class Storage(ABC):
+    """Хранилище бота: запчасти, журнал движений и пользователи"""
+    parts: PartsRepository
+    ledger: Ledger
+    users: UserRepository
+
+    def init(self):
+        """Готовит хранилище к работе (схема, миграции)"""
+
+# --- SQLite ---
+
+PART_COLUMNS = 'p.id, p.name, p.part_number, p.quantity, p.unit, p.price, p.location, p.min_stock, p.supplier, p.pack_size'
+# Остаток и склад берутся из stock, порядок колонок тот же
+LOCATION_PART_COLUMNS = 'p.id, p.name, p.part_number, s.quantity, p.unit, p.price, s.location, p.min_stock, p.supplier, p.pack_size'
+
+def _parts_source(location):
+    """FROM-часть и параметры для выборки по всем складам или по одному"""
+    if location:
+        return f'SELECT {LOCATION_PART_COLUMNS} FROM stock s JOIN live_parts p ON p.id = s.part_id WHERE s.location = ?', [location]
+    return f'SELECT {PART_COLUMNS} FROM live_parts p WHERE 1', []
+
+class SqlitePartsRepository(PartsRepository):
+
+    def _one(self, sql, params=()):
+        cursor = get_db_connection().cursor()
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        return Part(*row) if row else None
+
+    def _many(self, sql, params=()):
+        cursor = get_db_connection().cursor()
+        cursor.execute(sql, params)
+        return [Part(*row) for row in cursor.fetchall()]
+
+    def get(self, part_id):
+        return self._one(f'SELECT {PART_COLUMNS} FROM live_parts p WHERE p.id = ?', (part_id,))
+
+    def get_by_number(self, part_number):
+        return self._one(f'SELECT {PART_COLUMNS} FROM live_parts p WHERE p.part_number = ?', (part_number,))
+
+    def find_by_norm(self, part_number_norm):
+        return self._many(f'SELECT {PART_COLUMNS} FROM live_parts p WHERE p.part_number_norm = ?', (part_number_norm,))
+
+    def get_many(self, part_ids):
+        if not part_ids:
+            return []
+        placeholders = ','.join('?' * len(part_ids))
+        return self._many(f'SELECT {PART_COLUMNS} FROM live_parts p WHERE p.id IN ({placeholders})', list(part_ids))
+
+    def all(self):
+        return self._many(f'SELECT {PART_COLUMNS} FROM live_parts p')
+
+    def create(self, name, part_number, unit, min_stock, location, quantity):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                'INSERT INTO parts (name, part_number, part_number_norm, quantity, unit, location, min_stock) '
+                'VALUES (?, ?, ?, 0, ?, ?, ?)',
+                (name, part_number, normalize_part_number(part_number), unit, location, min_stock)
+            )
+            part_id = cursor.lastrowid
+            # Строка остатка нужна и при нулевом количестве: по ней запчасть видна в выборках склада
+            cursor.execute('INSERT INTO stock (part_id, location, quantity) VALUES (?, ?, 0)', (part_id, location))
+            apply_movement(cursor, part_id, location, quantity)
+            conn.commit()
+        except sqlite3.IntegrityError:
+            # Единственное ограничение parts - уникальный код среди неудаленных
+            conn.rollback()
+            raise PartNumberTaken(part_number) from None
+        except Exception:
+            conn.rollback()
+            raise
+        bump_data_version()
+        return self.get(part_id)
+
+    def update(self, part_id, field, value):
+        if field not in EDITABLE_FIELDS:
+            raise ValueError(f"Поле {field} нельзя менять напрямую")
+        conn = get_db_connection()
+        try:
+            conn.execute(f'UPDATE parts SET {field} = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', (value, part_id))
+            if field == 'part_number':
+                conn.execute('UPDATE parts SET part_number_norm = ? WHERE id = ?', (normalize_part_number(value), part_id))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            raise PartNumberTaken(value) from None
+        except Exception:
+            conn.rollback()
+            raise
+        bump_data_version()
+
+    def delete(self, part_id):
+        conn = get_db_connection()
+        try:
+            # Мягкое удаление: запчасть и история остаются в базе, историю позже
+            # пачками переносит в архив purge_deleted_parts; остатки по складам не нужны
+            conn.execute(
+                'UPDATE parts SET deleted_at = CURRENT_TIMESTAMP WHERE id = ? AND deleted_at IS NULL', (part_id,)
+            )
+            conn.execute('DELETE FROM stock WHERE part_id = ?', (part_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        bump_data_version()
+
+    def count(self, location=None):
+        cursor = get_db_connection().cursor()
+        if location:
+            cursor.execute('SELECT COUNT(*) FROM stock WHERE location = ?', (location,))
+        else:
+            cursor.execute("SELECT row_count FROM table_counts WHERE tbl = 'parts'")
+        return cursor.fetchone()[0]
+
+    def totals(self, location=None):
+        cursor = get_db_connection().cursor()
+        if location:
+            cursor.execute('SELECT COUNT(*), SUM(quantity) FROM stock WHERE location = ?', (location,))
+        else:
+            cursor.execute('SELECT COUNT(*), SUM(quantity) FROM live_parts')
+        count, quantity = cursor.fetchone()
+        return count, quantity or 0
+
+    def page(self, location=None, after_id=None, before_id=None, limit=10):
+        sql, params = _parts_source(location)
+        if before_id is not None:
+            sql += ' AND (p.name, p.id) < (SELECT name, id FROM parts WHERE id = ?) ORDER BY p.name DESC, p.id DESC'
+            params.append(before_id)
+        elif after_id is not None:
+            sql += ' AND (p.name, p.id) > (SELECT name, id FROM parts WHERE id = ?) ORDER BY p.name, p.id'
+            params.append(after_id)
+        else:
+            sql += ' ORDER BY p.name, p.id'
+        parts = self._many(f'{sql} LIMIT ?', (*params, limit + 1))
+        if before_id is not None:
+            parts.reverse()
+        return parts
+
+    def search(self, term, location=None):
+        sql, params = _parts_source(location)
+        return self._many(f'{sql} AND (p.name LIKE ? OR p.part_number LIKE ?)', (*params, f'%{term}%', f'%{term}%'))
+
+    def low_stock(self, location=None):
+        sql, params = _parts_source(location)
+        if location:
+            return self._many(f'{sql} AND s.quantity <= p.min_stock ORDER BY s.quantity', params)
+        # Та же проверка в виде выражения индекса idx_parts_low_stock
+        return self._many(f'{sql} AND p.quantity - p.min_stock <= 0 ORDER BY p.quantity', params)
+
+    def location_quantity(self, part_id, location):
+        return get_location_quantity(get_db_connection().cursor(), part_id, location)
+
+    def locations(self):
+        cursor = get_db_connection().cursor()
+        cursor.execute(
+            'SELECT location, COUNT(*), SUM(quantity) FROM stock WHERE quantity <> 0 GROUP BY location ORDER BY location'
+        )
+        return [tuple(row) for row in cursor.fetchall()]
+
+    def reorder_suggestions(self, limit=REPORT_LIMIT):
+        return reorder_suggestions(limit)
+
+class SqliteLedger(Ledger):
+
+    def move(self, part_id, location, delta, comment=None, update_id=None):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            # Отметка update_id и движение фиксируются одной транзакцией
+            claim_update(cursor, update_id)
+            apply_movement(cursor, part_id, location, delta, comment)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        bump_data_version()
+
+    def transfer(self, part_id, from_location, to_location, quantity, update_id=None):
+        if not transfer_stock(get_db_connection(), part_id, from_location, to_location, quantity, update_id):
+            return False
+        bump_data_version()
+        return True
+
+    def count(self):
+        cursor = get_db_connection().cursor()
+        # Счетчики горячей и архивной таблиц ведут триггеры и архивирование
+        cursor.execute(
+            "SELECT SUM(row_count) FROM table_counts WHERE tbl IN ('transactions', ?)", (ARCHIVE_COUNT,)
+        )
+        return cursor.fetchone()[0] or 0
+
+    def prune_processed_updates(self, keep_days=DEDUP_KEEP_DAYS):
+        return prune_processed_updates(keep_days)
+
+    def history(self, part_id, balance, after_id=None, before_id=None, limit=HISTORY_PAGE_SIZE):
+        return part_history(part_id, balance, after_id, before_id, limit)
+
+class SqliteUserRepository(UserRepository):
+    """Таблица users в parts.db (создается в auth.init_auth_db)"""
+
+    def list(self):
+        cursor = get_db_connection().cursor()
+        cursor.execute('SELECT user_id, username, role FROM users ORDER BY user_id')
+        return [tuple(row) for row in cursor.fetchall()]
+
+    def add(self, user_id, username, role='user'):
+        conn = get_db_connection()
+        conn.execute('INSERT OR REPLACE INTO users (user_id, username, role) VALUES (?, ?, ?)', (user_id, username, role))
+        conn.commit()
+
+    def remove(self, user_id):
+        conn = get_db_connection()
+        conn.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+        conn.commit()
+
+class SqliteStorage(Storage):
+    """Рабочее хранилище: parts.db и архив транзакций.
+
+    Снимки, сверка, архивирование, оценка склада и журнал изменений
+    работают напрямую с SQLite и доступны только с этим хранилищем.
+    """
+
+    def __init__(self):
+        self.parts = SqlitePartsRepository()
+        self.ledger = SqliteLedger()
+        self.users = SqliteUserRepository()
+
+    def init(self):
+        init_db()
+        init_auth_db()
+
+# --- В памяти ---
+
+class MemoryPartsRepository(PartsRepository):
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def _part(self, row, location=None):
+        if location is None:
+            return Part(row['id'], row['name'], row['part_number'], row['quantity'], row['unit'],
+                        row['price'], row['location'], row['min_stock'], row['supplier'], row['pack_size'])
+        return Part(row['id'], row['name'], row['part_number'], self._storage.stock[(row['id'], location)],
+                    row['unit'], row['price'], location, row['min_stock'], row['supplier'], row['pack_size'])
+
+    def _live(self):
+        """Неудаленные запчасти, как live_parts в SQLite"""
+        return [row for row in self._storage.part_rows.values() if row['deleted_at'] is None]
+
+    def _rows(self, location=None):
+        """Запчасти (на складе location) как Part"""
+        parts = self._storage.part_rows
+        if location is None:
+            return [self._part(row) for row in self._live()]
+        return [self._part(parts[part_id], location) for part_id, stock_location in self._storage.stock
+                if stock_location == location]
+
+    def get(self, part_id):
+        row = self._storage.part_rows.get(part_id)
+        return self._part(row) if row and row['deleted_at'] is None else None
+
+    def get_by_number(self, part_number):
+        for row in self._live():
+            if row['part_number'] == part_number:
+                return self._part(row)
+        return None
+
+    def find_by_norm(self, part_number_norm):
+        return [self._part(row) for row in self._live()
+                if normalize_part_number(row['part_number']) == part_number_norm]
+
+    def get_many(self, part_ids):
+        return [part for part in map(self.get, part_ids) if part]
+
+    def all(self):
+        return self._rows()
+
+    def create(self, name, part_number, unit, min_stock, location, quantity):
+        if self.get_by_number(part_number):
+            raise PartNumberTaken(part_number)
+        storage = self._storage
+        storage.last_part_id += 1
+        part_id = storage.last_part_id
+        storage.part_rows[part_id] = {
+            'id': part_id, 'name': name, 'part_number': part_number, 'quantity': 0, 'unit': unit,
+            'price': 0.0, 'location': location, 'min_stock': min_stock, 'supplier': None, 'pack_size': 1,
+            'deleted_at': None,
+        }
+        storage.stock[(part_id, location)] = 0
+        storage.ledger.move(part_id, location, quantity)
+        bump_data_version()
+        return self.get(part_id)
+
+    def update(self, part_id, field, value):
+        if field not in EDITABLE_FIELDS:
+            raise ValueError(f"Поле {field} нельзя менять напрямую")
+        if field == 'part_number':
+            taken = self.get_by_number(value)
+            if taken and taken.id != part_id:
+                raise PartNumberTaken(value)
+        self._storage.part_rows[part_id][field] = value
+        bump_data_version()
+
+    def delete(self, part_id):
+        storage = self._storage
+        row = storage.part_rows.get(part_id)
+        if row is None or row['deleted_at'] is not None:
+            return
+        # Мягкое удаление, как в SQLite: запчасть и ее история остаются
+        row['deleted_at'] = datetime.now(timezone.utc)
+        for key in [key for key in storage.stock if key[0] == part_id]:
+            del storage.stock[key]
+        bump_data_version()
+
+    def count(self, location=None):
+        return len(self._rows(location))
+
+    def totals(self, location=None):
+        parts = self._rows(location)
+        return len(parts), sum(part.quantity for part in parts)
+
+    def page(self, location=None, after_id=None, before_id=None, limit=10):
+        parts = sorted(self._rows(location), key=lambda part: (part.name, part.id))
+        cursor_id = before_id if before_id is not None else after_id
+        if cursor_id is None:
+            return parts[:limit + 1]
+        cursor_part = self._storage.part_rows.get(cursor_id)
+        if cursor_part is None:
+            return []
+        key = (cursor_part['name'], cursor_id)
+        if before_id is not None:
+            return [part for part in parts if (part.name, part.id) < key][-(limit + 1):]
+        return [part for part in parts if (part.name, part.id) > key][:limit + 1]
+
+    def search(self, term, location=None):
+        term = term.casefold()
+        return [part for part in self._rows(location)
+                if term in part.name.casefold() or term in part.part_number.casefold()]
+
+    def low_stock(self, location=None):
+        parts = [part for part in self._rows(location) if part.quantity <= part.min_stock]
+        return sorted(parts, key=lambda part: part.quantity)
+
+    def location_quantity(self, part_id, location):
+        return self._storage.stock.get((part_id, location), 0)
+
+    def locations(self):
+        summary = {}
+        for (_, location), quantity in self._storage.stock.items():
+            if quantity:
+                positions, total = summary.get(location, (0, 0))
+                summary[location] = (positions + 1, total + quantity)
+        return [(location, *summary[location]) for location in sorted(summary)]
+
+    def reorder_suggestions(self, limit=REPORT_LIMIT):
+        suggestions = []
+        for row in self._live():
+            point = self._storage.reorder_points.get(row['id'])
+            if point is None or not row['min_stock'] < row['quantity'] <= point['reorder_point']:
+                continue
+            suggestions.append({
+                'id': row['id'], 'name': row['name'], 'part_number': row['part_number'], 'unit': row['unit'],
+                'quantity': row['quantity'], 'reorder_point': point['reorder_point'],
+                'days_of_cover': row['quantity'] / point['daily_mean'],
+            })
+        suggestions.sort(key=lambda suggestion: suggestion['days_of_cover'])
+        return suggestions[:limit], len(suggestions)
+
+# Колонки строки истории, как в history.OLDER_QUERY (без delta и balance)
+HISTORY_FIELDS = ('id', 'type', 'quantity', 'location', 'comment', 'created_at')
+
+class MemoryLedger(Ledger):
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def _record(self, part_id, type_, quantity, location, comment=None):
+        storage = self._storage
+        storage.last_transaction_id += 1
+        storage.transactions.append({
+            'id': storage.last_transaction_id, 'part_id': part_id, 'type': type_, 'quantity': quantity,
+            'location': location, 'comment': comment,
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+
+    def _claim(self, update_id):
+        if update_id is None:
+            return
+        if update_id in self._storage.processed_updates:
+            raise DuplicateUpdate(update_id)
+        self._storage.processed_updates[update_id] = datetime.now(timezone.utc)
+
+    def move(self, part_id, location, delta, comment=None, update_id=None):
+        self._claim(update_id)
+        if delta == 0:
+            return
+        storage = self._storage
+        storage.stock[(part_id, location)] = storage.stock.get((part_id, location), 0) + delta
+        storage.part_rows[part_id]['quantity'] += delta
+        self._record(part_id, 'incoming' if delta > 0 else 'outgoing', abs(delta), location, comment)
+        bump_data_version()
+
+    def transfer(self, part_id, from_location, to_location, quantity, update_id=None):
+        self._claim(update_id)
+        stock = self._storage.stock
+        if stock.get((part_id, from_location), 0) < quantity:
+            # Как откат транзакции в SQLite: отметка обновления не сохраняется
+            self._storage.processed_updates.pop(update_id, None)
+            return False
+        stock[(part_id, from_location)] -= quantity
+        stock[(part_id, to_location)] = stock.get((part_id, to_location), 0) + quantity
+        self._record(part_id, 'transfer_out', quantity, from_location)
+        self._record(part_id, 'transfer_in', quantity, to_location)
+        bump_data_version()
+        return True
+
+    def count(self):
+        return len(self._storage.transactions)
+
+    def prune_processed_updates(self, keep_days=DEDUP_KEEP_DAYS):
+        processed = self._storage.processed_updates
+        cutoff = datetime.now(timezone.utc) - timedelta(days=keep_days)
+        stale = [update_id for update_id, processed_at in processed.items() if processed_at < cutoff]
+        for update_id in stale:
+            del processed[update_id]
+        return len(stale)
+
+    def history(self, part_id, balance, after_id=None, before_id=None, limit=HISTORY_PAGE_SIZE):
+        transactions = self._storage.transactions
+        cursor_id = before_id if before_id is not None else after_id
+        cursor = None
+        if cursor_id is not None:
+            created_at = next((row['created_at'] for row in transactions if row['id'] == cursor_id), None)
+            if created_at is None:
+                return [], False
+            cursor = (created_at, cursor_id)
+
+        def key(row):
+            return row['created_at'], row['id']
+
+        # Изменение общего остатка - как SIGNED_QUANTITY: перемещения его не меняют
+        moves = [
+            {field: row[field] for field in HISTORY_FIELDS}
+            | {'delta': {'incoming': row['quantity'], 'outgoing': -row['quantity']}.get(row['type'], 0)}
+            for row in transactions if row['part_id'] == part_id
+        ]
+        if before_id is not None:
+            newer = sorted((row for row in moves if key(row) > cursor), key=key)
+            rows = newer[:limit]
+            for row in rows:
+                balance += row['delta']
+                row['balance'] = balance
+            rows.reverse()
+            return rows, len(newer) > limit
+
+        older = sorted((row for row in moves if cursor is None or key(row) < cursor), key=key, reverse=True)
+        rows = older[:limit]
+        for row in rows:
+            row['balance'] = balance
+            balance -= row['delta']
+        return rows, len(older) > limit
+
+class MemoryUserRepository(UserRepository):
+
+    def __init__(self):
+        self._users = {}
+
+    def list(self):
+        return [(user_id, *self._users[user_id]) for user_id in sorted(self._users)]
+
+    def add(self, user_id, username, role='user'):
+        self._users[user_id] = (username, role)
+
+    def remove(self, user_id):
+        self._users.pop(user_id, None)
+
+class MemoryStorage(Storage):
+    """Хранилище в памяти для тестов и замеров: ничего не пишет на диск"""
+
+    def __init__(self):
+        self.part_rows = {}  # id -> словарь полей запчасти
+        self.last_part_id = 0
+        self.stock = {}  # (part_id, склад) -> остаток
+        self.transactions = []
+        self.last_transaction_id = 0
+        self.processed_updates = {}  # update_id -> время проведения (UTC)
+        self.reorder_points = {}  # part_id -> {'daily_mean': ..., 'reorder_point': ...}, как таблица reorder_points
+        self.parts = MemoryPartsRepository(self)
+        self.ledger = MemoryLedger(self)
+        self.users = MemoryUserRepository()
+
+_BACKENDS = {
+    'sqlite': SqliteStorage,
+    'memory': MemoryStorage,
+}
+
+_storage = None
+
+def get_storage() -> Storage:
+    """Хранилище бота (выбирается STORAGE_BACKEND при первом обращении)"""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND not in _BACKENDS:
+            raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND={STORAGE_BACKEND}")
+        _storage = _BACKENDS[STORAGE_BACKEND]()
+        logger.info("Хранилище: %s", STORAGE_BACKEND)
+    return _storage
+
+def set_storage(storage: Storage):
+    """Подменяет хранилище (например, MemoryStorage в тестах)"""
+    global _storage
+    _storage = storage
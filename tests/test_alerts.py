@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+import alerts
+from alerts import LowStockAlerts
+
+class FakeQueue:
+    running = True
+
+    def __init__(self):
+        self.sent = []
+
+    def enqueue(self, chat_id, text):
+        self.sent.append(text)
+
+@pytest.fixture
+def admin_queue(monkeypatch):
+    queue = FakeQueue()
+    monkeypatch.setattr(alerts, 'send_queue', queue)
+    return queue
+
+def part(part_id, quantity, min_stock=5):
+    return {'id': part_id, 'name': f'Запчасть {part_id}', 'part_number': f'P-{part_id}',
+            'quantity': quantity, 'unit': 'шт.', 'min_stock': min_stock}
+
+def run_changes(collector, *changes):
+    """Передает изменения сборщику внутри event loop и сразу отправляет дайджест"""
+    async def scenario():
+        for args in changes:
+            collector.note_change(*args)
+        collector.flush()
+    asyncio.run(scenario())
+
+def test_digest_lists_crossed_parts_by_quantity(admin_queue):
+    collector = LowStockAlerts(delay=3600)
+    run_changes(collector, (part(1, 10), 4), (part(2, 10), 1), (part(1, 4), 3))
+    assert len(admin_queue.sent) == 1
+    lines = admin_queue.sent[0].splitlines()
+    assert lines[2:] == ['Запчасть 2 (P-2): 1/5 шт.', 'Запчасть 1 (P-1): 3/5 шт.']
+
+def test_recovered_and_already_low_parts_are_not_reported(admin_queue):
+    collector = LowStockAlerts(delay=3600)
+    run_changes(collector, (part(1, 10), 4), (part(1, 4), 8), (part(2, 3), 2))
+    assert admin_queue.sent == []
+
+def test_raised_min_stock_crosses_threshold(admin_queue):
+    collector = LowStockAlerts(delay=3600)
+    run_changes(collector, (part(1, 10), 10, 12))
+    assert '10/12' in admin_queue.sent[0]
+
+def test_cooldown_suppresses_repeated_alert(admin_queue):
+    collector = LowStockAlerts(delay=3600, cooldown=3600)
+    run_changes(collector, (part(1, 10), 4))
+    run_changes(collector, (part(1, 10), 3))
+    assert len(admin_queue.sent) == 1
+
+def test_digest_without_running_queue_is_logged(monkeypatch, caplog):
+    queue = FakeQueue()
+    queue.running = False
+    monkeypatch.setattr(alerts, 'send_queue', queue)
+    run_changes(LowStockAlerts(delay=3600), (part(1, 10), 4))
+    assert queue.sent == []
+    assert 'Запчасть 1 (P-1): 4/5' in caplog.text
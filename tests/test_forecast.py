@@ -0,0 +1,34 @@
+import math
+import pytest
+
+# Прогноз необязателен и без NumPy не считается
+np = pytest.importorskip('numpy')
+
+from forecast import forecast_consumption, compute_reorder_points
+from purchase_orders import build_purchase_order
+
+def test_days_without_consumption_count_as_zero():
+    # Запчасть 7: по 10 в дни 0 и 5 из 10 - среднее 2, отклонение 4
+    history = np.array([[7, 0, 4], [7, 0, 6], [7, 5, 10]], dtype=np.int64)
+    part_ids, mean, std, reorder_point = forecast_consumption(history, 10, 5, 1.0)
+    assert part_ids.tolist() == [7]
+    assert mean.tolist() == [2.0]
+    assert std.tolist() == [4.0]
+    assert reorder_point.tolist() == [math.ceil(2 * 5 + 4 * math.sqrt(5))]
+
+def test_reorder_points_drive_report_and_order(sqlite_storage):
+    part = sqlite_storage.parts.create('Фильтр', 'A', 'шт.', 2, 'склад', 40)
+    sqlite_storage.ledger.move(part.id, 'склад', -30)
+    idle = sqlite_storage.parts.create('Ремень', 'B', 'шт.', 2, 'склад', 1)
+
+    # 30 за 10 дней - 3 в день, за 5 дней поставки нужно 15
+    assert compute_reorder_points(window_days=10, lead_time_days=5, service_z=0) == 1
+    rows, total = sqlite_storage.parts.reorder_suggestions()
+    assert total == 1
+    assert (rows[0]['part_number'], rows[0]['reorder_point']) == ('A', 15)
+
+    lines = {line[0]: line for _, lines in build_purchase_order(cover_days=10) for line in lines}
+    # A: до точки заказа плюс расход за 10 дней (15 + 30); B без прогноза - до 2 * min_stock
+    assert lines['A'][4:7] == [45, 1, 35]
+    assert lines['B'][4:7] == [4, 1, 3]
+    assert idle.id not in [row['id'] for row in rows]
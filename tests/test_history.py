@@ -0,0 +1,49 @@
+def history_with_moves(storage):
+    """Приход 5, приход 3, расход 2, перемещение 1 на цех, приход 1 - остаток 7"""
+    part = storage.parts.create('Фильтр', 'A', 'шт.', 1, 'склад', 5)
+    storage.ledger.move(part.id, 'склад', 3)
+    storage.ledger.move(part.id, 'склад', -2, 'в ремонт')
+    storage.ledger.transfer(part.id, 'склад', 'цех', 1)
+    storage.ledger.move(part.id, 'цех', 1)
+    return part
+
+def summary(rows):
+    return [(row['type'], row['delta'], row['balance']) for row in rows]
+
+def test_history_pages_from_newest_to_oldest(any_storage):
+    part = history_with_moves(any_storage)
+    pages = []
+    rows, has_more = any_storage.ledger.history(part.id, 7, limit=2)
+    pages.append(summary(rows))
+    while has_more:
+        rows, has_more = any_storage.ledger.history(
+            part.id, rows[-1]['balance'] - rows[-1]['delta'], after_id=rows[-1]['id'], limit=2
+        )
+        pages.append(summary(rows))
+
+    assert pages == [
+        [('incoming', 1, 7), ('transfer_in', 0, 6)],
+        [('transfer_out', 0, 6), ('outgoing', -2, 6)],
+        [('incoming', 3, 8), ('incoming', 5, 5)],
+    ]
+    assert rows[-1]['location'] == 'склад'
+
+def test_history_page_back_to_newer_moves(any_storage):
+    part = history_with_moves(any_storage)
+    first, _ = any_storage.ledger.history(part.id, 7, limit=2)
+    second, _ = any_storage.ledger.history(
+        part.id, first[-1]['balance'] - first[-1]['delta'], after_id=first[-1]['id'], limit=2
+    )
+    third, _ = any_storage.ledger.history(
+        part.id, second[-1]['balance'] - second[-1]['delta'], after_id=second[-1]['id'], limit=2
+    )
+
+    rows, has_more = any_storage.ledger.history(part.id, third[0]['balance'], before_id=third[0]['id'], limit=2)
+    assert summary(rows) == summary(second) and has_more
+    assert rows[-1]['comment'] == 'в ремонт'
+    rows, has_more = any_storage.ledger.history(part.id, rows[0]['balance'], before_id=rows[0]['id'], limit=2)
+    assert summary(rows) == summary(first) and not has_more
+
+def test_history_with_unknown_cursor_is_empty(any_storage):
+    part = history_with_moves(any_storage)
+    assert any_storage.ledger.history(part.id, 7, after_id=10_000) == ([], False)
@@ -0,0 +1,34 @@
+import pytest
+from purchase_orders import build_purchase_order, purchase_order_csv
+
+def order_lines(group_by):
+    """[(группа, код, остаток, заказать)]"""
+    return [
+        (group, line[0], line[2], line[6])
+        for group, lines in build_purchase_order(group_by) for line in lines
+    ]
+
+@pytest.fixture
+def stock_in_two_locations(sqlite_storage):
+    """A: 100 на складе и 0 в цехе; B: 2 на складе и 1 в цехе при min_stock 5"""
+    parts = sqlite_storage.parts
+    plenty = parts.create('Фильтр', 'A', 'шт.', 10, 'склад', 100)
+    sqlite_storage.ledger.transfer(plenty.id, 'склад', 'цех', 5)
+    sqlite_storage.ledger.move(plenty.id, 'цех', -5)
+    short = parts.create('Ремень', 'B', 'шт.', 5, 'склад', 2)
+    sqlite_storage.ledger.move(short.id, 'цех', 1)
+    parts.update(short.id, 'supplier', 'ООО Ремни')
+    return sqlite_storage
+
+def test_order_by_supplier_uses_total_quantity(stock_in_two_locations):
+    # Без прогноза заказываем до двойного min_stock: 10 - 3
+    assert order_lines('supplier') == [('ООО Ремни', 'B', 3, 7)]
+
+def test_order_by_location_has_one_line_per_part(stock_in_two_locations):
+    # A не заказывается, хотя в цехе ее нет; B - по складу, где она кончится первой
+    assert order_lines('location') == [('цех', 'B', 3, 7)]
+
+def test_order_csv_has_group_column(stock_in_two_locations):
+    text = purchase_order_csv(build_purchase_order('location'), 'location').decode('utf-8-sig')
+    assert text.splitlines()[0].startswith('Склад;Код;')
+    assert text.splitlines()[1].startswith('цех;B;Ремень;3;')
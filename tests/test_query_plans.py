@@ -0,0 +1,5 @@
+from query_plans import check_plans
+
+def test_hot_queries_use_indexes(sqlite_storage):
+    # Фикстура переводит parts.db и архив во временный каталог
+    assert check_plans() == []
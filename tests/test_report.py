@@ -0,0 +1,42 @@
+import storage
+from database import get_db_connection
+from storage import MemoryStorage
+from handlers import render_report
+
+def set_reorder_point(backend, part_id: int, daily_mean: float, reorder_point: int):
+    """Записывает прогноз в обход расчета по истории расхода"""
+    if isinstance(backend, MemoryStorage):
+        backend.reorder_points[part_id] = {'daily_mean': daily_mean, 'reorder_point': reorder_point}
+        return
+    conn = get_db_connection()
+    conn.execute(
+        'INSERT INTO reorder_points (part_id, daily_mean, daily_std, reorder_point, computed_at) '
+        "VALUES (?, ?, 0, ?, datetime('now'))",
+        (part_id, daily_mean, reorder_point)
+    )
+    conn.commit()
+
+def test_reorder_suggestions_between_min_stock_and_reorder_point(any_storage):
+    slow = any_storage.parts.create('Фильтр', 'A', 'шт.', 2, 'склад', 8)
+    fast = any_storage.parts.create('Ремень', 'B', 'шт.', 2, 'склад', 6)
+    low = any_storage.parts.create('Свеча', 'C', 'шт.', 5, 'склад', 5)
+    enough = any_storage.parts.create('Масло', 'D', 'л', 1, 'склад', 50)
+    set_reorder_point(any_storage, slow.id, 1.0, 10)
+    set_reorder_point(any_storage, fast.id, 3.0, 10)
+    set_reorder_point(any_storage, low.id, 1.0, 10)
+    set_reorder_point(any_storage, enough.id, 1.0, 10)
+
+    rows, total = any_storage.parts.reorder_suggestions()
+    assert total == 2
+    assert [(row['part_number'], row['days_of_cover']) for row in rows] == [('B', 2.0), ('A', 8.0)]
+    assert any_storage.parts.reorder_suggestions(limit=1)[1] == 2
+
+def test_report_on_memory_backend_does_not_touch_sqlite(memory_storage, monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, '_storage', memory_storage)
+    monkeypatch.chdir(tmp_path)
+    part = memory_storage.parts.create('Фильтр', 'A', 'шт.', 2, 'склад', 4)
+    set_reorder_point(memory_storage, part.id, 1.0, 10)
+
+    message = render_report(None)
+    assert 'Фильтр (A): 4/10 шт.' in message
+    assert not (tmp_path / 'parts.db').exists()
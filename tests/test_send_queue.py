@@ -0,0 +1,129 @@
+import asyncio
+from datetime import timedelta
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
+from send_queue import SendQueue, OutgoingMessage, split_text, MAX_MESSAGE_LENGTH
+
+class FakeBot:
+    """Записывает отправленное; failures - исключения для первых вызовов"""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.calls = []
+
+    async def _call(self, method, **kwargs):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.calls.append((method, kwargs))
+
+    async def send_message(self, **kwargs):
+        await self._call('send_message', **kwargs)
+
+    async def edit_message_text(self, **kwargs):
+        await self._call('edit_message_text', **kwargs)
+
+    async def send_document(self, **kwargs):
+        await self._call('send_document', **kwargs)
+
+def run_queue(bot, fill, **settings):
+    """Запускает очередь, ставит сообщения вызовом fill(queue) и ждет их отправки"""
+    async def scenario():
+        queue = SendQueue(**settings)
+        queue.start(bot)
+        fill(queue)
+        await queue.stop()
+        return queue
+    return asyncio.run(scenario())
+
+def inline_keyboard():
+    return InlineKeyboardMarkup([[InlineKeyboardButton('>', callback_data='next')]])
+
+def test_split_text_prefers_line_breaks():
+    text = '\n'.join(f'строка {i}' for i in range(1000))
+    chunks = split_text(text)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+    assert all(not chunk.startswith('\n') for chunk in chunks)
+    assert '\n'.join(chunks) == text
+
+def test_split_text_cuts_line_without_breaks():
+    chunks = split_text('x' * (MAX_MESSAGE_LENGTH + 10))
+    assert [len(chunk) for chunk in chunks] == [MAX_MESSAGE_LENGTH, 10]
+
+def test_messages_to_one_chat_are_coalesced():
+    bot = FakeBot()
+    queue = run_queue(bot, lambda queue: (queue.enqueue(1, 'первое'), queue.enqueue(1, 'второе')))
+    assert [kwargs['text'] for _, kwargs in bot.calls] == ['первое\n\nвторое']
+    assert queue.coalesced == 1
+
+def test_inline_keyboard_and_other_chats_are_not_coalesced():
+    bot = FakeBot()
+    keyboard = inline_keyboard()
+
+    def fill(queue):
+        queue.enqueue(1, 'страница', reply_markup=keyboard)
+        queue.enqueue(1, 'текст')
+        queue.enqueue(2, 'другой чат')
+
+    run_queue(bot, fill)
+    sent = sorted((kwargs['chat_id'], kwargs['text']) for _, kwargs in bot.calls)
+    assert sent == [(1, 'страница'), (1, 'текст'), (2, 'другой чат')]
+
+def test_long_text_is_split_and_keyboard_goes_to_last_part():
+    bot = FakeBot()
+    keyboard = inline_keyboard()
+    run_queue(bot, lambda queue: queue.enqueue(1, 'x' * (MAX_MESSAGE_LENGTH + 1), reply_markup=keyboard))
+    assert [len(kwargs['text']) for _, kwargs in bot.calls] == [MAX_MESSAGE_LENGTH, 1]
+    assert [kwargs['reply_markup'] for _, kwargs in bot.calls] == [None, keyboard]
+
+def test_pending_edit_of_same_message_is_replaced():
+    bot = FakeBot()
+
+    def fill(queue):
+        queue.edit(1, 10, 'старый текст')
+        queue.edit(1, 10, 'новый текст')
+
+    queue = run_queue(bot, fill)
+    assert [(method, kwargs['text']) for method, kwargs in bot.calls] == [('edit_message_text', 'новый текст')]
+    assert queue.coalesced == 1
+
+def test_replacing_edit_is_cut_to_one_message():
+    bot = FakeBot()
+
+    def fill(queue):
+        queue.edit(1, 10, 'старый текст')
+        queue.edit(1, 10, 'x' * (MAX_MESSAGE_LENGTH + 10))
+
+    run_queue(bot, fill)
+    assert [(method, len(kwargs['text'])) for method, kwargs in bot.calls] == [('edit_message_text', MAX_MESSAGE_LENGTH)]
+
+def test_document_is_sent_separately():
+    bot = FakeBot()
+
+    def fill(queue):
+        queue.enqueue(1, 'текст')
+        queue.enqueue_document(1, b'csv', 'order.csv', 'подпись')
+
+    run_queue(bot, fill)
+    assert [method for method, _ in bot.calls] == ['send_message', 'send_document']
+    assert bot.calls[1][1]['caption'] == 'подпись'
+
+def test_retry_after_pauses_queue_and_requeues_message():
+    async def scenario():
+        queue = SendQueue()
+        queue._bot = FakeBot([RetryAfter(timedelta(seconds=30))])
+        message = OutgoingMessage(1, 'текст')
+        await queue._deliver(message)
+        paused_for = queue._paused_until - asyncio.get_running_loop().time()
+        return queue, message, paused_for
+
+    queue, message, paused_for = asyncio.run(scenario())
+    assert queue.retried == 1 and queue.sent == 0
+    assert list(queue._pending[1]) == [message]
+    assert 29 < paused_for <= 30
+
+def test_message_is_delivered_after_retry_after():
+    bot = FakeBot([RetryAfter(timedelta(milliseconds=50))])
+    queue = run_queue(bot, lambda queue: queue.enqueue(1, 'текст'))
+    assert [kwargs['text'] for _, kwargs in bot.calls] == ['текст']
+    assert (queue.retried, queue.sent, queue.dropped) == (1, 1, 0)
@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+from database import get_db_connection
+from snapshots import take_snapshot, stock_as_of, prune_snapshots
+
+def at(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+def set_times(sql: str, *params):
+    conn = get_db_connection()
+    conn.execute(sql, params)
+    conn.commit()
+
+def quantities(moment: str):
+    snapshot_time, rows = stock_as_of(at(moment))
+    return snapshot_time, {row['part_number']: row['quantity'] for row in rows}
+
+def move_snapshot(taken_at: str):
+    """Переносит единственный снимок на taken_at"""
+    set_times('UPDATE stock_snapshots SET taken_at = ?', taken_at)
+    set_times('UPDATE stock_snapshot_runs SET taken_at = ?', taken_at)
+
+def stock_with_two_parts(storage):
+    """A: 5 и B: 7 с января 2020, B удалена в марте"""
+    storage.parts.create('Фильтр', 'A', 'шт.', 1, 'склад', 5)
+    part_b = storage.parts.create('Ремень', 'B', 'шт.', 1, 'склад', 7)
+    set_times("UPDATE transactions SET created_at = '2020-01-10 10:00:00'")
+    storage.parts.delete(part_b.id)
+    set_times("UPDATE parts SET deleted_at = '2020-03-01 00:00:00' WHERE id = ?", part_b.id)
+    return part_b
+
+def test_part_deleted_after_moment_from_current_stock(sqlite_storage):
+    stock_with_two_parts(sqlite_storage)
+    snapshot_time, stock = quantities('2020-02-01 00:00:00')
+    assert snapshot_time is None
+    assert stock == {'A': 5, 'B': 7}
+
+def test_part_deleted_after_moment_from_later_snapshot(sqlite_storage):
+    stock_with_two_parts(sqlite_storage)
+    # Снимок сделан после удаления B, строки B в нем нет
+    take_snapshot()
+    move_snapshot('2020-03-05 00:00:00')
+    snapshot_time, stock = quantities('2020-02-01 00:00:00')
+    assert snapshot_time == at('2020-03-05 00:00:00')
+    assert stock == {'A': 5, 'B': 7}
+
+def test_part_deleted_before_moment_is_not_listed(sqlite_storage):
+    stock_with_two_parts(sqlite_storage)
+    take_snapshot()
+    move_snapshot('2020-03-05 00:00:00')
+    assert quantities('2020-03-02 00:00:00')[1] == {'A': 5}
+
+def test_moves_after_earlier_snapshot_are_added(sqlite_storage):
+    part = sqlite_storage.parts.create('Фильтр', 'A', 'шт.', 1, 'склад', 5)
+    set_times("UPDATE transactions SET created_at = '2020-01-10 10:00:00'")
+    take_snapshot()
+    move_snapshot('2020-01-11 00:00:00')
+    sqlite_storage.ledger.move(part.id, 'склад', -2)
+    sqlite_storage.ledger.move(part.id, 'цех', 4)
+    set_times("UPDATE transactions SET created_at = '2020-01-12 10:00:00' WHERE created_at > '2020-01-11'")
+    sqlite_storage.ledger.move(part.id, 'склад', 1)
+    set_times("UPDATE transactions SET created_at = '2020-01-20 10:00:00' WHERE created_at > '2020-01-13'")
+
+    snapshot_time, stock = quantities('2020-01-13 00:00:00')
+    assert snapshot_time == at('2020-01-11 00:00:00')
+    assert stock == {'A': 7}
+
+def test_prune_keeps_first_snapshot_of_each_month(sqlite_storage):
+    sqlite_storage.parts.create('Фильтр', 'A', 'шт.', 1, 'склад', 5)
+    for taken_at in ('2020-01-05 00:00:00', '2020-01-20 00:00:00', '2020-02-03 00:00:00', '2020-02-10 00:00:00'):
+        set_times('INSERT INTO stock_snapshot_runs (taken_at, last_transaction_id) VALUES (?, 1)', taken_at)
+        set_times('INSERT INTO stock_snapshots (part_id, quantity, taken_at) VALUES (1, 5, ?)', taken_at)
+    fresh = take_snapshot()
+
+    assert prune_snapshots(keep_days=30) == 2
+    conn = get_db_connection()
+    runs = [row[0] for row in conn.execute('SELECT taken_at FROM stock_snapshot_runs ORDER BY taken_at')]
+    assert runs == ['2020-01-05 00:00:00', '2020-02-03 00:00:00', fresh]
+    assert conn.execute('SELECT COUNT(*) FROM stock_snapshots').fetchone()[0] == 3
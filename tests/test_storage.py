@@ -0,0 +1,121 @@
+from datetime import timedelta
+import pytest
+from database import get_db_connection
+from storage import PartNumberTaken, DuplicateUpdate, MemoryStorage
+
+def age_processed_updates(storage, days: int):
+    """Сдвигает время проведения всех отмеченных update_id на days дней назад"""
+    if isinstance(storage, MemoryStorage):
+        for update_id, processed_at in storage.processed_updates.items():
+            storage.processed_updates[update_id] = processed_at - timedelta(days=days)
+        return
+    conn = get_db_connection()
+    conn.execute(f"UPDATE processed_updates SET processed_at = datetime(processed_at, '-{days} days')")
+    conn.commit()
+
+def test_create_rejects_taken_part_number(any_storage):
+    any_storage.parts.create('Фильтр', 'A-1', 'шт.', 1, 'склад', 5)
+    with pytest.raises(PartNumberTaken):
+        any_storage.parts.create('Фильтр 2', 'A-1', 'шт.', 1, 'склад', 1)
+    assert any_storage.parts.count() == 1
+
+def test_update_rejects_taken_part_number(any_storage):
+    any_storage.parts.create('Фильтр', 'A-1', 'шт.', 1, 'склад', 5)
+    part = any_storage.parts.create('Ремень', 'B-1', 'шт.', 1, 'склад', 5)
+    with pytest.raises(PartNumberTaken):
+        any_storage.parts.update(part.id, 'part_number', 'A-1')
+    assert any_storage.parts.get(part.id).part_number == 'B-1'
+    # Свой же код - не конфликт
+    any_storage.parts.update(part.id, 'part_number', 'B-1')
+
+def test_deleted_part_number_can_be_reused(any_storage):
+    part = any_storage.parts.create('Фильтр', 'A-1', 'шт.', 1, 'склад', 5)
+    any_storage.parts.delete(part.id)
+    other = any_storage.parts.create('Ремень', 'B-1', 'шт.', 1, 'склад', 5)
+    any_storage.parts.update(other.id, 'part_number', 'A-1')
+    assert any_storage.parts.get_by_number('A-1').id == other.id
+
+def test_part_created_without_stock_is_listed_in_its_location(any_storage):
+    part = any_storage.parts.create('Фильтр', 'A-1', 'шт.', 1, 'цех', 0)
+    assert any_storage.parts.count('цех') == 1
+    assert [row.id for row in any_storage.parts.page('цех')] == [part.id]
+    assert any_storage.parts.count('склад') == 0
+
+def test_repeated_update_id_is_not_applied_twice(any_storage):
+    part = any_storage.parts.create('Фильтр', 'A-1', 'шт.', 1, 'склад', 5)
+    any_storage.ledger.move(part.id, 'склад', 3, update_id=100)
+    with pytest.raises(DuplicateUpdate):
+        any_storage.ledger.move(part.id, 'склад', 3, update_id=100)
+    with pytest.raises(DuplicateUpdate):
+        any_storage.ledger.transfer(part.id, 'склад', 'цех', 1, update_id=100)
+    assert any_storage.parts.get(part.id).quantity == 8
+    assert any_storage.ledger.count() == 2
+
+def test_failed_transfer_does_not_claim_update_id(any_storage):
+    part = any_storage.parts.create('Фильтр', 'A-1', 'шт.', 1, 'склад', 5)
+    assert not any_storage.ledger.transfer(part.id, 'склад', 'цех', 50, update_id=100)
+    assert any_storage.ledger.transfer(part.id, 'склад', 'цех', 2, update_id=100)
+    assert any_storage.parts.location_quantity(part.id, 'цех') == 2
+
+def test_old_update_ids_are_pruned(any_storage):
+    part = any_storage.parts.create('Фильтр', 'A-1', 'шт.', 1, 'склад', 5)
+    any_storage.ledger.move(part.id, 'склад', 1, update_id=100)
+    age_processed_updates(any_storage, 10)
+    any_storage.ledger.move(part.id, 'склад', 1, update_id=101)
+    assert any_storage.ledger.prune_processed_updates(keep_days=7) == 1
+    # Забытый update_id проводится снова, свежий - нет
+    any_storage.ledger.move(part.id, 'склад', 1, update_id=100)
+    with pytest.raises(DuplicateUpdate):
+        any_storage.ledger.move(part.id, 'склад', 1, update_id=101)
+
+def parts_in_two_locations(storage):
+    """Ремень 2 на складе, Фильтр 10 на складе и 3 в цехе, Свеча 8 в цехе; min_stock 5"""
+    parts = storage.parts
+    belt = parts.create('Ремень', 'B-1', 'шт.', 5, 'склад', 2)
+    filter_ = parts.create('Фильтр', 'A-1', 'шт.', 5, 'склад', 10)
+    storage.ledger.transfer(filter_.id, 'склад', 'цех', 3)
+    plug = parts.create('Свеча', 'C-1', 'шт.', 5, 'цех', 8)
+    return belt, filter_, plug
+
+def names(rows):
+    return [row.name for row in rows]
+
+def test_pages_by_name(any_storage):
+    belt, filter_, plug = parts_in_two_locations(any_storage)
+    parts = any_storage.parts
+    # Лишняя строка показывает, что есть следующая страница
+    assert names(parts.page(limit=2)) == ['Ремень', 'Свеча', 'Фильтр']
+    assert names(parts.page(after_id=plug.id, limit=2)) == ['Фильтр']
+    assert names(parts.page(before_id=filter_.id, limit=1)) == ['Ремень', 'Свеча']
+    assert [(row.name, row.quantity) for row in parts.page('цех')] == [('Свеча', 8), ('Фильтр', 3)]
+
+def test_totals_low_stock_and_locations(any_storage):
+    parts_in_two_locations(any_storage)
+    parts = any_storage.parts
+    assert tuple(parts.totals()) == (3, 20)
+    assert tuple(parts.totals('цех')) == (2, 11)
+    assert names(parts.low_stock()) == ['Ремень']
+    assert [(row.name, row.quantity) for row in parts.low_stock('цех')] == [('Фильтр', 3)]
+    assert parts.locations() == [('склад', 2, 9), ('цех', 2, 11)]
+
+def test_transfer_keeps_total_quantity(any_storage):
+    _, filter_, _ = parts_in_two_locations(any_storage)
+    ledger, parts = any_storage.ledger, any_storage.parts
+    assert not ledger.transfer(filter_.id, 'цех', 'склад', 4)
+    assert ledger.transfer(filter_.id, 'цех', 'склад', 3)
+    assert parts.location_quantity(filter_.id, 'склад') == 10
+    assert parts.location_quantity(filter_.id, 'цех') == 0
+    assert parts.get(filter_.id).quantity == 10
+
+def test_deleted_part_is_hidden_but_keeps_history(any_storage):
+    belt, filter_, _ = parts_in_two_locations(any_storage)
+    moves = any_storage.ledger.count()
+    any_storage.parts.delete(filter_.id)
+    parts = any_storage.parts
+    assert parts.get(filter_.id) is None
+    assert parts.get_by_number('A-1') is None
+    assert parts.count() == 2 and parts.count('цех') == 1
+    assert tuple(parts.totals()) == (2, 10)
+    assert names(parts.search('Фил')) == []
+    assert parts.locations() == [('склад', 1, 2), ('цех', 1, 8)]
+    assert any_storage.ledger.count() == moves
@@ -0,0 +1,59 @@
+from cache import get_data_version
+from database import get_db_connection
+
+# Сколько позиций показывать в рейтинге по вложенным средствам
+VALUATION_TOP_N = 10
+
+# (версия данных, top_n) -> результат; пересчет только после изменения остатков или цен
+_valuation_cache = {}
+
+def get_valuation(top_n: int = VALUATION_TOP_N) -> dict:
+    """Стоимость склада: итог, разбивка по складам и самые дорогие запасы"""
+    key = (get_data_version(), top_n)
+    if key in _valuation_cache:
+        return _valuation_cache[key]
+
+    cursor = get_db_connection().cursor()
+
+    # Итоги по складам одним агрегирующим проходом по остаткам
+    cursor.execute('''
+    SELECT s.location,
+           SUM(s.quantity * p.price) AS value,
+           COUNT(*) AS positions
+    FROM stock s
+    JOIN live_parts p ON p.id = s.part_id
+    WHERE s.quantity > 0
+    GROUP BY s.location
+    ORDER BY value DESC
+    ''')
+    by_location = cursor.fetchall()
+
+    # Запчасть на нескольких складах - одна позиция без цены, а не по одной на склад.
+    # CROSS JOIN фиксирует порядок: перебираем остатки, parts - по первичному ключу
+    cursor.execute('''
+    SELECT COUNT(DISTINCT p.id)
+    FROM stock s
+    CROSS JOIN live_parts p ON p.id = s.part_id
+    WHERE s.quantity > 0 AND p.price <= 0
+    ''')
+    unpriced = cursor.fetchone()[0]
+
+    # Первые строки индекса idx_parts_value по убыванию стоимости, без сортировки
+    cursor.execute('''
+    SELECT name, part_number, quantity, unit, price, quantity * price AS value
+    FROM live_parts
+    WHERE quantity > 0 AND price > 0
+    ORDER BY quantity * price DESC
+    LIMIT ?
+    ''', (top_n,))
+    top = cursor.fetchall()
+
+    result = {
+        'total_value': sum(row['value'] or 0.0 for row in by_location),
+        'unpriced': unpriced,
+        'by_location': by_location,
+        'top': top,
+    }
+    _valuation_cache.clear()
+    _valuation_cache[key] = result
+    return result